@@ -0,0 +1,62 @@
+"""
+Compare two pytest-benchmark JSON files and fail when a benchmark got slower.
+
+    python benchmarks/compare.py benchmarks/baselines/sqlite-1k.json new.json
+    python benchmarks/compare.py old.json new.json --threshold 0.2 --stat mean
+
+The exit status is 1 when the chosen statistic of any benchmark grew by more than threshold
+(a fraction, 0.1 = 10%). Benchmarks present in only one of the files are listed but never fail;
+a missing baseline file, or two files without a single benchmark in common, exit with status 2.
+"""
+import argparse
+import json
+import os
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return {bench["fullname"]: bench["stats"] for bench in json.load(file)["benchmarks"]}
+
+
+def compare(baseline: dict, current: dict, stat: str, threshold: float) -> list[str]:
+    regressions = []
+    for name in sorted(baseline.keys() | current.keys()):
+        if name not in current or name not in baseline:
+            print(f"{'only in ' + ('baseline' if name in baseline else 'current'):>20}  {name}")
+            continue
+        old, new = baseline[name][stat], current[name][stat]
+        change = (new - old) / old if old else 0.0
+        regressed = change > threshold
+        marker = "REGRESSION" if regressed else ""
+        print(f"{old * 1000:9.3f} ms {new * 1000:9.3f} ms {change:+8.1%}  {name} {marker}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--stat", default="median", choices=["min", "median", "mean", "max"])
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; record one with --benchmark-json (see benchmarks/conftest.py)")
+        return 2
+    baseline, current = load(args.baseline), load(args.current)
+    if not baseline.keys() & current.keys():
+        print(f"{args.baseline} and {args.current} have no benchmark in common")
+        return 2
+
+    regressions = compare(baseline, current, args.stat, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Seeded data sets for the benchmarks.
+
+A data set of size n holds n contacts. The benchmark user (BENCH_EMAIL) owns
+max(1000, n // 100) of them, so it has full 500-row pages even in the smallest set;
+the rest are spread over n // 1000 other users. The same size always gives the same rows.
+SQLite data sets are cached in benchmarks/.data, so the 1M one is only generated once.
+"""
+import pathlib
+import random
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from src.database.models import Base, Contact, Users, birthday_key
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "benchmark"
+DATA_DIR = pathlib.Path(__file__).resolve().parent / ".data"
+BATCH_SIZE = 10_000
+
+NAMES = ["Olena", "Andrii", "Maria", "Oleksandr", "Iryna", "Dmytro", "Natalia", "Serhii", "Yulia", "Taras"]
+SURNAMES = ["Shevchenko", "Bondarenko", "Kovalenko", "Tkachenko", "Kravchenko", "Melnyk", "Boyko", "Koval"]
+
+
+def dataset_url(size: int) -> str:
+    DATA_DIR.mkdir(exist_ok=True)
+    return f"sqlite:///{DATA_DIR / f'contacts-{size}.sqlite'}"
+
+
+def bench_share(size: int) -> int:
+    return min(size, max(1000, size // 100))
+
+
+def _contacts(size: int, owners: list[int], rng: random.Random):
+    start = date(1950, 1, 1)
+    now = datetime(2023, 10, 1)
+    for number in range(size):
+        birthday = start + timedelta(days=rng.randrange(365 * 55))
+        name, surname = rng.choice(NAMES), rng.choice(SURNAMES)
+        yield {
+            "name": name,
+            "surname": surname,
+            "email": f"{name}.{surname}{number}@example.com".lower(),
+            "phone": f"+380{rng.randrange(10 ** 9):09d}",
+            "birthday": birthday,
+            "birthday_key": birthday_key(birthday),
+            "description": rng.choice(["", "work", "family", "met at the conference"]),
+            "created_at": now,
+            "updated_at": now,
+            "user_id": owners[number],
+        }
+
+
+def ensure_dataset(engine, size: int, password_hash: str, seed: int = 42) -> None:
+    """
+    The ensure_dataset function creates the tables and the data set of the given size,
+    unless the database already holds it.
+
+    :param engine: Engine: The database to fill
+    :param size: int: The number of contacts
+    :param password_hash: str: The stored password of the benchmark user
+    :param seed: int: The seed of the random generator
+    :return: None
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        username = conn.execute(select(Users.username).filter_by(email=BENCH_EMAIL)).scalar()
+        if username is not None:
+            if username != f"bench-{size}":
+                raise RuntimeError(f"The database holds the {username} data set, use another one for size {size}")
+            return
+        users = [{"username": f"bench-{size}", "email": BENCH_EMAIL, "password": password_hash, "confirmed": True,
+                  "avatar": ""}]
+        users += [{"username": f"user{number}", "email": f"user{number}@example.com", "password": password_hash,
+                   "confirmed": True, "avatar": ""} for number in range(max(1, size // 1000))]
+        conn.execute(insert(Users), users)
+        ids = conn.execute(select(Users.id).order_by(Users.id)).scalars().all()
+        rng = random.Random(seed)
+        share = bench_share(size)
+        owners = [ids[0]] * share + [rng.choice(ids[1:]) for _ in range(size - share)]
+        rng.shuffle(owners)
+        batch = []
+        for row in _contacts(size, owners, rng):
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                conn.execute(insert(Contact), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(Contact), batch)
+        assert conn.execute(select(func.count()).select_from(Contact)).scalar() == size
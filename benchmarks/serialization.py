@@ -0,0 +1,70 @@
+"""
+Compare the time it takes to turn a page of contacts into a JSON body.
+
+    before     what FastAPI does for response_model=List[ContactResponse]: validate every
+               row from attributes (including EmailStr), jsonable_encoder, then json.dumps
+    validated  the prebuilt List[ContactResponse] TypeAdapter (settings.response_validation)
+    after      the default path of contacts_response: plain dictionaries dumped by orjson
+
+    python benchmarks/serialization.py
+    python benchmarks/serialization.py --rows 500 --repeat 200
+"""
+import argparse
+import json
+import pathlib
+import statistics
+import sys
+import timeit
+from datetime import date, datetime
+
+import orjson
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+from src.database.models import Contact  # noqa: E402
+from src.schemas.contacts import ContactResponse  # noqa: E402
+from src.services.serialization import contact_list_adapter, contact_rows  # noqa: E402
+
+
+def make_page(rows: int) -> list[Contact]:
+    return [
+        Contact(id=i, name=f"Name{i}", surname=f"Surname{i}", email=f"user{i}@example.com", phone="+380501234567",
+                birthday=date(1990, 1 + i % 12, 1 + i % 28), description="Met at the conference",
+                created_at=datetime(2023, 10, 1, 12, 0, 0, 123456), updated_at=datetime(2023, 10, 2, 9, 30))
+        for i in range(rows)
+    ]
+
+
+def before(page):
+    return json.dumps(jsonable_encoder([ContactResponse.model_validate(contact) for contact in page])).encode()
+
+
+def validated(page):
+    return contact_list_adapter.dump_json(contact_list_adapter.validate_python(page, from_attributes=True))
+
+
+def after(page):
+    return orjson.dumps(contact_rows(page))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    page = make_page(args.rows)
+    expected = json.loads(before(page))
+    baseline = None
+    print(f"{args.rows} rows, median of {args.repeat} runs")
+    for fn in (before, validated, after):
+        assert json.loads(fn(page)) == expected, f"{fn.__name__} renders a different body"
+        median = statistics.median(timeit.repeat(lambda: fn(page), number=1, repeat=args.repeat))
+        baseline = baseline or median
+        print(f"{fn.__name__:>10}: {median * 1000:8.2f} ms  x{baseline / median:.1f}")
+
+
+if __name__ == "__main__":
+    main()
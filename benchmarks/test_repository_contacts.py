@@ -0,0 +1,117 @@
+import itertools
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import delete, func, select
+
+from benchmarks.data import bench_share
+from src.database.models import Contact
+from src.repository import contacts as repository_contacts
+from src.schemas.contacts import ContactModel
+
+
+@pytest.fixture(scope="module")
+def sample(bench_engine, bench_user):
+    with bench_engine.connect() as conn:
+        return conn.execute(select(Contact).filter_by(user_id=bench_user.id).order_by(Contact.id)
+                            .offset(bench_share(1000) // 2).limit(1)).one()
+
+
+@pytest.fixture
+def cleanup(bench_engine):
+    with bench_engine.connect() as conn:
+        last_id = conn.execute(select(func.max(Contact.id))).scalar()
+    yield
+    with bench_engine.begin() as conn:
+        conn.execute(delete(Contact).where(Contact.id > last_id))
+
+
+def contact_body(description: str = "") -> ContactModel:
+    return ContactModel(id=0, name="Bench", surname="Mark", email="bench.mark@example.com", phone="+380000000000",
+                        birthday=date(1990, 6, 15), description=description, created_at=datetime(2023, 10, 1),
+                        updated_at=datetime(2023, 10, 1))
+
+
+def test_get_contacts_first_page(run, db, bench_user):
+    assert len(run(repository_contacts.get_contacts, 10, 0, db, bench_user.id)) == 10
+
+
+def test_get_contacts_500_rows(run, db, bench_user):
+    assert len(run(repository_contacts.get_contacts, 500, 0, db, bench_user.id)) == 500
+
+
+def test_get_contacts_deep_offset(run, db, bench_user):
+    run(repository_contacts.get_contacts, 10, bench_share(1000) - 10, db, bench_user.id)
+
+
+def test_get_contacts_keyset(run, db, bench_user, sample):
+    assert run(repository_contacts.get_contacts, 10, 0, db, bench_user.id, sample.id)
+
+
+def test_get_contact_by_id(run, db, bench_user, sample):
+    assert run(repository_contacts.get_contact_by_id, sample.id, db, bench_user.id).id == sample.id
+
+
+def test_get_contact_by_name(run, db, bench_user, sample):
+    assert run(repository_contacts.get_contact_by_name, sample.name, db, bench_user.id)
+
+
+def test_get_contact_by_surname(run, db, bench_user, sample):
+    assert run(repository_contacts.get_contact_by_surname, sample.surname, db, bench_user.id)
+
+
+def test_get_contact_by_email(run, db, bench_user, sample):
+    assert run(repository_contacts.get_contact_by_email, sample.email, db, bench_user.id)
+
+
+@pytest.mark.parametrize("days", [7, 30, 366])
+def test_get_upcoming_birthdays(run, db, bench_user, days):
+    run(repository_contacts.get_upcoming_birthdays, days, db, bench_user.id, date(2023, 12, 20))
+
+
+def test_get_nearly_birthdays(run, db, bench_user):
+    run(repository_contacts.get_nearly_birthdays, db, bench_user.id)
+
+
+@pytest.mark.parametrize("q", ["kov", "olena shev", "+38050"])
+def test_search_contacts(run, db, bench_user, q):
+    run(repository_contacts.search_contacts, q, 20, db, bench_user.id)
+
+
+def test_stream_contacts(run, db, bench_user):
+    async def export():
+        count = 0
+        async for rows in repository_contacts.stream_contacts(db, bench_user.id, 1000):
+            count += len(rows)
+        return count
+
+    assert run(export) >= bench_share(1000)
+
+
+def test_create(run, db, bench_user, cleanup):
+    assert run(repository_contacts.create, contact_body(), db, bench_user.id).id
+
+
+def test_create_many_1000(run, db, bench_user, cleanup):
+    rows = [contact_body().model_dump(exclude={"id", "created_at", "updated_at"}) for _ in range(1000)]
+    assert run(repository_contacts.create_many, rows, db, bench_user.id) == 1000
+
+
+def test_update(run, db, bench_user, sample):
+    counter = itertools.count()
+
+    async def update():
+        return await repository_contacts.update(sample.id, contact_body(f"round {next(counter)}"), db, bench_user.id)
+
+    assert run(update).id == sample.id
+
+
+def test_remove(benchmark, loop, db, bench_user, cleanup):
+    def setup():
+        contact = loop.run_until_complete(repository_contacts.create(contact_body(), db, bench_user.id))
+        return (contact.id, db, bench_user.id), {}
+
+    def remove(*args):
+        return loop.run_until_complete(repository_contacts.remove(*args))
+
+    benchmark.pedantic(remove, setup=setup, rounds=100)
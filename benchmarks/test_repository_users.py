@@ -0,0 +1,59 @@
+import itertools
+
+import pytest
+from sqlalchemy import delete
+
+from benchmarks.data import BENCH_EMAIL
+from src.database.models import Users
+from src.repository import users as repository_users
+from src.schemas.users import UserModel
+
+
+@pytest.fixture
+def user(db):
+    return db.query(Users).filter_by(email=BENCH_EMAIL).one()
+
+
+def test_get_user_by_email(run, db):
+    assert run(repository_users.get_user_by_email, BENCH_EMAIL, db).email == BENCH_EMAIL
+
+
+def test_create_user(run, db, bench_engine):
+    counter = itertools.count()
+
+    async def create():
+        body = UserModel(username="new", email=f"new{next(counter)}@bench.example.com", password="hash")
+        return await repository_users.create_user(body, db)
+
+    try:
+        assert run(create).id
+    finally:
+        with bench_engine.begin() as conn:
+            conn.execute(delete(Users).where(Users.email.like("%@bench.example.com")))
+
+
+def test_update_token(run, db, user):
+    counter = itertools.count()
+
+    async def update():
+        await repository_users.update_token(user, f"token {next(counter)}", db)
+
+    run(update)
+
+
+def test_update_password(run, db, user):
+    password = user.password
+    run(repository_users.update_password, user, password, db)
+
+
+def test_confirmed_email(run, db):
+    run(repository_users.confirmed_email, BENCH_EMAIL, db)
+
+
+def test_update_avatar(run, db):
+    counter = itertools.count()
+
+    async def update():
+        return await repository_users.update_avatar(BENCH_EMAIL, f"/media/avatars/{next(counter)}.png", db)
+
+    assert run(update).email == BENCH_EMAIL
@@ -0,0 +1,121 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+import pytest
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.data import BENCH_EMAIL
+from main import app
+from src.database.db import get_db
+from src.database.models import Contact
+from src.services.auth import auth_service
+from src.services.rate_limit import rate_limiter
+
+BURST_REQUESTS = 200
+BURST_CONCURRENCY = 20
+
+
+@pytest.fixture(scope="module")
+def client(bench_engine, loop):
+    Session = sessionmaker(bind=bench_engine, autoflush=False)
+
+    async def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    limits = rate_limiter.times, rate_limiter.routes
+    rate_limiter.times, rate_limiter.routes = 10 ** 9, {}
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+    token = loop.run_until_complete(auth_service.create_access_token(data={"sub": BENCH_EMAIL}))
+    client.headers["Authorization"] = f"Bearer {token}"
+    yield client
+    loop.run_until_complete(client.aclose())
+    rate_limiter.times, rate_limiter.routes = limits
+    app.dependency_overrides.pop(get_db)
+
+
+@pytest.fixture
+def get(run, client):
+    def get(url, **params):
+        response = run(client.get, url, params=params)
+        assert response.status_code == 200, response.text
+        return response
+
+    return get
+
+
+def test_get_contacts_500(get):
+    get("/api/contact/", limit=500)
+
+
+def test_get_contacts_cursor(get, client, loop):
+    cursor = loop.run_until_complete(client.get("/api/contact/", params={"limit": 10})).headers["X-Next-Cursor"]
+    get("/api/contact/", limit=10, cursor=cursor)
+
+
+def test_search(get):
+    get("/api/contact/search", q="kov")
+
+
+def test_birthdays(get):
+    get("/api/contact/birthdays", days=30)
+
+
+def test_get_contact(get, client, loop):
+    contact_id = loop.run_until_complete(client.get("/api/contact/", params={"limit": 1})).json()[0]["id"]
+    get(f"/api/contact/{contact_id}")
+
+
+def test_users_me(get):
+    get("/api/users/me")
+
+
+def test_create_contact(run, client, bench_engine):
+    with bench_engine.connect() as conn:
+        last_id = conn.execute(select(func.max(Contact.id))).scalar()
+    body = {"id": 0, "name": "Bench", "surname": "Mark", "email": "bench.mark@example.com", "phone": "+380000000000",
+            "birthday": "1990-06-15", "description": "", "created_at": "2023-10-01T00:00:00",
+            "updated_at": "2023-10-01T00:00:00"}
+    try:
+        assert run(client.post, "/api/contact/", json=body).status_code == 201
+    finally:
+        with bench_engine.begin() as conn:
+            conn.execute(delete(Contact).where(Contact.id > last_id))
+
+
+def test_throughput_get_contacts(benchmark, client, loop):
+    """
+    BURST_REQUESTS requests with BURST_CONCURRENCY in flight; the requests per second and
+    the latency percentiles of the last round are saved in extra_info.
+    """
+    latencies = []
+
+    async def one(semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.get("/api/contact/", params={"limit": 50})
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+    async def burst():
+        latencies.clear()
+        semaphore = asyncio.Semaphore(BURST_CONCURRENCY)
+        start = time.perf_counter()
+        await asyncio.gather(*(one(semaphore) for _ in range(BURST_REQUESTS)))
+        return time.perf_counter() - start
+
+    elapsed = benchmark.pedantic(lambda: loop.run_until_complete(burst()), rounds=5, iterations=1)
+    quantiles = statistics.quantiles(latencies, n=100)
+    benchmark.extra_info.update({
+        "requests_per_second": BURST_REQUESTS / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+    })
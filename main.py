@@ -1,35 +1,24 @@
-import time
+import asyncio
 
-import redis.asyncio as redis
 from fastapi import FastAPI, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
 from src.conf.config import settings
-from src.database.db import get_db
-from src.routes import contacts, auth, users
-from fastapi_limiter import FastAPILimiter
+from src.database.db import get_db, execute, replica_router
+from src.database.instrumentation import QueryCounterMiddleware
+from src.routes import contacts, auth, users, admin
+from src.services.auth import auth_service
+from src.services.cache import redis_client, user_cache
+from src.services.email import email_dispatcher
+from src.services.metrics import MetricsMiddleware, registry
+from src.services.rate_limit import rate_limiter
+from src.services.timing import ServerTimingMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
 
-app = FastAPI()
-
-
-@app.middleware('http')
-async def custom_middleware(request: Request, call_next):
-    """
-    The custom_middleware function is a middleware function that adds the time it took to process
-    the request in seconds as a header called 'perfomance'
-
-    :param request: Request: Pass the request object to the middleware function
-    :param call_next: Pass the request to the next middleware in line
-    :return: A response with the performance header
-    :doc-author: ms
-    """
-    start_time = time.time()
-    response = await call_next(request)
-    during = time.time() - start_time
-    response.headers['perfomance'] = str(during)
-    return response
+app = FastAPI(default_response_class=ORJSONResponse)
 
 
 origins = [
@@ -42,7 +31,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "ETag"],
 )
+# Times every request in development and 1% of them in production, unless server_timing_sample_rate is set
+app.add_middleware(ServerTimingMiddleware, sample_rate=settings.server_timing_sample_rate)
+app.add_middleware(QueryCounterMiddleware, n_plus_one_threshold=settings.sql_n_plus_one_threshold)
+app.add_middleware(MetricsMiddleware)
 
 
 @app.on_event("startup")
@@ -50,12 +44,37 @@ async def startup():
     """
     The startup function is called when the application starts up.
     It's a good place to initialize things that are used by the app, such as databases or caches.
+    It starts the user cache listener and its retries of failed invalidations, the task that syncs the rate limiter with Redis,
+    the workers that send the queued emails, the task that shares the metrics with the other workers
+    and the health checks of the read replicas.
     
-    :return: A fastapilimiter object
+    :return: None
+    """
+    app.state.rate_limit_sync = asyncio.create_task(rate_limiter.run())
+    email_dispatcher.start()
+    app.state.metrics_flush = asyncio.create_task(registry.run())
+    app.state.user_cache_listener = asyncio.create_task(user_cache.listen())
+    app.state.user_cache_retries = asyncio.create_task(user_cache.retry_pending())
+    app.state.replica_checks = asyncio.create_task(replica_router.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
     """
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=1, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(r)
+    The shutdown function is called when the application stops.
+    It stops the user cache tasks, the rate limiter sync, the replica checks and the password hashing pool,
+    lets the email workers send what is queued, and closes the connections of the shared Redis pool used by the caches.
+
+    :return: None
+    """
+    app.state.user_cache_listener.cancel()
+    app.state.user_cache_retries.cancel()
+    app.state.rate_limit_sync.cancel()
+    app.state.metrics_flush.cancel()
+    app.state.replica_checks.cancel()
+    auth_service.hasher.shutdown()
+    await email_dispatcher.stop()
+    await redis_client.connection_pool.disconnect()
 
 
 @app.get("/")
@@ -71,7 +90,7 @@ async def root(request: Request):
 
 
 @app.get("/api/healthchecker")
-def healthchecker(db: Session = Depends(get_db)):
+async def healthchecker(db: Session = Depends(get_db)):
     """
     The healthchecker function is a simple function that checks the health of the database.
     It does this by making a request to the database and checking if it returns any results.
@@ -82,7 +101,7 @@ def healthchecker(db: Session = Depends(get_db)):
     """
     try:
         # Make request
-        result = db.execute(text("SELECT 1")).fetchone()
+        result = (await execute(db, text("SELECT 1"))).fetchone()
         if result is None:
             raise HTTPException(status_code=500, detail="Database is not configured correctly")
         return {"message": "Welcome to FastAPI!"}
@@ -91,9 +110,24 @@ def healthchecker(db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail="Error connecting to the database")
 
 
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """
+    The metrics function returns the request, database pool and Redis metrics of all workers
+    in the Prometheus text format.
+
+    :return: The metrics as text
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 app.include_router(auth.router, prefix='/api')
 app.include_router(contacts.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
+app.include_router(admin.router, prefix='/api')
+
+if settings.avatar_storage == "local":
+    app.mount(settings.avatar_media_url, StaticFiles(directory=settings.avatar_media_root), name="media")
 
 # alembic revision --autogenerate -m 'Init'
 
@@ -0,0 +1,51 @@
+"""'Contact user indexes'
+
+Revision ID: 0213d5c306b0
+Revises: b37d1fe50ed4
+Create Date: 2026-10-18 10:12:31.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0213d5c306b0'
+down_revision: Union[str, None] = 'b37d1fe50ed4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COMPOSITE_INDEXES = {
+    'ix_contact_user_id_id': ['user_id', 'id'],
+    'ix_contact_user_id_name': ['user_id', 'name'],
+    'ix_contact_user_id_surname': ['user_id', 'surname'],
+    'ix_contact_user_id_email': ['user_id', 'email'],
+    'ix_contact_user_id_phone': ['user_id', 'phone'],
+}
+
+SINGLE_INDEXES = {
+    'ix_contact_id': ['id'],
+    'ix_contact_name': ['name'],
+    'ix_contact_surname': ['surname'],
+    'ix_contact_email': ['email'],
+    'ix_contact_phone': ['phone'],
+}
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction on Postgres
+    with op.get_context().autocommit_block():
+        for name, columns in COMPOSITE_INDEXES.items():
+            op.create_index(name, 'contact', columns, unique=False, postgresql_concurrently=True)
+        for name in SINGLE_INDEXES:
+            op.drop_index(name, table_name='contact', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, columns in SINGLE_INDEXES.items():
+            op.create_index(name, 'contact', columns, unique=False, postgresql_concurrently=True)
+        for name in COMPOSITE_INDEXES:
+            op.drop_index(name, table_name='contact', postgresql_concurrently=True)
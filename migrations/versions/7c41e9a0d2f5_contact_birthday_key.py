@@ -0,0 +1,39 @@
+"""'Contact birthday key'
+
+Revision ID: 7c41e9a0d2f5
+Revises: 0213d5c306b0
+Create Date: 2026-10-18 11:03:54.271904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c41e9a0d2f5'
+down_revision: Union[str, None] = '0213d5c306b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('contact', sa.Column('birthday_key', sa.Integer(), nullable=True))
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("UPDATE contact SET birthday_key = "
+                   "CAST(strftime('%m', birthday) AS INTEGER) * 100 + CAST(strftime('%d', birthday) AS INTEGER)")
+    else:
+        op.execute("UPDATE contact SET birthday_key = "
+                   "EXTRACT(MONTH FROM birthday) * 100 + EXTRACT(DAY FROM birthday)")
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contact_user_id_birthday_key', 'contact', ['user_id', 'birthday_key'], unique=False,
+                        postgresql_concurrently=True)
+        op.drop_index('ix_contact_birthday', table_name='contact', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contact_birthday', 'contact', ['birthday'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_contact_user_id_birthday_key', table_name='contact', postgresql_concurrently=True)
+    op.drop_column('contact', 'birthday_key')
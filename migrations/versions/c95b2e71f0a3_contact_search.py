@@ -0,0 +1,60 @@
+"""'Contact search'
+
+Revision ID: c95b2e71f0a3
+Revises: 7c41e9a0d2f5
+Create Date: 2026-10-18 12:26:08.913552
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c95b2e71f0a3'
+down_revision: Union[str, None] = '7c41e9a0d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_DOCUMENT = ("coalesce(name, '') || ' ' || coalesce(surname, '') || ' ' || coalesce(email, '') || ' ' || "
+                   "coalesce(phone, '') || ' ' || coalesce(description, '')")
+
+FTS_COLUMNS = "owner, name, surname, email, phone, description"
+FTS_NEW = "new.id, 'u' || new.user_id, new.name, new.surname, new.email, new.phone, new.description"
+FTS_OLD = "'delete', old.id, 'u' || old.user_id, old.name, old.surname, old.email, old.phone, old.description"
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE contact_fts USING fts5("
+                   f"{FTS_COLUMNS}, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')")
+        op.execute(f"INSERT INTO contact_fts(rowid, {FTS_COLUMNS}) "
+                   "SELECT id, 'u' || user_id, name, surname, email, phone, description FROM contact")
+        op.execute("CREATE TRIGGER contact_fts_ai AFTER INSERT ON contact BEGIN "
+                   f"INSERT INTO contact_fts(rowid, {FTS_COLUMNS}) VALUES ({FTS_NEW}); END")
+        op.execute("CREATE TRIGGER contact_fts_ad AFTER DELETE ON contact BEGIN "
+                   f"INSERT INTO contact_fts(contact_fts, rowid, {FTS_COLUMNS}) VALUES ({FTS_OLD}); END")
+        op.execute("CREATE TRIGGER contact_fts_au AFTER UPDATE ON contact BEGIN "
+                   f"INSERT INTO contact_fts(contact_fts, rowid, {FTS_COLUMNS}) VALUES ({FTS_OLD}); "
+                   f"INSERT INTO contact_fts(rowid, {FTS_COLUMNS}) VALUES ({FTS_NEW}); END")
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE EXTENSION IF NOT EXISTS btree_gin")
+    with op.get_context().autocommit_block():
+        op.execute("CREATE INDEX CONCURRENTLY ix_contact_search_tsv ON contact "
+                   f"USING gin (user_id, to_tsvector('simple', {SEARCH_DOCUMENT}))")
+        op.execute("CREATE INDEX CONCURRENTLY ix_contact_search_trgm ON contact "
+                   f"USING gin (user_id, ({SEARCH_DOCUMENT}) gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER contact_fts_au")
+        op.execute("DROP TRIGGER contact_fts_ad")
+        op.execute("DROP TRIGGER contact_fts_ai")
+        op.execute("DROP TABLE contact_fts")
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contact_search_trgm', table_name='contact', postgresql_concurrently=True)
+        op.drop_index('ix_contact_search_tsv', table_name='contact', postgresql_concurrently=True)
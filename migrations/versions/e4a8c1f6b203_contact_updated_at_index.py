@@ -0,0 +1,29 @@
+"""'Contact updated_at index'
+
+Revision ID: e4a8c1f6b203
+Revises: c95b2e71f0a3
+Create Date: 2026-10-18 16:02:44.517309
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a8c1f6b203'
+down_revision: Union[str, None] = 'c95b2e71f0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contact_user_id_updated_at', 'contact', ['user_id', 'updated_at'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contact_user_id_updated_at', table_name='contact', postgresql_concurrently=True)
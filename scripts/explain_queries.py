@@ -0,0 +1,87 @@
+"""
+Print the query plan of every read query in src/repository/contacts.py.
+
+The repository functions are run against the configured database and each
+statement they emit is captured and re-run with EXPLAIN (EXPLAIN QUERY PLAN on SQLite),
+so the plans are those of the exact SQL the application sends.
+
+    python scripts/explain_queries.py --user-id 1
+    python scripts/explain_queries.py --user-id 1 --analyze
+"""
+import argparse
+import asyncio
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, event, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from src.database.db import URI  # noqa: E402
+from src.database.models import Contact  # noqa: E402
+from src.repository import contacts as repository_contacts  # noqa: E402
+
+
+def explain_prefix(dialect: str, analyze: bool) -> str:
+    if dialect == "sqlite":
+        return "EXPLAIN QUERY PLAN "
+    if dialect == "postgresql":
+        return "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    return "EXPLAIN "
+
+
+def repository_calls(sample: Contact | None, user_id: int):
+    name = sample.name if sample else "name"
+    surname = sample.surname if sample else "surname"
+    email = sample.email if sample else "email@example.com"
+    last_id = sample.id if sample else 0
+    return [
+        ("get_contacts (offset)", lambda db: repository_contacts.get_contacts(10, 0, db, user_id)),
+        ("get_contacts (cursor)", lambda db: repository_contacts.get_contacts(10, 0, db, user_id, last_id)),
+        ("get_contact_by_id", lambda db: repository_contacts.get_contact_by_id(last_id, db, user_id)),
+        ("get_contact_by_name", lambda db: repository_contacts.get_contact_by_name(name, db, user_id)),
+        ("get_contact_by_surname", lambda db: repository_contacts.get_contact_by_surname(surname, db, user_id)),
+        ("get_contact_by_email", lambda db: repository_contacts.get_contact_by_email(email, db, user_id)),
+        ("get_nearly_birthdays", lambda db: repository_contacts.get_nearly_birthdays(db, user_id)),
+    ]
+
+
+async def main(user_id: int, analyze: bool) -> None:
+    engine = create_engine(URI)
+    prefix = explain_prefix(engine.dialect.name, analyze)
+    captured = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((statement, parameters))
+
+    with Session(engine) as db:
+        sample = db.execute(select(Contact).filter_by(user_id=user_id).limit(1)).scalars().first()
+        for title, call in repository_calls(sample, user_id):
+            captured.clear()
+            try:
+                await call(db)
+            except Exception as err:
+                print(f"== {title}: skipped ({err.__class__.__name__}: {err})\n")
+                db.rollback()
+                continue
+            event.remove(engine, "before_cursor_execute", capture)
+            try:
+                for statement, parameters in captured:
+                    print(f"== {title}\n{statement}\n")
+                    plan = db.connection().exec_driver_sql(prefix + statement, parameters).fetchall()
+                    for row in plan:
+                        print("   ", " | ".join(str(column) for column in row))
+                    print()
+            finally:
+                event.listen(engine, "before_cursor_execute", capture)
+            db.rollback()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", type=int, default=1, help="owner of the contacts to query")
+    parser.add_argument("--analyze", action="store_true", help="run EXPLAIN ANALYZE on Postgres")
+    args = parser.parse_args()
+    asyncio.run(main(args.user_id, args.analyze))
@@ -0,0 +1,238 @@
+"""
+Fill the database with synthetic users and contacts for load testing.
+
+The same --seed always produces the same rows. Contact counts per user follow a Pareto
+distribution, so a few users own most of the address book, like in production.
+Names repeat with Zipf-like frequencies and in several spellings, phones come in the
+formats people actually type, and birthdays follow a realistic age distribution.
+Rows are written in batches: with COPY on Postgres (psycopg2), with multi-row INSERTs elsewhere.
+
+    python scripts/seed.py --users 5000 --contacts 1000000
+    python scripts/seed.py --url sqlite:///./load.db --create-tables --users 100 --contacts 50000 --seed 7
+"""
+import argparse
+import csv
+import io
+import pathlib
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import create_engine, insert  # noqa: E402
+
+from src.database.db import URI  # noqa: E402
+from src.database.models import Base, Contact, Users, birthday_key  # noqa: E402
+
+# Spelling variants of one name are listed together; earlier names are more frequent
+NAMES = [
+    ("Oleksandr", "Olexandr", "Alexander"), ("Olena", "Elena"), ("Andrii", "Andriy", "Andrew"), ("Maria", "Mariia"),
+    ("Dmytro", "Dmitro"), ("Iryna", "Irina"), ("Serhii", "Sergiy", "Sergey"), ("Natalia", "Nataliia"),
+    ("Mykola", "Nikolai"), ("Yulia", "Yuliia", "Julia"), ("Taras",), ("Oksana",), ("Volodymyr", "Vladimir"),
+    ("Kateryna", "Katerina"), ("Yurii", "Yuriy"), ("Anna", "Hanna"), ("Bohdan", "Bogdan"), ("Sofiia", "Sofia"),
+    ("Maksym", "Maxim"), ("Viktoriia", "Victoria"), ("Ivan",), ("Tetiana", "Tatiana"), ("Roman",), ("Daryna",),
+]
+SURNAMES = [
+    ("Melnyk", "Melnik"), ("Shevchenko",), ("Boyko", "Boiko"), ("Kovalenko",), ("Bondarenko",), ("Tkachenko",),
+    ("Kovalchuk",), ("Kravchenko",), ("Oliinyk", "Oleinik"), ("Shevchuk",), ("Koval",), ("Polishchuk",),
+    ("Bondar",), ("Tkachuk",), ("Moroz",), ("Marchenko",), ("Lysenko",), ("Rudenko",), ("Savchenko",),
+    ("Petrenko",), ("Kravchuk",), ("Pavlenko",), ("Ivanenko",), ("Kuzmenko",), ("Klymenko", "Klimenko"),
+]
+OPERATORS = ["50", "66", "95", "99", "67", "68", "96", "97", "98", "63", "73", "93"]
+PHONE_FORMATS = [
+    "+380{op}{a}{b}{c}", "+380 {op} {a} {b1} {b2}{c}", "0{op}-{a}-{b1}-{b2}{c}", "(0{op}) {a}{b}{c}",
+    "380{op}{a}{b}{c}", "0{op}{a}{b}{c}",
+]
+DOMAINS = ["gmail.com", "ukr.net", "i.ua", "meta.ua", "outlook.com", "example.com"]
+DESCRIPTIONS = ["", "", "", "work", "family", "friend", "neighbour", "met at the conference", "dentist",
+                "football on Saturdays", "call after 18:00"]
+
+COLUMNS = ("user_id", "name", "surname", "phone", "email", "birthday", "birthday_key", "description",
+           "created_at", "updated_at")
+# COPY csv reads an unquoted empty field as NULL; the generated rows have no NULLs, so empty strings stay empty
+NOT_NULL_COLUMNS = ("name", "surname", "phone", "email", "description")
+
+
+def _zipf_weights(count: int) -> list[float]:
+    weights, total = [], 0.0
+    for rank in range(1, count + 1):
+        total += 1 / rank
+        weights.append(total)
+    return weights
+
+
+NAME_WEIGHTS = _zipf_weights(len(NAMES))
+SURNAME_WEIGHTS = _zipf_weights(len(SURNAMES))
+
+
+def contact_counts(rng: random.Random, users: int, contacts: int, alpha: float) -> list[int]:
+    """
+    The contact_counts function splits the contacts over the users with Pareto-distributed weights.
+
+    :param rng: random.Random: The seeded generator
+    :param users: int: The number of users
+    :param contacts: int: The total number of contacts
+    :param alpha: float: The Pareto shape; lower means more skewed
+    :return: The number of contacts of each user, adding up to contacts
+    """
+    weights = [rng.paretovariate(alpha) for _ in range(users)]
+    total = sum(weights)
+    counts = [int(contacts * weight / total) for weight in weights]
+    for index in rng.sample(range(users), contacts - sum(counts)):
+        counts[index] += 1
+    return counts
+
+
+def _name(rng: random.Random, choices: list[tuple], cum_weights: list[float]) -> str:
+    variants = rng.choices(choices, cum_weights=cum_weights)[0]
+    return variants[0] if len(variants) == 1 or rng.random() < 0.8 else rng.choice(variants[1:])
+
+
+def _phone(rng: random.Random) -> str:
+    number = f"{rng.randrange(10 ** 7):07d}"
+    return rng.choice(PHONE_FORMATS).format(op=rng.choice(OPERATORS), a=number[:3], b=number[3:5], c=number[5:],
+                                            b1=number[3], b2=number[4])
+
+
+def _birthday(rng: random.Random, today: date) -> date:
+    age = min(95, max(1, int(rng.gauss(38, 16))))
+    year = today.year - age
+    days = (date(year + 1, 1, 1) - date(year, 1, 1)).days
+    return date(year, 1, 1) + timedelta(days=rng.randrange(days))
+
+
+def generate_users(rng: random.Random, count: int, seed: int, password_hash: str) -> list[dict]:
+    """
+    The generate_users function makes the user rows. Emails are unique per seed.
+
+    :param rng: random.Random: The seeded generator
+    :param count: int: The number of users
+    :param seed: int: The seed, part of the emails so several seeds can share a database
+    :param password_hash: str: The stored password of every user
+    :return: A list of dictionaries with the Users columns
+    """
+    return [{"username": f"{_name(rng, NAMES, NAME_WEIGHTS).lower()}{number}",
+             "email": f"user{number}.s{seed}@example.com",
+             "password": password_hash,
+             "avatar": "",
+             "confirmed": rng.random() < 0.95} for number in range(count)]
+
+
+def generate_contacts(rng: random.Random, owners: list[tuple[int, int]], today: date):
+    """
+    The generate_contacts function yields the contact rows of each owner as tuples in COLUMNS order.
+
+    :param rng: random.Random: The seeded generator
+    :param owners: list[tuple[int, int]]: Pairs of user id and number of contacts
+    :param today: date: The reference date for ages and creation times
+    :return: An iterator over tuples
+    """
+    now = datetime.combine(today, datetime.min.time())
+    for user_id, count in owners:
+        for _ in range(count):
+            name = _name(rng, NAMES, NAME_WEIGHTS)
+            surname = _name(rng, SURNAMES, SURNAME_WEIGHTS)
+            birthday = _birthday(rng, today)
+            created_at = now - timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600))
+            email = f"{name}.{surname}{rng.randrange(1000) if rng.random() < 0.6 else ''}@{rng.choice(DOMAINS)}"
+            yield (user_id, name, surname, _phone(rng), email.lower(), birthday, birthday_key(birthday),
+                   rng.choice(DESCRIPTIONS), created_at, created_at)
+
+
+def _copy(conn, rows: list[tuple]) -> None:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {Contact.__tablename__} ({', '.join(COLUMNS)}) FROM STDIN "
+                           f"WITH (FORMAT csv, FORCE_NOT_NULL ({', '.join(NOT_NULL_COLUMNS)}))", buffer)
+    finally:
+        cursor.close()
+
+
+def write_contacts(conn, rows, batch_size: int) -> int:
+    """
+    The write_contacts function writes the rows batch_size at a time: with COPY on Postgres through psycopg2,
+    with executemany INSERTs (one multi-row statement per batch) on other databases.
+
+    :param conn: Connection: An open connection, inside a transaction
+    :param rows: Iterable[tuple]: Rows in COLUMNS order
+    :param batch_size: int: The number of rows per batch
+    :return: The number of rows written
+    """
+    use_copy = conn.dialect.name == "postgresql" and conn.dialect.driver == "psycopg2"
+    statement = insert(Contact)
+
+    def flush(batch):
+        if use_copy:
+            _copy(conn, batch)
+        else:
+            conn.execute(statement, [dict(zip(COLUMNS, row)) for row in batch])
+
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            flush(batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        flush(batch)
+        written += len(batch)
+    return written
+
+
+def seed(engine, users: int, contacts: int, seed: int = 42, alpha: float = 1.2, batch_size: int = 10_000,
+         password_hash: str = "", today: date = date(2024, 1, 1)) -> tuple[int, int]:
+    """
+    The seed function inserts users and their contacts in one transaction.
+
+    :param engine: Engine: The database to fill
+    :param users: int: The number of users
+    :param contacts: int: The total number of contacts
+    :param seed: int: The seed of the random generator
+    :param alpha: float: The Pareto shape of the contacts per user
+    :param batch_size: int: The number of contacts per batch
+    :param password_hash: str: The stored password of every user
+    :param today: date: The reference date for ages and creation times
+    :return: The numbers of users and contacts written
+    """
+    rng = random.Random(seed)
+    with engine.begin() as conn:
+        user_rows = generate_users(rng, users, seed, password_hash)
+        ids = conn.execute(insert(Users).returning(Users.id, sort_by_parameter_order=True), user_rows).scalars().all()
+        owners = list(zip(ids, contact_counts(rng, users, contacts, alpha)))
+        written = write_contacts(conn, generate_contacts(rng, owners, today), batch_size)
+    return len(ids), written
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=URI, help="database url, defaults to the configured one")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--contacts", type=int, default=100_000, help="total number of contacts")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skew", type=float, default=1.2, help="Pareto shape of contacts per user, lower is more skewed")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--password", default="password", help="password of every generated user")
+    parser.add_argument("--create-tables", action="store_true", help="create missing tables first")
+    args = parser.parse_args(argv)
+
+    from src.services.auth import auth_service
+
+    engine = create_engine(args.url)
+    if args.create_tables:
+        Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    users, contacts = seed(engine, args.users, args.contacts, args.seed, args.skew, args.batch_size,
+                           auth_service.get_password_hash(args.password))
+    elapsed = time.perf_counter() - start
+    print(f"{users} users and {contacts} contacts in {elapsed:.1f} s ({contacts / elapsed:,.0f} contacts/s)")
+
+
+if __name__ == "__main__":
+    main()
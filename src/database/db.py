@@ -1,27 +1,303 @@
-import configparser
-import pathlib
+import inspect
 
-from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+from fastapi import Depends, HTTPException, Request, status
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url, URL
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.exc import DBAPIError, OperationalError, SQLAlchemyError
 
 from src.conf.config import settings
+from src.database.instrumentation import (PoolMonitor, TimedAsyncAdaptedQueuePool, TimedQueuePool,
+                                          instrument_engine)
+from src.database.replicas import ReplicaRouter
+from src.services.cache import redis_client
+from src.services.metrics import instrument_pool
+from src.services.timing import span
 
 URI = settings.sqlalchemy_database_url
 
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
 
-engine = create_engine(URI, echo=True)
-DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+def to_async_url(uri: str) -> URL:
+    """
+    The to_async_url function swaps the driver of a database url for its asyncio counterpart,
+    e.g. postgresql+psycopg2 becomes postgresql+asyncpg and sqlite becomes sqlite+aiosqlite.
+
+    :param uri: str: The sync database url from the settings
+    :return: The url with the async driver
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def pool_options(uri: str) -> dict:
+    """
+    The pool_options function returns the connection pool arguments from the settings for a database url.
+        Every worker opens up to database_pool_size + database_max_overflow connections to each database,
+        so that times the number of workers has to stay below max_connections on the server.
+        SQLite keeps the pool SQLAlchemy picks for it.
+
+    :param uri: str: The database url
+    :return: Keyword arguments for create_engine or create_async_engine
+    """
+    if make_url(uri).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "poolclass": TimedAsyncAdaptedQueuePool if settings.database_async else TimedQueuePool,
+        "pool_size": settings.database_pool_size,
+        "max_overflow": settings.database_max_overflow,
+        "pool_timeout": settings.database_pool_timeout,
+        "pool_recycle": settings.database_pool_recycle,
+        "pool_pre_ping": settings.database_pool_pre_ping,
+    }
+
+
+def _create_engine(uri: str):
+    if settings.database_async:
+        return create_async_engine(to_async_url(uri), echo=settings.database_echo, **pool_options(uri))
+    return create_engine(uri, echo=settings.database_echo, **pool_options(uri))
+
+
+engine = _create_engine(URI)
+if settings.database_async:
+    DBSession = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+else:
+    DBSession = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+replica_engines = {f"replica{number}": _create_engine(url)
+                   for number, url in enumerate(settings.database_replica_urls, 1)}
+
+pool_monitors = {}
+for name, pool_engine in {"primary": engine, **replica_engines}.items():
+    instrument_pool(pool_engine, name)
+    instrument_engine(pool_engine)
+    pool_monitors[name] = PoolMonitor(pool_engine, name)
+
+replica_router = ReplicaRouter(replica_engines, sticky_seconds=settings.database_sticky_seconds,
+                               sticky_size=settings.database_sticky_size,
+                               check_interval=settings.database_replica_check_interval, client=redis_client)
+
+
+class LazySession:
+    """
+    A stand-in for a Session or an AsyncSession that only creates it on first use.
+    A request that never queries, e.g. one whose user came from the cache, creates no session
+    and takes no connection from the pool. FastAPI caches dependencies per request, so every
+    dependency that asks for get_db or get_read_db gets the same LazySession.
+    """
+
+    __slots__ = ("_factory", "_kwargs", "_session", "replica")
+
+    def __init__(self, factory, **kwargs):
+        self._factory = factory
+        self._kwargs = kwargs
+        self._session = None
+        self.replica = None
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._factory(**self._kwargs)
+        return getattr(self._session, name)
+
+
+def is_replica(db) -> bool:
+    """
+    The is_replica function tells whether a session handed out by get_read_db reads from a replica.
+    Responses built from a replica may lag behind the primary, so they must not be cached.
+
+    :param db: Session | AsyncSession | LazySession: The database session
+    :return: True for a session on a replica
+    """
+    return getattr(db, "replica", None) is not None
+
+
+async def identify(request: Request, subject: str) -> None:
+    """
+    The identify function records the user of the request, once the token is verified,
+    and whether they wrote through any worker in the last database_sticky_seconds,
+    in which case get_read_db hands out the primary session.
+
+    :param request: Request: The current request
+    :param subject: str: The token subject (email) of the user
+    :return: None
+    """
+    request.state.subject = subject
+    request.state.sticky = await replica_router.wrote_recently(subject)
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_commit(session):
+    # Read by get_db to send the next reads of the client to the primary
+    session.info["committed"] = True
+
+
+async def _resolve(result):
+    """
+    The _resolve function awaits the result of a session call when the session is an AsyncSession,
+    so the repository code is the same for both the sync and the async engine.
+
+    :param result: The value or awaitable returned by the session
+    :return: The resolved value
+    """
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+async def execute(db, statement, params=None):
+    """
+    The execute function runs a statement on a Session or an AsyncSession.
+
+    :param db: Session | AsyncSession: The database session
+    :param statement: The statement to execute
+    :param params: Optional parameters for the statement
+    :return: The result of the statement
+    """
+    with span("db"):
+        return await _resolve(db.execute(statement, params))
+
+
+async def commit(db) -> None:
+    """
+    The commit function commits the current transaction of a Session or an AsyncSession.
+
+    :param db: Session | AsyncSession: The database session
+    :return: None
+    """
+    with span("db"):
+        await _resolve(db.commit())
+
+
+async def refresh(db, instance) -> None:
+    """
+    The refresh function reloads the attributes of an instance from the database.
+
+    :param db: Session | AsyncSession: The database session
+    :param instance: The ORM object to refresh
+    :return: None
+    """
+    with span("db"):
+        await _resolve(db.refresh(instance))
+
+
+async def delete(db, instance) -> None:
+    """
+    The delete function marks an instance as deleted in a Session or an AsyncSession.
+
+    :param db: Session | AsyncSession: The database session
+    :param instance: The ORM object to delete
+    :return: None
+    """
+    await _resolve(db.delete(instance))
+
+
+async def rollback(db) -> None:
+    """
+    The rollback function rolls back the current transaction of a Session or an AsyncSession.
+
+    :param db: Session | AsyncSession: The database session
+    :return: None
+    """
+    await _resolve(db.rollback())
+
+
+async def close(db) -> None:
+    """
+    The close function closes a Session or an AsyncSession and releases its connection.
+
+    :param db: Session | AsyncSession: The database session
+    :return: None
+    """
+    await _resolve(db.close())
+
+
+async def stream_partitions(db, statement, size: int):
+    """
+    The stream_partitions function runs a select through a server-side cursor and yields
+    the rows size at a time, so the full result is never held in memory.
+        With a sync Session each partition is fetched in the threadpool to keep the event loop free.
+
+    :param db: Session | AsyncSession: The database session
+    :param statement: The select statement
+    :param size: int: The number of rows per partition
+    :return: An async iterator over lists of rows
+    """
+    statement = statement.execution_options(yield_per=size)
+    if hasattr(db, "stream"):
+        result = await db.stream(statement)
+        try:
+            async for partition in result.partitions():
+                yield partition
+        finally:
+            await result.close()
+        return
+    result = await run_in_threadpool(db.execute, statement)
+    partitions = result.partitions()
+    try:
+        while (partition := await run_in_threadpool(next, partitions, None)) is not None:
+            yield partition
+    finally:
+        result.close()
 
 
 # Dependency
-def get_db():
-    db = DBSession()
+async def get_db(request: Request):
+    db = LazySession(DBSession)
+    try:
+        yield db
+    except SQLAlchemyError as err:
+        if db.opened:
+            await rollback(db)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    finally:
+        if db.opened:
+            if db.info.get("committed"):
+                await replica_router.mark_write(getattr(request.state, "subject", None))
+            await close(db)
+
+
+async def get_read_db(request: Request, primary=Depends(get_db)):
+    """
+    The get_read_db function is the dependency of the read-only routes. Its session goes to a replica
+    picked by the replica_router, or is the get_db session when no replica is configured or healthy,
+    or when the current user wrote something in the last database_sticky_seconds.
+        The choice is made when the route first uses the session, once get_current_user has identified the user.
+        A replica whose connection fails during the request is ejected until it passes a health check.
+
+    :param request: Request: Find the current user in request.state
+    :param primary: Session: The session on the primary, used when no replica is picked
+    :return: A session
+    """
+    def open_session():
+        picked = replica_router.pick(getattr(request.state, "sticky", False))
+        if picked is None:
+            return primary
+        db.replica, replica = picked
+        return DBSession(bind=replica)
+
+    db = LazySession(open_session)
     try:
         yield db
     except SQLAlchemyError as err:
-        db.rollback()
+        if db.opened:
+            await rollback(db)
+        if db.replica is not None and (isinstance(err, OperationalError) or
+                                       (isinstance(err, DBAPIError) and err.connection_invalidated)):
+            replica_router.eject(db.replica, err)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     finally:
-        db.close()
+        if db.replica is not None:
+            await close(db)
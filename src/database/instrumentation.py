@@ -0,0 +1,273 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from src.services import metrics
+from src.services.timing import record
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+CHECKOUT_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+db_queries = metrics.registry.histogram("db_queries_per_request", "SQL statements run by one request.",
+                                        ("route",), QUERY_BUCKETS)
+db_time = metrics.registry.histogram("db_time_per_request_seconds", "Time spent in SQL by one request.",
+                                     ("route",), metrics.FAST_BUCKETS)
+db_checkouts = metrics.registry.histogram("db_checkouts_per_request",
+                                         "Connections taken from the pools by one request.", ("route",),
+                                         CHECKOUT_BUCKETS)
+db_pool_wait = metrics.registry.histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection.",
+                                         ("pool",), metrics.FAST_BUCKETS)
+db_pool_timeouts = metrics.registry.counter("db_pool_timeouts_total",
+                                            "Checkouts that gave up after pool_timeout seconds.", ("pool",))
+db_pool_held = metrics.registry.histogram("db_pool_held_seconds", "How long a connection was kept out of the pool.",
+                                          ("pool", "route"), metrics.FAST_BUCKETS)
+db_n_plus_one = metrics.registry.counter("db_n_plus_one_total",
+                                         "Requests that ran the same statement too many times.", ("route",))
+
+
+@dataclass(slots=True)
+class QueryStats:
+    count: int = 0
+    seconds: float = 0.0
+    checkouts: int = 0
+    scope: dict | None = None
+    statements: Counter = field(default_factory=Counter)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """
+        The repeated function returns the statements run at least threshold times,
+        which is what a lazy load inside a loop (N+1) looks like.
+
+        :param self: Represent the instance of the class
+        :param threshold: int: How many runs of one statement are suspicious
+        :return: A list of (statement, count) tuples, most frequent first
+        """
+        return [(statement, count) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _query_done(conn, statement)
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute; it is timed here so its start does not linger
+    if exception_context.connection is not None:
+        _query_done(exception_context.connection, exception_context.statement)
+
+
+def _query_done(conn, statement):
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = _stats.get()
+    if stats is None:
+        return
+    stats.count += 1
+    stats.seconds += elapsed
+    stats.statements[statement] += 1
+    record("sql", elapsed)
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    stats = _stats.get()
+    if stats is not None:
+        stats.checkouts += 1
+
+
+class TimedPool:
+    """
+    A mixin for the queue pools that times how long each checkout waits for a connection,
+    which is what a pool too small for the load looks like, and counts the checkouts that time out.
+    """
+
+    monitor = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            if self.monitor is not None:
+                db_pool_timeouts.inc(self.monitor.name)
+            raise
+        finally:
+            if self.monitor is not None:
+                db_pool_wait.observe(time.perf_counter() - start, self.monitor.name)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.monitor = self.monitor
+        return pool
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+class PoolMonitor:
+    """
+    Keeps track of the connections taken out of the pool of an engine: since when,
+    and by which route, so the admin endpoint can show the ones held for long.
+    """
+
+    def __init__(self, engine, name: str):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.name = name
+        self.held: dict[int, tuple[float, str]] = {}
+        self.engine.pool.monitor = self
+        event.listen(self.engine.pool, "checkout", self._on_checkout)
+        event.listen(self.engine.pool, "checkin", self._on_checkin)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        stats = _stats.get()
+        self.held[id(connection_record)] = (time.perf_counter(), _route_of(stats))
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        started = self.held.pop(id(connection_record), None)
+        if started is not None:
+            db_pool_held.observe(time.perf_counter() - started[0], self.name, started[1])
+
+    def snapshot(self, long_held: float) -> dict:
+        """
+        The snapshot function describes the pool as it is now, in the current worker.
+
+        :param self: Represent the instance of the class
+        :param long_held: float: Connections held at least this many seconds are listed with their route
+        :return: A dictionary for the admin endpoint
+        """
+        pool = self.engine.pool
+        now = time.perf_counter()
+        held = sorted(((now - start, route) for start, route in list(self.held.values())), reverse=True)
+        counts = {name: getattr(pool, attribute)() for name, attribute in
+                  (("size", "size"), ("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow"),
+                   ("timeout", "timeout")) if hasattr(pool, attribute)}
+        return {
+            "name": self.name,
+            "pool": type(pool).__name__,
+            **counts,
+            "wait_seconds": _histogram(db_pool_wait, (self.name,)),
+            "timeouts": db_pool_timeouts.values.get((self.name,), 0),
+            "long_held": [{"route": route, "seconds": round(seconds, 3)} for seconds, route in held
+                          if seconds >= long_held],
+        }
+
+
+def _route_of(stats: QueryStats | None) -> str:
+    if stats is None or stats.scope is None:
+        return "background"
+    return getattr(stats.scope.get("route"), "path", None) or "unmatched"
+
+
+def _histogram(histogram, labels: tuple) -> dict:
+    with histogram.lock:
+        counts = histogram.values.get(labels)
+        counts = list(counts) if counts is not None else None
+    if counts is None:
+        return {"count": 0, "sum": 0.0, "buckets": {}}
+    cumulative, buckets = 0, {}
+    for bound, count in zip(histogram.buckets + (float("inf"),), counts):
+        cumulative += count
+        buckets["+Inf" if bound == float("inf") else repr(bound)] = cumulative
+    return {"count": cumulative, "sum": counts[-1], "buckets": buckets}
+
+
+def instrument_engine(engine) -> None:
+    """
+    The instrument_engine function times every statement the engine runs and adds it,
+    and every connection taken from its pool, to the QueryStats of the request being handled, if any.
+
+    :param engine: Engine | AsyncEngine: The engine to instrument
+    :return: None
+    """
+    engine = getattr(engine, "sync_engine", engine)
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    event.listen(engine.pool, "checkout", _checkout)
+
+
+class QueryCounterMiddleware:
+    """
+    A pure ASGI middleware that counts the SQL statements, the database time and the pool checkouts
+    of each request, logs them and adds them to the metrics. Requests that take no connection are counted
+    with 0 checkouts. A statement that runs n_plus_one_threshold times or more in one request is logged
+    as a warning and counted in db_n_plus_one_total.
+    """
+
+    def __init__(self, app, n_plus_one_threshold: int = 5):
+        self.app = app
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats(scope=scope)
+        token = _stats.set(stats)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _stats.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            db_checkouts.observe(stats.checkouts, route)
+            if stats.count:
+                db_queries.observe(stats.count, route)
+                db_time.observe(stats.seconds, route)
+                logger.debug("%s %s: %s queries in %.2f ms", scope["method"], scope["path"], stats.count,
+                             stats.seconds * 1000)
+                repeated = stats.repeated(self.n_plus_one_threshold)
+                if repeated:
+                    db_n_plus_one.inc(route)
+                    for statement, count in repeated:
+                        logger.warning("Possible N+1 in %s %s: %s runs of %s", scope["method"], scope["path"],
+                                       count, statement)
+
+
+@contextmanager
+def assert_max_queries(engine, limit: int):
+    """
+    The assert_max_queries function is a test helper that fails when the code in the block
+    runs more than limit statements on the engine, from any thread.
+
+        with assert_max_queries(engine, 2):
+            client.get("/api/contact/", headers=headers)
+
+    :param engine: Engine | AsyncEngine: The engine to watch
+    :param limit: int: The number of statements allowed
+    :return: A context manager yielding the list of statements run so far
+    """
+    engine = getattr(engine, "sync_engine", engine)
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "after_cursor_execute", count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "after_cursor_execute", count)
+    if len(statements) > limit:
+        raise AssertionError(f"{len(statements)} queries were run, at most {limit} expected:\n" +
+                             "\n".join(statements))
@@ -1,23 +1,54 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, func, Date, Boolean
-from sqlalchemy.orm import relationship, declarative_base
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, func, Date, Boolean, Index, DDL, event
+from sqlalchemy.orm import relationship, declarative_base, validates, backref
 
 Base = declarative_base()
 
 
+def birthday_key(birthday):
+    """
+    The birthday_key function maps a date to month * 100 + day, so birthdays sort by day of year
+    regardless of the birth year and an upcoming-birthdays window is a plain range on an index.
+
+    :param birthday: date | None: The birthday
+    :return: The day-of-year key, e.g. 1231 for December 31
+    """
+    if birthday is None:
+        return None
+    return birthday.month * 100 + birthday.day
+
+
 class Contact(Base):
     __tablename__ = "contact"
-    id = Column(Integer, primary_key=True, index=True)
+    # Every lookup is scoped to one user, so the indexes lead with user_id
+    __table_args__ = (
+        Index("ix_contact_user_id_id", "user_id", "id"),
+        Index("ix_contact_user_id_name", "user_id", "name"),
+        Index("ix_contact_user_id_surname", "user_id", "surname"),
+        Index("ix_contact_user_id_email", "user_id", "email"),
+        Index("ix_contact_user_id_phone", "user_id", "phone"),
+        Index("ix_contact_user_id_birthday_key", "user_id", "birthday_key"),
+        # max(updated_at) per user is the version behind the ETag of the contact list
+        Index("ix_contact_user_id_updated_at", "user_id", "updated_at"),
+    )
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, default=1)
-    user = relationship("Users", backref="contact")
-    name = Column(String, index=True)
-    surname = Column(String, index=True)
-    phone = Column(String, index=True)
-    email = Column(String, index=True)
-    birthday = Column(Date, index=True)
+    # Lazy loads are refused so a loop over contacts can't turn into one query per row
+    user = relationship("Users", backref=backref("contact", lazy="raise_on_sql"), lazy="raise_on_sql")
+    name = Column(String)
+    surname = Column(String)
+    phone = Column(String)
+    email = Column(String)
+    birthday = Column(Date)
+    birthday_key = Column(Integer)
     description = Column(String)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
 
+    @validates("birthday")
+    def validate_birthday(self, key, value):
+        self.birthday_key = birthday_key(value)
+        return value
+
 
 class Users(Base):
     __tablename__ = 'users'
@@ -28,3 +59,44 @@ class Users(Base):
     refresh_token = Column(String(255), nullable=True)
     avatar = Column(String(255), nullable=True)
     confirmed = Column(Boolean, default=False)
+
+
+# Text that GET /api/contact/search matches against. On Postgres the query must repeat this exact
+# expression for the planner to use the GIN indexes below, so it is kept as literal SQL.
+SEARCH_DOCUMENT = ("coalesce(name, '') || ' ' || coalesce(surname, '') || ' ' || coalesce(email, '') || ' ' || "
+                   "coalesce(phone, '') || ' ' || coalesce(description, '')")
+
+SEARCH_DDL = {
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE EXTENSION IF NOT EXISTS btree_gin",
+        f"CREATE INDEX IF NOT EXISTS ix_contact_search_tsv ON contact "
+        f"USING gin (user_id, to_tsvector('simple', {SEARCH_DOCUMENT}))",
+        f"CREATE INDEX IF NOT EXISTS ix_contact_search_trgm ON contact "
+        f"USING gin (user_id, ({SEARCH_DOCUMENT}) gin_trgm_ops)",
+    ],
+    # Contentless FTS5 index; owner holds 'u<user_id>' so the per-user filter is part of the MATCH
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS contact_fts USING fts5("
+        "owner, name, surname, email, phone, description, "
+        "content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+        "CREATE TRIGGER IF NOT EXISTS contact_fts_ai AFTER INSERT ON contact BEGIN "
+        "INSERT INTO contact_fts(rowid, owner, name, surname, email, phone, description) "
+        "VALUES (new.id, 'u' || new.user_id, new.name, new.surname, new.email, new.phone, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS contact_fts_ad AFTER DELETE ON contact BEGIN "
+        "INSERT INTO contact_fts(contact_fts, rowid, owner, name, surname, email, phone, description) "
+        "VALUES ('delete', old.id, 'u' || old.user_id, old.name, old.surname, old.email, old.phone, "
+        "old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS contact_fts_au AFTER UPDATE ON contact BEGIN "
+        "INSERT INTO contact_fts(contact_fts, rowid, owner, name, surname, email, phone, description) "
+        "VALUES ('delete', old.id, 'u' || old.user_id, old.name, old.surname, old.email, old.phone, "
+        "old.description); "
+        "INSERT INTO contact_fts(rowid, owner, name, surname, email, phone, description) "
+        "VALUES (new.id, 'u' || new.user_id, new.name, new.surname, new.email, new.phone, new.description); END",
+    ],
+}
+
+for _dialect, _statements in SEARCH_DDL.items():
+    for _statement in _statements:
+        event.listen(Contact.__table__, "after_create", DDL(_statement).execute_if(dialect=_dialect))
+event.listen(Contact.__table__, "before_drop", DDL("DROP TABLE IF EXISTS contact_fts").execute_if(dialect="sqlite"))
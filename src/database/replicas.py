@@ -0,0 +1,189 @@
+import asyncio
+import itertools
+import logging
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+
+from src.services import metrics
+from src.services.cache import TTLCache
+from src.services.metrics import redis_timer
+
+logger = logging.getLogger(__name__)
+
+db_reads = metrics.registry.counter("db_reads_total", "Read-only sessions by where they were sent.", ("target",))
+db_replicas_healthy = metrics.registry.gauge("db_replicas_healthy", "Replicas currently taking reads.")
+
+
+def _ping_sync(engine) -> None:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def ping(engine, timeout: float) -> bool:
+    """
+    The ping function checks that a database answers a trivial query within timeout seconds.
+
+    :param engine: Engine | AsyncEngine: The database to check
+    :param timeout: float: Seconds to wait for the answer
+    :return: True when the database answered
+    """
+    try:
+        if isinstance(engine, AsyncEngine):
+            async def probe():
+                async with engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+
+            await asyncio.wait_for(probe(), timeout)
+        else:
+            await asyncio.wait_for(run_in_threadpool(_ping_sync, engine), timeout)
+    except (SQLAlchemyError, OSError, asyncio.TimeoutError):
+        return False
+    return True
+
+
+class ReplicaRouter:
+    """
+    Picks the database for a read-only session: the healthy replicas in turn, or the primary
+    when there are none, when all of them are ejected, or for a user who wrote in the last sticky_seconds,
+    so they read their own writes despite the replication lag, from any token, device or worker.
+
+    A replica is ejected as soon as a session on it loses its connection, and by the check that pings
+    every replica each check_interval seconds; the same check lets it back in once it answers again.
+    Recent writes are keyed by the token subject (email) of the user and kept in Redis with a sticky_seconds
+    TTL, so every worker sees them, and in a local cache that spares the worker that took the write a round trip.
+    When Redis cannot be asked, reads go to the primary, which is never stale.
+    """
+
+    prefix = "sticky:"
+
+    def __init__(self, engines: dict, sticky_seconds: float, sticky_size: int, check_interval: float,
+                 check_timeout: float = 2, client: redis.Redis | None = None):
+        self.engines = engines
+        self.healthy = list(engines)
+        self.sticky_seconds = sticky_seconds
+        self.recent_writes = TTLCache(sticky_size, sticky_seconds)
+        self.client = client
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self._turn = itertools.count()
+        db_replicas_healthy.set(len(self.healthy))
+
+    def key(self, subject: str) -> str:
+        return f"{self.prefix}{subject}"
+
+    async def wrote_recently(self, subject: str | None) -> bool:
+        """
+        The wrote_recently function tells whether a user wrote through any worker in the last sticky_seconds.
+        It costs nothing when no replica is configured.
+
+        :param self: Represent the instance of the class
+        :param subject: str | None: The token subject of the user, None for anonymous requests
+        :return: True when the reads of the user must go to the primary
+        """
+        if subject is None or not self.engines:
+            return False
+        if self.recent_writes.get(subject):
+            return True
+        if self.client is None:
+            return False
+        try:
+            with redis_timer("replica_sticky_get"):
+                return bool(await self.client.exists(self.key(subject)))
+        except RedisError as err:
+            logger.warning("Reading the recent writes of %s failed, reading from the primary: %s", subject, err)
+            return True
+
+    def pick(self, sticky: bool = False):
+        """
+        The pick function chooses where the next read-only session of a user goes.
+
+        :param self: Represent the instance of the class
+        :param sticky: bool: Whether the user wrote recently, see wrote_recently
+        :return: The name and engine of a replica, or None for the primary
+        """
+        if not self.healthy:
+            if self.engines:
+                db_reads.inc("primary")
+            return None
+        if sticky:
+            db_reads.inc("sticky")
+            return None
+        name = self.healthy[next(self._turn) % len(self.healthy)]
+        db_reads.inc("replica")
+        return name, self.engines[name]
+
+    async def mark_write(self, subject: str | None) -> None:
+        """
+        The mark_write function sends the reads of a user to the primary, on every worker, for the next sticky_seconds.
+
+        :param self: Represent the instance of the class
+        :param subject: str | None: The token subject of the user; anonymous writes are not tracked
+        :return: None
+        """
+        if subject is None or not self.engines:
+            return
+        self.recent_writes.set(subject, True)
+        if self.client is None:
+            return
+        try:
+            with redis_timer("replica_sticky_set"):
+                await self.client.set(self.key(subject), 1, px=max(1, int(self.sticky_seconds * 1000)))
+        except RedisError as err:
+            logger.warning("Recording the write of %s failed, other workers may read from a replica: %s",
+                           subject, err)
+
+    def eject(self, name: str, reason) -> None:
+        """
+        The eject function stops sending reads to a replica until the health check finds it answering again.
+
+        :param self: Represent the instance of the class
+        :param name: str: The name of the replica
+        :param reason: Why it is ejected, for the log
+        :return: None
+        """
+        if name in self.healthy:
+            self.healthy.remove(name)
+            db_replicas_healthy.set(len(self.healthy))
+            logger.warning("Replica %s ejected: %s", name, reason)
+
+    async def check(self) -> None:
+        """
+        The check function pings every replica, ejecting the ones that do not answer
+        and taking back the ones that do. The order of the replicas is kept, so the rotation stays fair.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        results = await asyncio.gather(*(ping(engine, self.check_timeout) for engine in self.engines.values()))
+        for name, ok in zip(self.engines, results):
+            if not ok:
+                self.eject(name, "health check failed")
+            elif name not in self.healthy:
+                logger.info("Replica %s is back", name)
+        self.healthy = [name for name, ok in zip(self.engines, results) if ok]
+        db_replicas_healthy.set(len(self.healthy))
+
+    async def run(self) -> None:
+        """
+        The run function checks the replicas every check_interval seconds for the lifetime of the worker.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if not self.engines:
+            return
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check()
+
+    def stats(self) -> dict:
+        return {
+            "replicas": list(self.engines),
+            "healthy": list(self.healthy),
+            "sticky_clients": len(self.recent_writes),
+        }
@@ -1,24 +1,81 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, func
+import re
+from datetime import date, timedelta
 
-from src.database.models import Contact
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import String, bindparam, case, column, desc, func, insert, literal_column, or_, select, table
+
+from src.database import db as database
+from src.database.models import Contact, birthday_key, SEARCH_DOCUMENT
 from src.schemas.contacts import ContactModel
+from src.services.cache import response_cache
+
+
+def _page_stmt(limit: int, offset: int, user_id: int, after_id: int | None):
+    stmt = select(Contact).filter_by(user_id=user_id).order_by(Contact.user_id, Contact.id).limit(limit)
+    if after_id is not None:
+        return stmt.filter(Contact.id > after_id)
+    return stmt.offset(offset)
+
 
+def _version_stmt(user_id: int):
+    return select(func.max(Contact.updated_at), func.count()).where(Contact.user_id == user_id)
 
-async def get_contacts(limit: int, offset: int, db: Session, user_id: int):
+
+async def get_contacts(limit: int, offset: int, db: Session, user_id: int, after_id: int | None = None):
     """
-    The get_contacts function returns a list of contacts from the database.
+    The get_contacts function returns a list of contacts from the database ordered by (user_id, id).
+    When after_id is given the page starts right after that contact (keyset pagination),
+    which is an index seek instead of skipping offset rows.
 
     :param limit: int: Limit the number of contacts returned
     :param offset: int: Specify the number of records to skip before returning results
     :param db: Session: Pass the database session to the function
     :param user_id: int: Filter the contacts by user_id
+    :param after_id: int | None: Return only contacts with an id greater than this one
     :return: A list of contacts
     """
-    contacts = db.query(Contact).filter_by(user_id=user_id).limit(limit).offset(offset).all()
+    contacts = (await database.execute(db, _page_stmt(limit, offset, user_id, after_id))).scalars().all()
     return contacts
 
 
+async def get_contacts_version(db: Session, user_id: int):
+    """
+    The get_contacts_version function returns (max(updated_at), count) of the contacts of a user.
+        Any create, update or delete changes one of the two, so it identifies the state of the address book
+        without reading it; both come from the (user_id, updated_at) index.
+
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: Filter the contacts by user_id
+    :return: A tuple of the latest updated_at, or None, and the number of contacts
+    """
+    latest, count = (await database.execute(db, _version_stmt(user_id))).one()
+    return latest, count
+
+
+async def get_contacts_with_version(limit: int, offset: int, db: Session, user_id: int,
+                                    after_id: int | None = None):
+    """
+    The get_contacts_with_version function returns a page like get_contacts together with what
+    get_contacts_version would return, in one statement: the version is added as two uncorrelated
+    scalar subqueries, which the database evaluates once and not per row.
+
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Specify the number of records to skip before returning results
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: Filter the contacts by user_id
+    :param after_id: int | None: Return only contacts with an id greater than this one
+    :return: A list of contacts and the version, which is None when the page is empty
+    """
+    other = aliased(Contact)
+    stmt = _page_stmt(limit, offset, user_id, after_id).add_columns(
+        select(func.max(other.updated_at)).where(other.user_id == user_id).scalar_subquery(),
+        select(func.count()).select_from(other).where(other.user_id == user_id).scalar_subquery())
+    rows = (await database.execute(db, stmt)).all()
+    if not rows:
+        return [], None
+    return [row[0] for row in rows], (rows[0][1], rows[0][2])
+
+
 async def get_contact_by_id(contact_id: int, db: Session, user_id: int):
     """
     The get_contact_by_id function takes in a contact_id and user_id, then returns the contact with that id.
@@ -32,7 +89,8 @@ async def get_contact_by_id(contact_id: int, db: Session, user_id: int):
     :param user_id: int: Filter the contacts by user_id
     :return: A contact object that matches the id and user_id passed in
     """
-    contact = db.query(Contact).filter_by(id=contact_id).filter_by(user_id=user_id).first()
+    stmt = select(Contact).filter_by(id=contact_id).filter_by(user_id=user_id)
+    contact = (await database.execute(db, stmt)).scalars().first()
     return contact
 
 
@@ -49,7 +107,8 @@ async def get_contact_by_name(name: str, db: Session, user_id: int):
     :param user_id: int: Filter the contacts by user_id
     :return: A list of contacts
     """
-    contacts = db.query(Contact).filter_by(name=name).filter_by(user_id=user_id).all()
+    stmt = select(Contact).filter_by(name=name).filter_by(user_id=user_id)
+    contacts = (await database.execute(db, stmt)).scalars().all()
     return contacts
 
 
@@ -63,7 +122,8 @@ async def get_contact_by_surname(surname: str, db: Session, user_id: int):
     :param user_id: int: Filter the contacts by user_id
     :return: A list of contacts with the given surname
     """
-    contacts = db.query(Contact).filter_by(surname=surname).filter_by(user_id=user_id).all()
+    stmt = select(Contact).filter_by(surname=surname).filter_by(user_id=user_id)
+    contacts = (await database.execute(db, stmt)).scalars().all()
     return contacts
 
 
@@ -77,10 +137,41 @@ async def get_contact_by_email(email: str, db: Session, user_id: int):
     :param user_id: int: Filter the contact by user_id
     :return: The contact with the specified email address
     """
-    contact = db.query(Contact).filter_by(email=email).filter_by(user_id=user_id).first()
+    stmt = select(Contact).filter_by(email=email).filter_by(user_id=user_id)
+    contact = (await database.execute(db, stmt)).scalars().first()
     return contact
 
 
+async def get_upcoming_birthdays(days: int, db: Session, user_id: int, today: date | None = None):
+    """
+    The get_upcoming_birthdays function returns the contacts whose birthdays fall within the given number of days
+    from today, today included, ordered by how soon the birthday comes.
+        The window is a range on the stored birthday_key (month * 100 + day), so it is served by the
+        (user_id, birthday_key) index; a window that crosses the end of the year becomes two ranges.
+
+    :param days: int: The length of the window in days
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: Filter the contacts by user_id
+    :param today: date | None: The first day of the window, defaults to the current date
+    :return: A list of contacts
+    """
+    today = today or date.today()
+    start = birthday_key(today)
+    stmt = select(Contact).filter_by(user_id=user_id)
+    if days < 365:
+        end_day = today + timedelta(days=days)
+        end = birthday_key(end_day)
+        if end_day.year == today.year:
+            stmt = stmt.filter(Contact.birthday_key.between(start, end))
+        else:
+            stmt = stmt.filter(or_(Contact.birthday_key >= start, Contact.birthday_key <= end))
+    else:
+        stmt = stmt.filter(Contact.birthday_key.is_not(None))
+    stmt = stmt.order_by(case((Contact.birthday_key < start, 1), else_=0), Contact.birthday_key, Contact.id)
+    contacts = (await database.execute(db, stmt)).scalars().all()
+    return contacts
+
+
 async def get_nearly_birthdays(db: Session, user_id: int):
     """
     The get_nearly_birthdays function returns a list of contacts whose birthdays are within 7 days from the current date.
@@ -90,13 +181,92 @@ async def get_nearly_birthdays(db: Session, user_id: int):
     :param user_id: int: Filter the contacts by user_id
     :return: All contacts that have a birthday in the next 7 days
     """
-    contact = db.query(Contact) \
-        .select_from(Contact) \
-        .filter_by(user_id=user_id) \
-        .filter(and_(func.date_part('day', Contact.birthday) - func.date_part('day', func.current_date()) <= 7,
-                     func.date_part('month', Contact.birthday) == func.date_part('month', func.current_date()))) \
-        .all()
-    return contact
+    return await get_upcoming_birthdays(7, db, user_id)
+
+
+def _search_terms(q: str) -> list[str]:
+    """
+    The _search_terms function splits a search string into word tokens, dropping any characters
+    that have a meaning in the full-text query syntax.
+
+    :param q: str: The search string
+    :return: A list of terms
+    """
+    return re.findall(r"\w+", q.lower())
+
+
+def _postgres_search(q: str, terms: list[str], limit: int, user_id: int):
+    document = literal_column(f"({SEARCH_DOCUMENT})")
+    text = bindparam("search_text", q, type_=String)
+    vector = func.to_tsvector(literal_column("'simple'"), document)
+    query = func.to_tsquery(literal_column("'simple'"),
+                            bindparam("search_query", " & ".join(f"{term}:*" for term in terms), type_=String))
+    rank = func.ts_rank(vector, query) + func.word_similarity(text, document)
+    return select(Contact) \
+        .filter(Contact.user_id == user_id) \
+        .filter(or_(vector.op("@@")(query), document.op("%>")(text))) \
+        .order_by(desc(rank), Contact.id) \
+        .limit(limit)
+
+
+def _sqlite_search(terms: list[str], limit: int, user_id: int):
+    fts = table("contact_fts", column("rowid"))
+    match = f'owner : u{user_id} AND {{name surname email phone description}} : (' + \
+            " ".join(f'"{term}"*' for term in terms) + ")"
+    rank = func.bm25(literal_column("contact_fts"), 0.0, 10.0, 10.0, 5.0, 5.0, 1.0)
+    return select(Contact) \
+        .join(fts, fts.c.rowid == Contact.id) \
+        .filter(literal_column("contact_fts").op("MATCH")(match)) \
+        .filter(Contact.user_id == user_id) \
+        .order_by(rank, Contact.id) \
+        .limit(limit)
+
+
+async def search_contacts(q: str, limit: int, db: Session, user_id: int):
+    """
+    The search_contacts function ranks the contacts of a user against a free-text query
+    over name, surname, email, phone and description.
+        Every word of the query is matched as a prefix. On Postgres the full-text match is combined
+        with pg_trgm word similarity, so misspelled words still match; both are served by GIN indexes
+        that lead with user_id. On SQLite the contact_fts FTS5 table is used and ranked by bm25.
+
+    :param q: str: The search string
+    :param limit: int: The maximum number of contacts returned
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: Filter the contacts by user_id
+    :return: A list of contacts, best match first
+    """
+    terms = _search_terms(q)
+    if not terms:
+        return []
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        stmt = _postgres_search(q, terms, limit, user_id)
+    elif dialect == "sqlite":
+        stmt = _sqlite_search(terms, limit, user_id)
+    else:
+        raise NotImplementedError(f"Contact search is not supported on {dialect}")
+    contacts = (await database.execute(db, stmt)).scalars().all()
+    return contacts
+
+
+EXPORT_COLUMNS = (Contact.id, Contact.name, Contact.surname, Contact.email, Contact.phone, Contact.birthday,
+                  Contact.description, Contact.created_at, Contact.updated_at)
+
+
+async def stream_contacts(db: Session, user_id: int, batch_size: int):
+    """
+    The stream_contacts function yields all contacts of a user in (user_id, id) order, batch_size rows at a time.
+    Plain rows are fetched instead of ORM objects, so nothing accumulates in the session.
+
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: Filter the contacts by user_id
+    :param batch_size: int: The number of rows fetched per round trip
+    :return: An async iterator over lists of rows with the EXPORT_COLUMNS fields
+    """
+    stmt = select(*EXPORT_COLUMNS).filter_by(user_id=user_id).order_by(Contact.user_id, Contact.id)
+    async for rows in database.stream_partitions(db, stmt, batch_size):
+        yield rows
 
 
 async def create(body: ContactModel, db: Session, user_id: int):
@@ -114,11 +284,31 @@ async def create(body: ContactModel, db: Session, user_id: int):
     contact = Contact(name=body.name, surname=body.surname, phone=body.phone, \
                       email=body.email, birthday=body.birthday, description=body.description, user_id=user_id)
     db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    await database.commit(db)
+    await response_cache.bump(user_id)
+    await database.refresh(db, contact)
     return contact
 
 
+async def create_many(rows: list[dict], db: Session, user_id: int) -> int:
+    """
+    The create_many function inserts a batch of validated contacts with one multi-row INSERT
+    and a single commit, without building ORM objects.
+
+    :param rows: list[dict]: The contacts, as ContactBase.model_dump() dictionaries
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: The owner of the contacts
+    :return: The number of inserted contacts
+    """
+    if not rows:
+        return 0
+    values = [dict(row, user_id=user_id, birthday_key=birthday_key(row["birthday"])) for row in rows]
+    await database.execute(db, insert(Contact), values)
+    await database.commit(db)
+    await response_cache.bump(user_id)
+    return len(values)
+
+
 async def update(contact_id: int, body: ContactModel, db: Session, user_id: int):
     """
     The update function updates a contact in the database.
@@ -142,7 +332,9 @@ async def update(contact_id: int, body: ContactModel, db: Session, user_id: int)
         contact.birthday = body.birthday
         contact.description = body.description
         contact.user_id = user_id
-        db.commit()
+        await database.commit(db)
+        await response_cache.bump(user_id)
+        await database.refresh(db, contact)
     return contact
 
 
@@ -161,6 +353,7 @@ async def remove(contact_id: int, db: Session, user_id: int):
     """
     contact = await get_contact_by_id(contact_id, db, user_id)
     if contact:
-        db.delete(contact)
-        db.commit()
+        await database.delete(db, contact)
+        await database.commit(db)
+        await response_cache.bump(user_id)
     return contact
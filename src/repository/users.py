@@ -1,8 +1,11 @@
 from libgravatar import Gravatar
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
+from src.database import db as database
 from src.database.models import Users
 from src.schemas.users import UserModel
+from src.services.cache import user_cache
 
 
 async def get_user_by_email(email: str, db: Session) -> Users | None:
@@ -15,7 +18,8 @@ async def get_user_by_email(email: str, db: Session) -> Users | None:
     :return: A user object if the email is found in the database
     :doc-author: ms
     """
-    return db.query(Users).filter_by(email=email).first()
+    stmt = select(Users).filter_by(email=email)
+    return (await database.execute(db, stmt)).scalars().first()
 
 
 async def create_user(body: UserModel, db: Session):
@@ -34,8 +38,8 @@ async def create_user(body: UserModel, db: Session):
     new_user = Users(username=body.username, email=body.email, password=body.password,
                      avatar=g.get_image())
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await database.commit(db)
+    await database.refresh(db, new_user)
     return new_user
 
 
@@ -54,7 +58,22 @@ async def update_token(user: Users, refresh_token, db: Session):
     :doc-author: ms
     """
     user.refresh_token = refresh_token
-    db.commit()
+    await database.commit(db)
+    await user_cache.write_through(user)
+
+
+async def update_password(user: Users, password: str, db: Session) -> None:
+    """
+    The update_password function stores a new password hash for a user,
+    e.g. when the hash is upgraded to the current scheme at login.
+
+    :param user: Users: The user to update
+    :param password: str: The new password hash
+    :param db: Session: Pass the database session to the function
+    :return: None
+    """
+    user.password = password
+    await database.commit(db)
 
 
 async def confirmed_email(email: str, db: Session) -> None:
@@ -70,7 +89,8 @@ async def confirmed_email(email: str, db: Session) -> None:
     """
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await database.commit(db)
+    await user_cache.write_through(user)
 
 
 async def update_avatar(email, url, db) -> Users:
@@ -88,5 +108,6 @@ async def update_avatar(email, url, db) -> Users:
     """
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    await database.commit(db)
+    await user_cache.write_through(user)
     return user
@@ -0,0 +1,61 @@
+import os
+
+from fastapi import Depends, APIRouter, HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from src.conf.config import settings
+from src.database import db as database
+from src.database.db import get_db, pool_monitors
+from src.database.models import Users
+from src.services.auth import auth_service
+
+router = APIRouter(prefix='/admin', tags=['admin'])
+
+
+async def require_admin(current_user: Users = Depends(auth_service.get_current_user)):
+    """
+    The require_admin function lets only the users listed in settings.admin_emails through.
+
+    :param current_user: Users: Get the current user
+    :return: The current user
+    """
+    if current_user.email not in settings.admin_emails:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
+    return current_user
+
+
+@router.get("/pool", dependencies=[Depends(require_admin)])
+async def pool_diagnostics(db: Session = Depends(get_db)):
+    """
+    The pool_diagnostics function reports the connection pools of the worker that answers:
+    checked-out, idle and overflow connections, how long checkouts waited, how many timed out,
+    and the connections held longer than database_long_held_seconds with the route holding them.
+        On Postgres it adds max_connections and the connections open on the server, to check that
+        workers x (database_pool_size + database_max_overflow) fits.
+
+    :param db: Session: Get the database session
+    :return: The pool report
+    """
+    server = {}
+    if db.get_bind().dialect.name == "postgresql":
+        try:
+            server["max_connections"] = int((await database.execute(db, text("SHOW max_connections"))).scalar())
+            server["connections"] = (await database.execute(
+                db, text("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()"))).scalar()
+        except SQLAlchemyError as err:
+            server["error"] = str(err)
+    return {
+        "worker": os.getpid(),
+        "config": {
+            "pool_size": settings.database_pool_size,
+            "max_overflow": settings.database_max_overflow,
+            "pool_timeout": settings.database_pool_timeout,
+            "pool_recycle": settings.database_pool_recycle,
+            "pool_pre_ping": settings.database_pool_pre_ping,
+            "connections_per_worker": settings.database_pool_size + settings.database_max_overflow,
+        },
+        "pools": [monitor.snapshot(settings.database_long_held_seconds) for monitor in pool_monitors.values()],
+        "server": server,
+    }
@@ -19,7 +19,7 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
     """
     The signup function creates a new user in the database.
         It takes a UserModel object as input, which is validated by pydantic.
-        The password is hashed using Argon2 and stored in the database.
+        The password is hashed in the password pool with the configured scheme and stored in the database.
         A background task sends an email to the user with their username.
     
     :param body: UserModel: Get the user data from the request body
@@ -32,7 +32,7 @@ async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Re
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.hasher.hash(body.password)
     new_user = await repository_users.create_user(body, db)
     background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
     # return new_user
@@ -44,6 +44,7 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
     The login function is used to authenticate a user.
         It takes the username and password from the request body,
         verifies that they are correct, and returns an access token.
+        A password hash made with an outdated scheme or cost is replaced on the way.
     
     :param body: OAuth2PasswordRequestForm: Get the username and password from the request body
     :param db: Session: Get a database session
@@ -55,8 +56,11 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    verified, new_hash = await auth_service.hasher.verify_and_update(body.password, user.password)
+    if not verified:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash is not None:
+        await repository_users.update_password(user, new_hash, db)
     # Generate JWT
     access_token = await auth_service.create_access_token(data={"sub": user.email})
     refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
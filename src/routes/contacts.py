@@ -1,51 +1,165 @@
-from typing import List
+from datetime import date
+from typing import List, Literal
 
-from fastapi import Depends, HTTPException, status, Path, APIRouter, Query
-from fastapi_limiter.depends import RateLimiter
+from fastapi import Depends, HTTPException, status, Path, APIRouter, Query, Request, Header, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from src.conf.config import settings
 from src.database.models import Users
 from src.repository import contacts as repository_contacts
-from src.database.db import get_db
+from src.database.db import get_db, get_read_db, is_replica
 from src.services.auth import auth_service
-from src.schemas.contacts import ContactResponse, ContactModel
+from src.services.cache import response_cache
+from src.schemas.contacts import ContactResponse, ContactModel, ContactImportReport
+from src.services.etag import CACHE_CONTROL, etag_matches, not_modified, weak_etag
+from src.services.contacts_io import import_contacts, export_contacts, EXPORT_MEDIA_TYPES
+from src.services.pagination import encode_cursor, decode_cursor
+from src.services.rate_limit import rate_limiter
+from src.services.serialization import contacts_response
 
 router = APIRouter(prefix='/contact', tags=['contact'])
 
 
 @router.get("/", response_model=List[ContactResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contacts(limit: int = Query(10, le=500), offset: int = 0, db: Session = Depends(get_db),
+            dependencies=[Depends(rate_limiter.depends("contact_list"))])
+async def get_contacts(limit: int = Query(10, le=500), offset: int = 0,
+                       cursor: str | None = None, if_none_match: str | None = Header(None),
+                       db: Session = Depends(get_read_db),
                        current_user: Users = Depends(auth_service.get_current_user)):
     """
     The get_contacts function returns a list of contacts.
+        A full page carries the cursor of the next page in the X-Next-Cursor header.
+        Passing it back as the cursor parameter continues after the last contact of the page;
+        the offset parameter is still accepted for old clients and is ignored when a cursor is given.
+        The weak ETag of the page comes from (max(updated_at), count) of the address book and the page parameters.
+        A client that sends it back in If-None-Match gets 304 after a single aggregate query when nothing changed.
+        Pages read from the primary are kept in the response cache until the next change to the contacts of the user;
+        pages read from a replica may lag behind and are not cached.
     
     :param limit: int: Limit the number of contacts returned
     :param le: Limit the maximum number of contacts returned
     :param offset: int: Specify the starting point of the query
+    :param cursor: str | None: The X-Next-Cursor value of the previous page
+    :param if_none_match: str | None: The ETag of the page the client already has
     :param db: Session: Get the database session
     :param current_user: Users: Get the current user
     :return: A list of contacts
     :doc-author: ms
     """
-    contacts = await repository_contacts.get_contacts(limit, offset, db, current_user.id)
+    after_id = None
+    if cursor is not None:
+        try:
+            after_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    key, cached = await response_cache.get("contact_list", current_user.id, (limit, offset, after_id))
+    if cached is not None:
+        etag = cached.headers["etag"]
+        return not_modified(etag) if etag_matches(if_none_match, etag) else cached
+    if if_none_match:
+        version = await repository_contacts.get_contacts_version(db, current_user.id)
+        etag = weak_etag(current_user.id, *version, limit, offset, after_id)
+        if version[1] and etag_matches(if_none_match, etag):
+            return not_modified(etag)
+        contacts = await repository_contacts.get_contacts(limit, offset, db, current_user.id, after_id)
+    else:
+        contacts, version = await repository_contacts.get_contacts_with_version(limit, offset, db,
+                                                                                current_user.id, after_id)
+        etag = weak_etag(current_user.id, *version, limit, offset, after_id) if version else None
     if not contacts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-    return contacts
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if len(contacts) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(contacts[-1].id)
+    response = contacts_response(contacts, headers)
+    if not is_replica(db):
+        await response_cache.set(key, response)
+    return response
+
+
+@router.get("/export", response_class=StreamingResponse, description='No more than 2 requests per minute',
+            dependencies=[Depends(rate_limiter.depends("contact_export"))])
+async def export_contacts_file(format: Literal["csv", "ndjson", "vcf"] = "ndjson", db: Session = Depends(get_read_db),
+                               current_user: Users = Depends(auth_service.get_current_user)):
+    """
+    The export_contacts_file function downloads the whole address book of the current user.
+        Rows are streamed from a server-side cursor straight into the response,
+        so the size of the address book does not change the memory used.
+    
+    :param format: str: The format of the file: csv, ndjson or vcf
+    :param db: Session: Get the database session
+    :param current_user: Users: Get the current user
+    :return: A streaming response with the file
+    """
+    return StreamingResponse(
+        export_contacts(db, current_user.id, format, settings.contacts_export_batch_size),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="contacts.{format}"'},
+    )
+
+
+@router.get("/search", response_model=List[ContactResponse], description='No more than 10 requests per minute',
+            dependencies=[Depends(rate_limiter.depends("contact_search"))])
+async def search_contacts(q: str = Query(min_length=1, max_length=100), limit: int = Query(20, ge=1, le=100),
+                          db: Session = Depends(get_read_db),
+                          current_user: Users = Depends(auth_service.get_current_user)):
+    """
+    The search_contacts function looks the query up in the name, surname, email, phone and description
+    of the current user's contacts and returns the best matches first.
+    Search is only available on Postgres and SQLite; other databases answer 501.
+    
+    :param q: str: The search string
+    :param limit: int: Limit the number of contacts returned
+    :param db: Session: Get the database session
+    :param current_user: Users: Get the current user
+    :return: A list of contacts
+    """
+    try:
+        contacts = await repository_contacts.search_contacts(q, limit, db, current_user.id)
+    except NotImplementedError as err:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail=str(err))
+    return contacts_response(contacts)
+
+
+@router.get("/birthdays", response_model=List[ContactResponse], description='No more than 10 requests per minute',
+            dependencies=[Depends(rate_limiter.depends("contact_birthdays"))])
+async def get_upcoming_birthdays(days: int = Query(7, ge=0, le=366), db: Session = Depends(get_read_db),
+                                 current_user: Users = Depends(auth_service.get_current_user)):
+    """
+    The get_upcoming_birthdays function returns the contacts with a birthday within the requested
+    number of days, nearest first. The window wraps over the end of the year.
+    
+    :param days: int: The length of the window in days
+    :param db: Session: Get the database session
+    :param current_user: Users: Get the current user
+    :return: A list of contacts
+    """
+    key, cached = await response_cache.get("contact_birthdays", current_user.id, (days, date.today()))
+    if cached is not None:
+        return cached
+    response = contacts_response(await repository_contacts.get_upcoming_birthdays(days, db, current_user.id))
+    if not is_replica(db):
+        await response_cache.set(key, response)
+    return response
 
 
 # response_model=OwnerResponse,
 @router.get("/{contact_id}", response_model=ContactResponse, description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db),
+            dependencies=[Depends(rate_limiter.depends("contact_get"))])
+async def get_contact(response: Response, contact_id: int = Path(ge=1), if_none_match: str | None = Header(None),
+                      db: Session = Depends(get_read_db),
                       current_user: Users = Depends(auth_service.get_current_user)):
     """
     The get_contact function is used to retrieve a single contact from the database.
     The function takes in an integer value for the contact_id, which is then passed into
     the get_contact_by_id function of repository/contacts.py. The get_contact function returns
     a JSON object containing all information about a specific contact.
+    The weak ETag comes from (id, updated_at); a matching If-None-Match is answered with 304 and no body.
     
+    :param response: Response: Set the ETag header
     :param contact_id: int: Get the contact id from the url
+    :param if_none_match: str | None: The ETag of the contact the client already has
     :param db: Session: Get the database session
     :param current_user: Users: Get the user id of the current user
     :return: A contact object
@@ -54,12 +168,17 @@ async def get_contact(contact_id: int = Path(ge=1), db: Session = Depends(get_db
     contacts = await repository_contacts.get_contact_by_id(contact_id, db, current_user.id)
     if not contacts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
+    etag = weak_etag(contacts.id, contacts.updated_at)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
     return contacts
 
 
 @router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED,
              description='No more than 10 requests per minute',
-             dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+             dependencies=[Depends(rate_limiter.depends("contact_create"))])
 async def create_contact(body: ContactModel, db: Session = Depends(get_db),
                          current_user: Users = Depends(auth_service.get_current_user)):
     """
@@ -75,8 +194,29 @@ async def create_contact(body: ContactModel, db: Session = Depends(get_db),
     return contact
 
 
+@router.post("/import", response_model=ContactImportReport, description='No more than 2 requests per minute',
+             dependencies=[Depends(rate_limiter.depends("contact_import"))])
+async def import_contacts_file(request: Request, format: Literal["csv", "ndjson", "vcf"] = "csv",
+                               db: Session = Depends(get_db),
+                               current_user: Users = Depends(auth_service.get_current_user)):
+    """
+    The import_contacts_file function creates contacts from an address book sent as the raw request body.
+        The body is parsed while it is received and the rows are inserted in batches,
+        so files of any size can be imported. Rows that fail validation are skipped and
+        listed in the report with their row number.
+    
+    :param request: Request: Read the request body as a stream
+    :param format: str: The format of the body: csv (with a header row), ndjson or vcf
+    :param db: Session: Get the database session
+    :param current_user: Users: Get the current user
+    :return: A report of the import
+    """
+    return await import_contacts(request.stream(), format, db, current_user.id,
+                                 settings.contacts_import_batch_size)
+
+
 @router.put("/{contact_id}", response_model=ContactResponse, description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
+            dependencies=[Depends(rate_limiter.depends("contact_update"))])
 async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: Session = Depends(get_db),
                          current_user: Users = Depends(auth_service.get_current_user)):
     """
@@ -99,14 +239,14 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: S
 
 @router.patch("/{contact}/name", response_model=List[ContactResponse],
               description='No more than 10 requests per minute',
-              dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contact_by_name(contact_name: str, db: Session = Depends(get_db),
+              dependencies=[Depends(rate_limiter.depends("contact_by_name"))])
+async def get_contact_by_name(contact_name: str, db: Session = Depends(get_read_db),
                               current_user: Users = Depends(auth_service.get_current_user)):
     """
     The get_contact_by_name function is used to retrieve a contact by name.
         The function takes in the following parameters:
             - contact_name (str): The name of the contact you wish to retrieve.
-            - db (Session, optional): A database Session instance that will be used for querying data from the database.  Defaults to Depends(get_db).
+            - db (Session, optional): A database Session instance that will be used for querying data from the database.  Defaults to Depends(get_read_db).
             - current_user (Users, optional): An instance of Users representing the currently logged-in user.  Defaults to Depends(auth_service.get_current_user).
     
     :param contact_name: str: Get the contact name from the url
@@ -115,16 +255,22 @@ async def get_contact_by_name(contact_name: str, db: Session = Depends(get_db),
     :return: A list of contacts
     :doc-author: ms
     """
+    key, cached = await response_cache.get("contact_by_name", current_user.id, (contact_name,))
+    if cached is not None:
+        return cached
     contacts = await repository_contacts.get_contact_by_name(contact_name, db, current_user.id)
     if not contacts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-    return contacts
+    response = contacts_response(contacts)
+    if not is_replica(db):
+        await response_cache.set(key, response)
+    return response
 
 
 @router.patch("/{contact}/surname", response_model=List[ContactResponse],
               description='No more than 10 requests per minute',
-              dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contact_by_surname(contact_surname: str, db: Session = Depends(get_db),
+              dependencies=[Depends(rate_limiter.depends("contact_by_surname"))])
+async def get_contact_by_surname(contact_surname: str, db: Session = Depends(get_read_db),
                                  current_user: Users = Depends(auth_service.get_current_user)):
     """
     The get_contact_by_surname function is used to retrieve a contact by surname.
@@ -140,21 +286,27 @@ async def get_contact_by_surname(contact_surname: str, db: Session = Depends(get
     :return: A list of contacts with the given surname
     :doc-author: ms
     """
+    key, cached = await response_cache.get("contact_by_surname", current_user.id, (contact_surname,))
+    if cached is not None:
+        return cached
     contacts = await repository_contacts.get_contact_by_surname(contact_surname, db, current_user.id)
     if not contacts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-    return contacts
+    response = contacts_response(contacts)
+    if not is_replica(db):
+        await response_cache.set(key, response)
+    return response
 
 
 @router.patch("/{contact}/email", response_model=ContactResponse, description='No more than 10 requests per minute',
-              dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contact_by_email(contact_email: str, db: Session = Depends(get_db),
+              dependencies=[Depends(rate_limiter.depends("contact_by_email"))])
+async def get_contact_by_email(contact_email: str, db: Session = Depends(get_read_db),
                                current_user: Users = Depends(auth_service.get_current_user)):
     """
     The get_contact_by_email function returns a contact by email.
         The function takes in the following parameters:
             - contact_email (str): The email of the contact to be returned.
-            - db (Session, optional): SQLAlchemy Session. Defaults to Depends(get_db).
+            - db (Session, optional): SQLAlchemy Session. Defaults to Depends(get_read_db).
             - current_user (Users, optional): Current user object from auth middleware. Defaults to Depends(auth_service.get_current_user).
     
     :param contact_email: str: Specify the email of the contact to be retrieved
@@ -171,8 +323,8 @@ async def get_contact_by_email(contact_email: str, db: Session = Depends(get_db)
 
 @router.patch("/{contact}/birthdays", response_model=List[ContactResponse],
               description='No more than 10 requests per minute',
-              dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def get_contacts_nearly_birthdays(db: Session = Depends(get_db),
+              dependencies=[Depends(rate_limiter.depends("contact_nearly_birthdays"))])
+async def get_contacts_nearly_birthdays(db: Session = Depends(get_read_db),
                                         current_user: Users = Depends(auth_service.get_current_user)):
     """
     The get_contacts_nearly_birthdays function returns a list of contacts that have birthdays in the next 30 days.
@@ -182,10 +334,16 @@ async def get_contacts_nearly_birthdays(db: Session = Depends(get_db),
     :return: A list of contacts with birthdays in the next 7 days
     :doc-author: ms
     """
+    key, cached = await response_cache.get("contact_nearly_birthdays", current_user.id, (date.today(),))
+    if cached is not None:
+        return cached
     contact = await repository_contacts.get_nearly_birthdays(db, current_user.id)
     if not contact:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not found")
-    return contact
+    response = contacts_response(contact)
+    if not is_replica(db):
+        await response_cache.set(key, response)
+    return response
 
 
 @router.delete("/{contact_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -1,17 +1,14 @@
 from sqlalchemy.orm import Session
-from fastapi import File, UploadFile
-
-import cloudinary
-import cloudinary.uploader
+from fastapi import File, UploadFile, HTTPException, status
 
 from src.conf.config import settings
 from src.database.db import get_db
 from src.database.models import Users
-from src.repository import users as repository_users
 from src.schemas.users import UserResponse
 from fastapi import Depends, APIRouter
 
 from src.services.auth import auth_service
+from src.services.avatars import update_avatar
 
 router = APIRouter(prefix='/users', tags=['users'])
 
@@ -34,26 +31,19 @@ async def update_avatar_user(file: UploadFile = File(), current_user: Users = De
                              db: Session = Depends(get_db)):
     """
     The update_avatar_user function is used to update the avatar of a user.
-        The function takes in an UploadFile object, which contains the file that will be uploaded to Cloudinary.
+        The function takes in an UploadFile object, which contains the file that will be stored as the avatar.
         It also takes in a Users object, which is the current_user who's avatar will be updated. 
         Finally it takes in a Session object, which is used for database transactions.
+        The image goes to the avatar storage from the settings, Cloudinary or the local filesystem,
+        without blocking the event loop; the same image uploaded again is not stored twice.
     
-    :param file: UploadFile: Upload the file to cloudinary
+    :param file: UploadFile: The new avatar image
     :param current_user: Users: Get the current user's email from the database
     :param db: Session: Pass the database session to the function
     :return: A user object
     :doc-author: ms
     """
-    cloudinary.config(
-        cloud_name=settings.cloudinary_name,
-        api_key=settings.cloudinary_api_key,
-        api_secret=settings.cloudinary_api_secret,
-        secure=True
-    )
-
-    public_id = f'ContactsApp/{current_user.username}{current_user.id}'
-    r = cloudinary.uploader.upload(file.file, public_id=public_id, overwrite=True)
-    src_url = cloudinary.CloudinaryImage(public_id) \
-        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    user = await repository_users.update_avatar(current_user.email, src_url, db)
-    return user
+    data = await file.read(settings.avatar_max_size + 1)
+    if len(data) > settings.avatar_max_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="The image is too large")
+    return await update_avatar(current_user, data, db)
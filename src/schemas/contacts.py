@@ -1,15 +1,20 @@
 from datetime import datetime, date
+from typing import List
+
 from pydantic import BaseModel, Field, EmailStr
 
 
-class ContactModel(BaseModel):
-    id: int
+class ContactBase(BaseModel):
     name: str
     surname: str
     email: EmailStr
     phone: str
     birthday: date
     description: str
+
+
+class ContactModel(ContactBase):
+    id: int
     created_at: datetime
     updated_at: datetime
 
@@ -28,3 +33,16 @@ class ContactResponse(BaseModel):
     # Якщо поветраються з бази даних
     class Config:
         from_attributes = True
+
+
+class ContactImportError(BaseModel):
+    row: int
+    errors: List[str]
+
+
+class ContactImportReport(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    errors: List[ContactImportError]
+    errors_truncated: bool = False
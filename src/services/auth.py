@@ -1,17 +1,20 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
-import pickle
 from typing import Optional
 
-import redis
-from fastapi import Depends, HTTPException, status
-from passlib.context import CryptContext
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from jose import JWTError, jwt
 
 from src.conf.config import settings
-from src.database.db import get_db
+from src.database.db import get_read_db, identify
 from src.repository import users as repository_users
+from src.services import metrics
+from src.services.cache import user_cache, TTLCache
+from src.services.passwords import build_password_context, PasswordHasher
+from src.services.timing import span
 
 
 class ConfigKey:
@@ -122,7 +125,7 @@ class Token:
 
 class Auth(Token):
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
-    r = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0)
+    cache = user_cache
 
     def __init__(self):
         """
@@ -133,7 +136,13 @@ class Auth(Token):
         :return: The config and pwd_context
         """
         self.config = ConfigKey
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        self.pwd_context = build_password_context()
+        self.hasher = PasswordHasher(self.pwd_context, workers=settings.password_hash_workers,
+                                     max_pending=settings.password_hash_max_pending)
+        self.token_cache = TTLCache(settings.token_cache_size, ttl=0)
+        self.token_cache_hits = 0
+        self.token_decodes = 0
+        self.token_decode_seconds = 0.0
 
     def verify_password(self, plain_password, hashed_password):
         """
@@ -159,17 +168,60 @@ class Auth(Token):
         """
         return self.pwd_context.hash(password)
 
+    def decode_access_token(self, token: str) -> dict:
+        """
+        The decode_access_token function verifies a JWT and returns its claims.
+        Verified claims are cached under the SHA-256 digest of the token until the token expires,
+        so a token presented again skips the signature check and the payload parsing.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The claims of the token
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        payload = self.token_cache.get(key)
+        if payload is not None:
+            self.token_cache_hits += 1
+            return payload
+        start = time.perf_counter()
+        payload = jwt.decode(token, self.config.SECRET_KEY, algorithms=[self.config.ALGORITHM])
+        self.token_decodes += 1
+        self.token_decode_seconds += time.perf_counter() - start
+        ttl = payload.get("exp", 0) - time.time()
+        if ttl > 0:
+            self.token_cache.set(key, payload, ttl=ttl)
+        return payload
+
+    def token_cache_stats(self) -> dict:
+        """
+        The token_cache_stats function reports how often a verified token was reused
+        and an estimate of the decode time this saved, based on the average decode time.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of counters
+        """
+        average = self.token_decode_seconds / self.token_decodes if self.token_decodes else 0.0
+        return {
+            "hits": self.token_cache_hits,
+            "decodes": self.token_decodes,
+            "decode_seconds": self.token_decode_seconds,
+            "decode_seconds_saved": self.token_cache_hits * average,
+            "size": len(self.token_cache),
+        }
+
     # define a function to generate a new access token
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    async def get_current_user(self, request: Request, token: str = Depends(oauth2_scheme),
+                               db: Session = Depends(get_read_db)):
         """
         The get_current_user function is a dependency that will be used in the
             UserRouter class. It takes in a token and db session, and returns the user
             object associated with that token. If no user is found, it raises an exception.
 
         :param self: Access the class variables and methods
+        :param request: Request: Keep the token subject in request.state for the database dependencies
         :param token: str: Get the token from the authorization header
         :param db: Session: Get the database session
-        :return: The user object
+        :return: The cached user (a CachedUser, not a Users instance)
         """
         credentials_exception = HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -179,7 +231,8 @@ class Auth(Token):
 
         try:
             # Decode JWT
-            payload = jwt.decode(token, self.config.SECRET_KEY, algorithms=[self.config.ALGORITHM])
+            with span("jwt"):
+                payload = self.decode_access_token(token)
             if payload.get('scope') == "access_token":
                 email = payload["sub"]
                 if email is None:
@@ -189,16 +242,26 @@ class Auth(Token):
         except JWTError as e:
             raise credentials_exception
 
-        user = self.r.get(f"user:{email}")
+        await identify(request, email)
+        with span("user"):
+            user = await self.cache.get_or_load(email, lambda: repository_users.get_user_by_email(email, db))
         if user is None:
-            user = await repository_users.get_user_by_email(email, db)
-            if user is None:
-                raise credentials_exception
-            self.r.set(f"user:{email}", pickle.dumps(user))
-            self.r.expire(f"user:{email}", 900)
-        else:
-            user = pickle.loads(user)
+            raise credentials_exception
         return user
 
 
 auth_service = Auth()
+auth_service.hasher.instrument()
+token_lookups = metrics.registry.counter("auth_token_lookups_total",
+                                         "Access tokens taken from the token cache or decoded.", ("result",))
+token_decode_seconds = metrics.registry.counter("auth_token_decode_seconds_total", "Time spent decoding access tokens.")
+token_decode_seconds_saved = metrics.registry.gauge("auth_token_decode_seconds_saved",
+                                                    "Decode time the token cache saved, at the average decode time.")
+token_cache_size = metrics.registry.gauge("auth_token_cache_size", "Verified tokens in the cache of the worker.")
+metrics.instrument_stats(auth_service.token_cache_stats, {
+    "hits": (token_lookups, "hit"),
+    "decodes": (token_lookups, "decode"),
+    "decode_seconds": (token_decode_seconds,),
+    "decode_seconds_saved": (token_decode_seconds_saved,),
+    "size": (token_cache_size,),
+})
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import re
+from pathlib import Path
+
+import cloudinary
+import cloudinary.uploader
+from fastapi import HTTPException, status
+
+from src.conf.config import settings
+from src.repository import users as repository_users
+
+logger = logging.getLogger(__name__)
+
+DIGEST_LENGTH = 16
+
+
+class CloudinaryStorage:
+    """
+    Stores avatars in Cloudinary. The client is configured once, when the storage is created,
+    and the blocking calls run in a worker thread. Cloudinary renders the resized variant on request.
+    Every image gets its own public id, named after its digest, and the previous one is destroyed once
+    the new url is saved, so replaced avatars leave no assets behind.
+    """
+
+    def __init__(self, cloud_name: str, api_key: int, api_secret: str, size: int):
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
+        self.size = size
+
+    @staticmethod
+    def _public_id(user, digest: str | None = None) -> str:
+        public_id = f'ContactsApp/{user.username}{user.id}'
+        return f'{public_id}_{digest}' if digest else public_id
+
+    async def save(self, data: bytes, user, digest: str) -> str:
+        """
+        The save function uploads the image and returns the url of its resized variant.
+
+        :param self: Represent the instance of the class
+        :param data: bytes: The uploaded image
+        :param user: The owner of the avatar
+        :param digest: str: The short content hash, made part of the url
+        :return: The url of the avatar
+        """
+        public_id = self._public_id(user, digest)
+        r = await asyncio.to_thread(cloudinary.uploader.upload, io.BytesIO(data), public_id=public_id, overwrite=True)
+        return cloudinary.CloudinaryImage(public_id) \
+            .build_url(width=self.size, height=self.size, crop='fill', version=r.get('version'))
+
+    async def discard(self, user, url: str) -> None:
+        """
+        The discard function destroys the asset behind a previous avatar url of the user.
+        Urls that point elsewhere, e.g. Gravatar, are left alone.
+
+        :param self: Represent the instance of the class
+        :param user: The owner of the avatar
+        :param url: str: The previous avatar url
+        :return: None
+        """
+        own = re.escape(self._public_id(user))
+        match = re.search(rf"/({own}(?:_[0-9a-f]+)?)(?:\.\w+)?(?:[?#].*)?$", url)
+        if match is None:
+            return
+        await asyncio.to_thread(cloudinary.uploader.destroy, match.group(1), invalidate=True)
+
+
+class LocalStorage:
+    """
+    Stores avatars on the local filesystem and makes the square variants itself with Pillow,
+    so avatars work without network access. The files are served from media_url.
+    """
+
+    def __init__(self, root: str, media_url: str, size: int, variants: list[int]):
+        from PIL import Image, ImageOps, UnidentifiedImageError
+
+        self.Image, self.ImageOps, self.UnidentifiedImageError = Image, ImageOps, UnidentifiedImageError
+        self.DecompressionBombError = Image.DecompressionBombError
+        self.root = Path(root)
+        self.media_url = media_url.rstrip("/")
+        self.size = size
+        self.variants = sorted(set(variants) | {size})
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, user, digest: str, size: int) -> Path:
+        return self.root / "avatars" / str(user.id) / f"{digest}_{size}.png"
+
+    def _render(self, data: bytes, user, digest: str) -> None:
+        try:
+            with self.Image.open(io.BytesIO(data)) as image:
+                image.load()
+                image = image.convert("RGBA")
+        except self.DecompressionBombError:
+            raise ValueError("The image has too many pixels")
+        except (self.UnidentifiedImageError, OSError):
+            raise ValueError("The file is not an image")
+        for size in self.variants:
+            path = self._path(user, digest, size)
+            if path.exists():
+                continue
+            path.parent.mkdir(parents=True, exist_ok=True)
+            partial = path.with_suffix(".tmp")
+            self.ImageOps.fit(image, (size, size)).save(partial, format="PNG")
+            os.replace(partial, path)
+
+    async def save(self, data: bytes, user, digest: str) -> str:
+        """
+        The save function writes every variant of the image in a worker thread
+        and returns the url of the variant of the configured size.
+
+        :param self: Represent the instance of the class
+        :param data: bytes: The uploaded image
+        :param user: The owner of the avatar
+        :param digest: str: The short content hash, used in the file names
+        :return: The url of the avatar
+        """
+        await asyncio.to_thread(self._render, data, user, digest)
+        return f"{self.media_url}/avatars/{user.id}/{digest}_{self.size}.png"
+
+    def _remove(self, user, digest: str) -> None:
+        for size in self.variants:
+            self._path(user, digest, size).unlink(missing_ok=True)
+
+    async def discard(self, user, url: str) -> None:
+        """
+        The discard function deletes every variant of a previous avatar of the user.
+        Urls that point elsewhere, e.g. Gravatar, are left alone.
+
+        :param self: Represent the instance of the class
+        :param user: The owner of the avatar
+        :param url: str: The previous avatar url
+        :return: None
+        """
+        prefix = re.escape(f"{self.media_url}/avatars/{user.id}/")
+        match = re.fullmatch(rf"{prefix}([0-9a-f]+)_\d+\.png", url)
+        if match is not None:
+            await asyncio.to_thread(self._remove, user, match.group(1))
+
+
+def build_storage(backend: str | None = None):
+    """
+    The build_storage function creates the avatar storage named in the settings.
+
+    :param backend: str | None: cloudinary or local, defaults to settings.avatar_storage
+    :return: A CloudinaryStorage or a LocalStorage
+    """
+    backend = backend or settings.avatar_storage
+    if backend == "cloudinary":
+        return CloudinaryStorage(settings.cloudinary_name, settings.cloudinary_api_key,
+                                 settings.cloudinary_api_secret, settings.avatar_size)
+    if backend == "local":
+        return LocalStorage(settings.avatar_media_root, settings.avatar_media_url, settings.avatar_size,
+                            settings.avatar_variants)
+    raise ValueError(f"Unknown avatar storage '{backend}'")
+
+
+avatar_storage = build_storage()
+
+
+async def update_avatar(user, data: bytes, db, storage=None):
+    """
+    The update_avatar function stores a new avatar for the user and saves its url.
+        The url carries a hash of the image, so uploading the same image again
+        returns the user as is without touching the storage or the database.
+        Once the new url is saved, the previous avatar is removed from the storage;
+        a failure there is only logged.
+
+    :param user: The current user
+    :param data: bytes: The uploaded image
+    :param db: Session: Pass the database session to the function
+    :param storage: The avatar storage, defaults to the one from the settings
+    :return: The updated user
+    """
+    storage = storage or avatar_storage
+    digest = hashlib.sha256(data).hexdigest()[:DIGEST_LENGTH]
+    if user.avatar and digest in user.avatar:
+        return user
+    try:
+        url = await storage.save(data, user, digest)
+    except ValueError as err:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
+    previous = user.avatar
+    updated = await repository_users.update_avatar(user.email, url, db)
+    if previous and previous != url:
+        try:
+            await storage.discard(user, previous)
+        except Exception as err:
+            logger.warning("Removing the previous avatar %s failed: %s", previous, err)
+    return updated
@@ -0,0 +1,522 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, astuple, fields
+
+import orjson
+import redis.asyncio as redis
+from fastapi import Response
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services import metrics
+from src.services.metrics import redis_timer
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    A bounded in-process LRU cache whose entries expire after ttl seconds.
+    It is only used from the event loop, so it needs no locking.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        """
+        The get function returns the cached value, or None when the key is missing or expired.
+
+        :param self: Represent the instance of the class
+        :param key: The cache key
+        :return: The cached value or None
+        """
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None) -> None:
+        """
+        The set function stores a value, evicting the least recently used entry when the cache is full.
+
+        :param self: Represent the instance of the class
+        :param key: The cache key
+        :param value: The value to store
+        :param ttl: float | None: Seconds until the entry expires, defaults to the cache ttl
+        :return: None
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+@dataclass(slots=True, frozen=True)
+class CachedUser:
+    """
+    The fields of Users that authenticated requests need. The password hash and the refresh token
+    are deliberately left out, so they never reach the cache.
+    """
+    id: int
+    username: str | None
+    email: str
+    avatar: str | None
+    confirmed: bool | None
+
+    @classmethod
+    def from_user(cls, user) -> "CachedUser":
+        return cls(*(getattr(user, field.name) for field in fields(cls)))
+
+    def dumps(self) -> bytes:
+        return json.dumps(astuple(self), separators=(",", ":")).encode()
+
+    @classmethod
+    def loads(cls, raw: bytes) -> "CachedUser | None":
+        try:
+            values = json.loads(raw)
+            return cls(*values)
+        except (TypeError, ValueError):
+            return None
+
+
+class UserCache:
+    """
+    A two-tier cache for the users behind access tokens: a small per-worker TTLCache in front
+    of Redis shared by all workers. A hit in the first tier needs no network I/O.
+
+    Every profile change goes through write_through or invalidate, which bump a per-user version
+    in the same MULTI as the new entry and broadcast the change so the other workers drop their
+    local copy. A reader that filled the cache from the database only stores its copy if the version
+    did not move in the meantime, so an old row can't overwrite a newer write.
+
+    When that MULTI fails after the database commit, the entry is dropped with a second MULTI right away;
+    when that fails too, the user is kept in pending, read from the database instead of Redis
+    by this worker, and retry_pending drops the entry as soon as Redis answers again.
+    """
+
+    prefix = "user:"
+    channel = "user-cache-invalidate"
+    reconnect_delay = 5
+
+    # KEYS: entry, version; ARGV: payload, version seen before the database read, ttl
+    FILL_SCRIPT = """
+        if (redis.call('GET', KEYS[2]) or '0') == ARGV[2] then
+            redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, client: redis.Redis, ttl: int, local_size: int, local_ttl: float):
+        self.client = client
+        self.ttl = ttl
+        self.local = TTLCache(local_size, local_ttl)
+        self.worker_id = uuid.uuid4().hex
+        self._fill = client.register_script(self.FILL_SCRIPT)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+        self.pending = set()
+
+    def key(self, email: str) -> str:
+        return f"{self.prefix}{email}"
+
+    def version_key(self, email: str) -> str:
+        return f"{self.prefix}{email}:v"
+
+    def _failed(self, action: str, err: Exception) -> None:
+        self.errors += 1
+        logger.warning("User cache %s failed: %s", action, err)
+
+    async def _lookup(self, email: str) -> tuple[CachedUser | None, str | None]:
+        user = self.local.get(email)
+        if user is not None:
+            self.local_hits += 1
+            return user, None
+        if email in self.pending:
+            # The Redis entry may predate a change, and the version too: neither is read nor filled
+            self.misses += 1
+            return None, None
+        try:
+            with redis_timer("user_cache_get"):
+                raw, version = await self.client.mget(self.key(email), self.version_key(email))
+        except RedisError as err:
+            self._failed("read", err)
+            self.misses += 1
+            return None, None
+        user = CachedUser.loads(raw) if raw is not None else None
+        if user is None:
+            self.misses += 1
+            return None, (version or b"0").decode()
+        self.redis_hits += 1
+        self.local.set(email, user)
+        return user, None
+
+    async def get(self, email: str) -> CachedUser | None:
+        """
+        The get function looks the user up in the local cache, then in Redis.
+        A Redis hit is copied into the local cache; Redis errors count as a miss.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: The cached user or None
+        """
+        user, _ = await self._lookup(email)
+        return user
+
+    async def get_or_load(self, email: str, load) -> CachedUser | None:
+        """
+        The get_or_load function returns the cached user, or calls load on a miss and caches what it returns.
+        The Redis entry is only written when no write_through or invalidate happened since the lookup.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :param load: A coroutine function that reads the user from the database
+        :return: The cached user, or None when load returns None
+        """
+        user, version = await self._lookup(email)
+        if user is not None:
+            return user
+        loaded = await load()
+        if loaded is None:
+            return None
+        user = CachedUser.from_user(loaded)
+        self.local.set(email, user)
+        if version is not None:
+            try:
+                with redis_timer("user_cache_fill"):
+                    await self._fill(keys=[self.key(email), self.version_key(email)],
+                                     args=[user.dumps(), version, self.ttl])
+            except RedisError as err:
+                self._failed("fill", err)
+        return user
+
+    async def write_through(self, user) -> CachedUser:
+        """
+        The write_through function stores the new state of a user after it changed in the database.
+        The version bump, the SET ... EX and the broadcast run in one MULTI.
+
+        :param self: Represent the instance of the class
+        :param user: Users | CachedUser: The updated user
+        :return: The cached representation of the user
+        """
+        cached = user if isinstance(user, CachedUser) else CachedUser.from_user(user)
+        self.local.set(cached.email, cached)
+        try:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.incr(self.version_key(cached.email))
+                pipe.expire(self.version_key(cached.email), self.ttl * 2)
+                pipe.set(self.key(cached.email), cached.dumps(), ex=self.ttl)
+                pipe.publish(self.channel, f"{self.worker_id}:{cached.email}")
+                with redis_timer("user_cache_write"):
+                    await pipe.execute()
+        except RedisError as err:
+            self._failed("write", err)
+            await self._drop_or_queue(cached.email)
+        else:
+            self.pending.discard(cached.email)
+        return cached
+
+    async def _drop(self, email: str) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(self.version_key(email))
+            pipe.expire(self.version_key(email), self.ttl * 2)
+            pipe.delete(self.key(email))
+            pipe.publish(self.channel, f"{self.worker_id}:{email}")
+            with redis_timer("user_cache_invalidate"):
+                await pipe.execute()
+
+    async def _drop_or_queue(self, email: str) -> None:
+        try:
+            await self._drop(email)
+        except RedisError as err:
+            self._failed("invalidate", err)
+            self.pending.add(email)
+        else:
+            self.pending.discard(email)
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function removes a user from both tiers on every worker.
+
+        :param self: Represent the instance of the class
+        :param email: str: The email of the user
+        :return: None
+        """
+        self.local.pop(email)
+        await self._drop_or_queue(email)
+
+    async def retry_pending(self) -> None:
+        """
+        The retry_pending function drops the Redis entries of the users whose change could not be written
+        every reconnect_delay seconds, until Redis takes them. It runs for the lifetime of the worker.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(self.reconnect_delay)
+            for email in list(self.pending):
+                await self._drop_or_queue(email)
+                if email in self.pending:
+                    break
+
+    async def listen(self) -> None:
+        """
+        The listen function drops local entries when another worker broadcasts a change.
+        It runs for the lifetime of the worker; while Redis is unreachable broadcasts can be missed,
+        so the local tier is cleared on every reconnect.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                self.local.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, _, email = message["data"].decode().partition(":")
+                    if origin != self.worker_id:
+                        self.invalidations += 1
+                        self.local.pop(email)
+            except (RedisError, OSError) as err:
+                self._failed("subscription", err)
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                await pubsub.reset()
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "local_size": len(self.local),
+            "pending": len(self.pending),
+        }
+
+
+response_cache_lookups = metrics.registry.counter("response_cache_lookups_total",
+                                                  "Response cache lookups by route and result.", ("route", "result"))
+
+
+class ResponseCache:
+    """
+    A Redis cache of whole JSON responses of the contact reads, keyed by route, parameters and
+    a per-user version. Every change to the contacts of a user bumps the version with one INCR,
+    so the old entries are never read again and simply expire after ttl seconds.
+
+    The version and the entry are read in one round trip by a script. Responses larger than
+    max_entry_size are not stored. After a Redis error the cache is skipped for retry_after seconds,
+    so an unreachable Redis costs one failed call per interval instead of one per request.
+
+    A bump that still fails after bump_attempts tries leaves the old entries current, so the user is
+    marked dirty for ttl seconds, until all of them expired: their responses are neither read
+    nor stored by this worker, unless a later bump gets through first.
+    """
+
+    prefix = "resp:"
+    bump_attempts = 3
+
+    # KEYS: version; ARGV: entry key without the version, i.e. prefix and route/params suffix
+    LOOKUP_SCRIPT = """
+        local version = redis.call('GET', KEYS[1]) or '0'
+        return {version, redis.call('GET', ARGV[1] .. version .. ARGV[2])}
+    """
+
+    def __init__(self, client: redis.Redis, ttl: int, max_entry_size: int, retry_after: float = 5,
+                 enabled: bool = True):
+        self.client = client
+        self.ttl = ttl
+        self.max_entry_size = max_entry_size
+        self.retry_after = retry_after
+        self.enabled = enabled
+        self.down_until = 0.0
+        self.dirty: dict[int, float] = {}
+        self._lookup = client.register_script(self.LOOKUP_SCRIPT)
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def version_key(self, user_id: int) -> str:
+        # The hash tag keeps all keys of a user on one Redis Cluster slot, as the script requires
+        return f"{self.prefix}{{{user_id}}}:v"
+
+    def _available(self) -> bool:
+        return self.enabled and time.monotonic() >= self.down_until
+
+    def _is_dirty(self, user_id: int) -> bool:
+        until = self.dirty.get(user_id)
+        if until is not None and time.monotonic() >= until:
+            del self.dirty[user_id]
+            until = None
+        return until is not None
+
+    async def _incr(self, user_id: int) -> bool:
+        try:
+            with redis_timer("response_cache_bump"):
+                await self.client.incr(self.version_key(user_id))
+        except RedisError as err:
+            self._failed("bump", err)
+            return False
+        self.dirty.pop(user_id, None)
+        return True
+
+    def _failed(self, action: str, err: Exception) -> None:
+        self.errors += 1
+        if time.monotonic() >= self.down_until:
+            logger.warning("Response cache %s failed, skipping it for %ss: %s", action, self.retry_after, err)
+        self.down_until = time.monotonic() + self.retry_after
+
+    async def get(self, route: str, user_id: int, params: tuple) -> tuple[str | None, Response | None]:
+        """
+        The get function looks up the cached response of a route for a user and parameters.
+
+        :param self: Represent the instance of the class
+        :param route: str: The name of the route
+        :param user_id: int: The owner of the contacts
+        :param params: tuple: The parameters the response depends on
+        :return: The key to store the response under, None when the cache is unavailable,
+            and the cached response or None
+        """
+        if not self._available():
+            return None, None
+        if self._is_dirty(user_id) and not await self._incr(user_id):
+            return None, None
+        head = f"{self.prefix}{{{user_id}}}:"
+        tail = f":{route}:{hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()}"
+        try:
+            with redis_timer("response_cache_get"):
+                version, *entry = await self._lookup(keys=[self.version_key(user_id)], args=[head, tail])
+        except RedisError as err:
+            self._failed("read", err)
+            response_cache_lookups.inc(route, "error")
+            return None, None
+        key = f"{head}{version.decode()}{tail}"
+        if not entry:
+            self.misses += 1
+            response_cache_lookups.inc(route, "miss")
+            return key, None
+        self.hits += 1
+        response_cache_lookups.inc(route, "hit")
+        headers, _, body = entry[0].partition(b"\n")
+        return key, Response(body, headers=orjson.loads(headers))
+
+    async def set(self, key: str | None, response: Response) -> None:
+        """
+        The set function stores a response under the key returned by get.
+        Only successful responses up to max_entry_size bytes are stored.
+
+        :param self: Represent the instance of the class
+        :param key: str | None: The key from get; nothing is stored when it is None
+        :param response: Response: The response to store
+        :return: None
+        """
+        if key is None or response.status_code != 200:
+            return
+        owner = key.removeprefix(self.prefix).partition(":")[0].strip("{}")
+        if owner.isdigit() and self._is_dirty(int(owner)):
+            # A bump failed since get: the response may not match the version in the key
+            return
+        if len(response.body) > self.max_entry_size:
+            self.skipped += 1
+            return
+        headers = {name: value for name, value in response.headers.items() if name != "content-length"}
+        try:
+            with redis_timer("response_cache_set"):
+                await self.client.set(key, orjson.dumps(headers) + b"\n" + response.body, ex=self.ttl)
+        except RedisError as err:
+            self._failed("write", err)
+
+    async def bump(self, user_id: int) -> None:
+        """
+        The bump function invalidates every cached response of a user at once by moving to a new version.
+        The version key has no expiry: if it could vanish, the version would restart from 0 and
+        could meet entries written under the same number before. The INCR is tried bump_attempts times;
+        when it keeps failing the user is marked dirty for ttl seconds.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: The owner of the contacts that changed
+        :return: None
+        """
+        if not self.enabled:
+            return
+        for _ in range(self.bump_attempts):
+            if await self._incr(user_id):
+                return
+        self.dirty[user_id] = time.monotonic() + self.ttl
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "dirty": len(self.dirty),
+        }
+
+
+redis_client = redis.Redis(
+    connection_pool=redis.ConnectionPool(host=settings.redis_host, port=settings.redis_port, db=0,
+                                         max_connections=settings.redis_max_connections)
+)
+
+user_cache = UserCache(redis_client, ttl=settings.user_cache_ttl, local_size=settings.user_cache_local_size,
+                       local_ttl=settings.user_cache_local_ttl)
+user_cache_lookups = metrics.registry.counter("user_cache_lookups_total", "User cache lookups by result.",
+                                              ("result",))
+user_cache_errors = metrics.registry.counter("user_cache_errors_total", "Failed Redis calls of the user cache.")
+user_cache_invalidations = metrics.registry.counter("user_cache_invalidations_total",
+                                                    "Local entries dropped on a change made by another worker.")
+user_cache_local_size = metrics.registry.gauge("user_cache_local_size", "Users in the local cache of the worker.")
+user_cache_pending = metrics.registry.gauge("user_cache_pending",
+                                            "Users whose Redis entry could not be dropped after a change.")
+metrics.instrument_stats(user_cache.stats, {
+    "local_hits": (user_cache_lookups, "local_hit"),
+    "redis_hits": (user_cache_lookups, "redis_hit"),
+    "misses": (user_cache_lookups, "miss"),
+    "errors": (user_cache_errors,),
+    "invalidations": (user_cache_invalidations,),
+    "local_size": (user_cache_local_size,),
+    "pending": (user_cache_pending,),
+})
+
+response_cache = ResponseCache(redis_client, ttl=settings.response_cache_ttl,
+                               max_entry_size=settings.response_cache_max_entry_size,
+                               retry_after=settings.response_cache_retry_after, enabled=settings.response_cache_enabled)
+response_cache_dirty = metrics.registry.gauge("response_cache_dirty",
+                                              "Users whose cached responses are bypassed after a failed bump.")
+metrics.instrument_stats(response_cache.stats, {"dirty": (response_cache_dirty,)})
@@ -0,0 +1,372 @@
+import codecs
+import csv
+import io
+import json
+import re
+from collections import deque
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+
+from src.database import db as database
+from src.repository import contacts as repository_contacts
+from src.schemas.contacts import ContactBase
+
+MAX_REPORTED_ERRORS = 100
+# A quoted CSV value may span this many lines or characters before its record is reported as broken;
+# a single line longer than MAX_RECORD_CHARS is reported as a broken row of any format
+MAX_RECORD_LINES = 100
+MAX_RECORD_CHARS = 64 * 1024
+LINE_TOO_LONG = f"line longer than {MAX_RECORD_CHARS} characters"
+
+VCARD_FIELDS = {"EMAIL": "email", "TEL": "phone", "BDAY": "birthday", "NOTE": "description"}
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_chars: int = MAX_RECORD_CHARS) -> AsyncIterator[str | None]:
+    """
+    The iter_lines function turns a stream of byte chunks into text lines without reading the whole body,
+    so only the current chunk and one partial line of at most max_chars characters are held in memory.
+        Only the new chunk is split; the partial line is kept as a list of pieces.
+        A longer line is dropped up to its end and yields None in its place, for the parser to report.
+
+    :param chunks: AsyncIterator[bytes]: The request body stream
+    :param max_chars: int: The longest line kept
+    :return: An async iterator over the lines, without line endings, or None for a line that was too long
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pieces = []
+    size = 0
+    skipping = False
+    async for chunk in chunks:
+        *lines, rest = decoder.decode(chunk).split("\n")
+        for line in lines:
+            if skipping:
+                skipping = False
+                continue
+            if pieces:
+                pieces.append(line)
+                line = "".join(pieces)
+                pieces, size = [], 0
+            yield line.rstrip("\r") if len(line) <= max_chars else None
+        if skipping:
+            continue
+        pieces.append(rest)
+        size += len(rest)
+        if size > max_chars:
+            pieces, size, skipping = [], 0, True
+            yield None
+    tail = "".join(pieces) + decoder.decode(b"", final=True)
+    if skipping:
+        return
+    if len(tail) > max_chars:
+        yield None
+    elif tail:
+        yield tail.rstrip("\r")
+
+
+def _in_quotes_after(line: str, inside: bool) -> bool:
+    """
+    The _in_quotes_after function tells whether a CSV record is still inside a quoted value at the end of a line,
+    following the rules of the csv module: a quote only opens a value at the start of a field
+    and a doubled quote inside a value is an escaped quote.
+
+    :param line: str: The next line of the record
+    :param inside: bool: Whether the record was inside a quoted value before this line
+    :return: Whether it is inside a quoted value after this line
+    """
+    if not inside and '"' not in line:
+        return False
+    field_start = not inside
+    index = 0
+    while index < len(line):
+        char = line[index]
+        if inside:
+            if char == '"':
+                if line.startswith('"', index + 1):
+                    index += 1
+                else:
+                    inside = False
+        elif char == '"' and field_start:
+            inside = True
+        field_start = not inside and char == ","
+        index += 1
+    return inside
+
+
+async def parse_csv(lines: AsyncIterator[str]):
+    """
+    The parse_csv function reads a CSV file with a header row naming the contact fields.
+    A quoted value may span up to MAX_RECORD_LINES lines and MAX_RECORD_CHARS characters. A record that runs
+    over is reported as an error and parsing goes on from its second line, so a stray quote costs
+    one row and never holds the rest of the file in memory.
+
+    :param lines: AsyncIterator[str]: The lines of the file
+    :return: An async iterator of (row number, record, error) tuples
+    """
+    header = None
+    pending = []
+    size = 0
+    inside = False
+    row = 0
+    replay = deque()
+    lines = aiter(lines)
+    while True:
+        if replay:
+            line = replay.popleft()
+        else:
+            try:
+                line = await anext(lines)
+            except StopAsyncIteration:
+                break
+        if line is None:
+            row += 1
+            yield row, None, LINE_TOO_LONG
+            pending, size, inside = [], 0, False
+            continue
+        pending.append(line)
+        size += len(line)
+        inside = _in_quotes_after(line, inside)
+        if inside:
+            if len(pending) < MAX_RECORD_LINES and size < MAX_RECORD_CHARS:
+                continue
+            row += 1
+            yield row, None, f"quoted value longer than {MAX_RECORD_LINES} lines or {MAX_RECORD_CHARS} characters"
+            replay.extendleft(reversed(pending[1:]))
+            pending, size, inside = [], 0, False
+            continue
+        text = "\n".join(pending)
+        pending, size = [], 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip().lower() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, None, f"expected {len(header)} columns, got {len(values)}"
+            continue
+        yield row, dict(zip(header, values)), None
+    if pending:
+        yield row + 1, None, "unterminated quoted value"
+
+
+async def parse_ndjson(lines: AsyncIterator[str]):
+    """
+    The parse_ndjson function reads one JSON object per line.
+
+    :param lines: AsyncIterator[str]: The lines of the file
+    :return: An async iterator of (row number, record, error) tuples
+    """
+    row = 0
+    async for line in lines:
+        if line is None:
+            row += 1
+            yield row, None, LINE_TOO_LONG
+            continue
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+        except ValueError as err:
+            yield row, None, f"invalid JSON: {err}"
+            continue
+        if not isinstance(record, dict):
+            yield row, None, "expected a JSON object"
+            continue
+        yield row, record, None
+
+
+def _vcard_value(value: str) -> str:
+    return re.sub(r"\\(.)", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _vcard_record(properties: list[str]) -> dict:
+    record = {}
+    for prop in properties:
+        key, _, value = prop.partition(":")
+        name = key.split(";", 1)[0].split(".")[-1].upper()
+        if name == "N":
+            parts = re.split(r"(?<!\\);", value)
+            record.setdefault("surname", _vcard_value(parts[0]))
+            if len(parts) > 1:
+                record.setdefault("name", _vcard_value(parts[1]))
+        elif name == "FN" and "name" not in record:
+            first, _, last = _vcard_value(value).partition(" ")
+            record["name"] = first
+            record.setdefault("surname", last)
+        elif name in VCARD_FIELDS:
+            field = VCARD_FIELDS[name]
+            value = _vcard_value(value)
+            if field == "birthday" and re.fullmatch(r"\d{8}", value):
+                value = f"{value[:4]}-{value[4:6]}-{value[6:]}"
+            record.setdefault(field, value)
+    return record
+
+
+async def parse_vcard(lines: AsyncIterator[str]):
+    """
+    The parse_vcard function reads vCard 3.0/4.0 cards.
+        N (or FN) gives the name and surname, and the first EMAIL, TEL, BDAY and NOTE
+        give the email, phone, birthday and description. Folded lines are unfolded.
+
+    :param lines: AsyncIterator[str]: The lines of the file
+    :return: An async iterator of (row number, record, error) tuples
+    """
+    properties = None
+    row = 0
+    async for line in lines:
+        if line is None:
+            if properties is not None:
+                row += 1
+                yield row, None, LINE_TOO_LONG
+            properties = None
+            continue
+        if line[:1] in (" ", "\t"):
+            if properties:
+                properties[-1] += line[1:]
+            continue
+        upper = line.strip().upper()
+        if upper == "BEGIN:VCARD":
+            properties = []
+        elif upper == "END:VCARD":
+            if properties is not None:
+                row += 1
+                yield row, _vcard_record(properties), None
+            properties = None
+        elif properties is not None and line.strip():
+            properties.append(line)
+    if properties is not None:
+        yield row + 1, None, "missing END:VCARD"
+
+
+PARSERS = {
+    "csv": parse_csv,
+    "ndjson": parse_ndjson,
+    "vcf": parse_vcard,
+}
+
+
+def _validation_messages(err: ValidationError) -> list[str]:
+    return [f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in err.errors()]
+
+
+async def import_contacts(chunks: AsyncIterator[bytes], file_format: str, db, user_id: int,
+                          batch_size: int) -> dict:
+    """
+    The import_contacts function parses an uploaded address book as it streams in, validates each row
+    against the writable fields of ContactModel and inserts the valid ones batch_size rows at a time.
+        A missing description is stored as an empty string. Memory use depends on batch_size only;
+        at most MAX_REPORTED_ERRORS row errors are listed in the report.
+
+    :param chunks: AsyncIterator[bytes]: The request body stream
+    :param file_format: str: One of csv, ndjson or vcf
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: The owner of the contacts
+    :param batch_size: int: The number of rows per INSERT
+    :return: A dictionary matching ContactImportReport
+    """
+    report = {"received": 0, "inserted": 0, "failed": 0, "errors": [], "errors_truncated": False}
+
+    def fail(row, messages):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"row": row, "errors": messages})
+        else:
+            report["errors_truncated"] = True
+
+    batch = []
+    async for row, record, error in PARSERS[file_format](iter_lines(chunks)):
+        report["received"] += 1
+        if error is not None:
+            fail(row, [error])
+            continue
+        record.setdefault("description", "")
+        try:
+            contact = ContactBase.model_validate(record)
+        except ValidationError as err:
+            fail(row, _validation_messages(err))
+            continue
+        batch.append(contact.model_dump())
+        if len(batch) >= batch_size:
+            report["inserted"] += await repository_contacts.create_many(batch, db, user_id)
+            batch = []
+    report["inserted"] += await repository_contacts.create_many(batch, db, user_id)
+    return report
+
+
+EXPORT_FIELDS = ("id", "name", "surname", "email", "phone", "birthday", "description", "created_at", "updated_at")
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "vcf": "text/vcard; charset=utf-8",
+}
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _ndjson_batch(rows) -> str:
+    return "".join(
+        json.dumps({field: _iso(value) if field in ("birthday", "created_at", "updated_at") else value
+                    for field, value in zip(EXPORT_FIELDS, row)}, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def _csv_batch(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue()
+
+
+def _vcard_escape(value) -> str:
+    return re.sub(r"([\\,;])", r"\\\1", str(value or "")).replace("\n", "\\n")
+
+
+def _vcard_batch(rows) -> str:
+    cards = []
+    for contact_id, name, surname, email, phone, birthday, description, _, updated_at in rows:
+        full_name = f"{name or ''} {surname or ''}".strip()
+        lines = [
+            "BEGIN:VCARD",
+            "VERSION:3.0",
+            f"UID:contact-{contact_id}",
+            f"N:{_vcard_escape(surname)};{_vcard_escape(name)};;;",
+            f"FN:{_vcard_escape(full_name)}",
+            f"EMAIL:{_vcard_escape(email)}",
+            f"TEL:{_vcard_escape(phone)}",
+        ]
+        if birthday:
+            lines.append(f"BDAY:{birthday.isoformat()}")
+        if description:
+            lines.append(f"NOTE:{_vcard_escape(description)}")
+        if updated_at:
+            lines.append(f"REV:{updated_at.strftime('%Y%m%dT%H%M%S')}")
+        lines.append("END:VCARD")
+        cards.append("\r\n".join(lines) + "\r\n")
+    return "".join(cards)
+
+
+async def export_contacts(db, user_id: int, file_format: str, batch_size: int) -> AsyncIterator[bytes]:
+    """
+    The export_contacts function renders all contacts of a user as csv, ndjson or vcf while they are read
+    from a server-side cursor, one batch_size chunk at a time, and closes the session when done.
+
+    :param db: Session: Pass the database session to the function
+    :param user_id: int: The owner of the contacts
+    :param file_format: str: One of csv, ndjson or vcf
+    :param batch_size: int: The number of rows fetched and rendered at a time
+    :return: An async iterator over encoded chunks of the file
+    """
+    render = {"csv": _csv_batch, "ndjson": _ndjson_batch, "vcf": _vcard_batch}[file_format]
+    try:
+        if file_format == "csv":
+            yield _csv_batch([EXPORT_FIELDS]).encode()
+        async for rows in repository_contacts.stream_contacts(db, user_id, batch_size):
+            yield render(rows).encode()
+    finally:
+        await database.close(db)
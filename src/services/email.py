@@ -1,25 +1,198 @@
+import asyncio
+import logging
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
 
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import EmailStr
 
 from src.conf.config import settings
+from src.services import metrics
 from src.services.auth import auth_service
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.mail_username,
-    MAIL_PASSWORD=settings.mail_password,
-    MAIL_FROM=settings.mail_from,
-    MAIL_PORT=settings.mail_port,
-    MAIL_SERVER=settings.mail_server,
-    MAIL_FROM_NAME="Desired Name",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
+logger = logging.getLogger(__name__)
+
+templates = Environment(loader=FileSystemLoader(Path(__file__).parent / 'templates'),
+                        autoescape=select_autoescape(["html"]))
+
+confirm_template = templates.get_template("email_template.html")
+
+
+class EmailDispatcher:
+    """
+    Sends queued messages over a small pool of persistent SMTP connections.
+    Each worker keeps its connection open between messages, takes up to batch_size messages
+    from the queue at a time and closes the connection after idle_timeout seconds without mail.
+    A failed send reconnects and is retried with exponential backoff; when the queue is full
+    new messages are dropped, the user can ask for the confirmation email again.
+    """
+
+    def __init__(self, hostname: str, port: int, username: str | None, password: str | None, use_tls: bool,
+                 start_tls: bool, validate_certs: bool, workers: int, queue_size: int, batch_size: int,
+                 max_retries: int, retry_backoff: float, idle_timeout: float):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.start_tls = start_tls
+        self.validate_certs = validate_certs
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.idle_timeout = idle_timeout
+        self.queue: asyncio.Queue[EmailMessage] = asyncio.Queue(maxsize=queue_size)
+        self.tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.connections = 0
+
+    def enqueue(self, message: EmailMessage) -> bool:
+        """
+        The enqueue function puts a message on the queue without waiting.
+
+        :param self: Represent the instance of the class
+        :param message: EmailMessage: The message to send
+        :return: False when the queue is full and the message was dropped
+        """
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Email queue is full, dropping the message to %s", message["To"])
+            return False
+        return True
+
+    def _client(self) -> aiosmtplib.SMTP:
+        return aiosmtplib.SMTP(hostname=self.hostname, port=self.port, username=self.username,
+                               password=self.password, use_tls=self.use_tls, start_tls=self.start_tls,
+                               validate_certs=self.validate_certs)
+
+    async def _close(self, smtp: aiosmtplib.SMTP | None) -> None:
+        if smtp is None or not smtp.is_connected:
+            return
+        try:
+            await smtp.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            smtp.close()
+
+    async def _send(self, smtp: aiosmtplib.SMTP | None, message: EmailMessage) -> aiosmtplib.SMTP | None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                if smtp is None or not smtp.is_connected:
+                    smtp = self._client()
+                    await smtp.connect()
+                    self.connections += 1
+                await smtp.send_message(message)
+                self.sent += 1
+                return smtp
+            except (aiosmtplib.SMTPException, OSError) as err:
+                await self._close(smtp)
+                smtp = None
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    logger.error("Sending email to %s failed: %s", message["To"], err)
+                    return None
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+            except Exception:
+                # E.g. a malformed message: retrying will not help, but the worker must keep going
+                await self._close(smtp)
+                self.failed += 1
+                logger.exception("Sending email to %s failed", message["To"])
+                return None
+
+    async def _worker(self) -> None:
+        smtp = None
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    await self._close(smtp)
+                    smtp = None
+                    continue
+                batch = [message]
+                while len(batch) < self.batch_size and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                for message in batch:
+                    try:
+                        smtp = await self._send(smtp, message)
+                    finally:
+                        self.queue.task_done()
+        finally:
+            await self._close(smtp)
+
+    def start(self) -> None:
+        """
+        The start function starts the workers. It is called once per process on startup.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5) -> None:
+        """
+        The stop function waits up to timeout seconds for the queued messages to be sent,
+        then stops the workers and closes their connections.
+
+        :param self: Represent the instance of the class
+        :param timeout: float: The seconds to wait for the queue to drain
+        :return: None
+        """
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %s emails still queued", self.queue.qsize())
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "connections": self.connections,
+        }
+
+
+email_dispatcher = EmailDispatcher(
+    hostname=settings.mail_server,
+    port=settings.mail_port,
+    username=settings.mail_username if settings.mail_use_credentials else None,
+    password=settings.mail_password if settings.mail_use_credentials else None,
+    use_tls=settings.mail_ssl_tls,
+    start_tls=settings.mail_starttls,
+    validate_certs=settings.mail_validate_certs,
+    workers=settings.mail_workers,
+    queue_size=settings.mail_queue_size,
+    batch_size=settings.mail_batch_size,
+    max_retries=settings.mail_max_retries,
+    retry_backoff=settings.mail_retry_backoff,
+    idle_timeout=settings.mail_idle_timeout,
 )
+email_queued = metrics.registry.gauge("email_queued", "Messages waiting to be sent.")
+email_messages = metrics.registry.counter("email_messages_total", "Messages by outcome.", ("result",))
+email_retries = metrics.registry.counter("email_retries_total", "Send attempts that were retried.")
+email_connections = metrics.registry.counter("email_connections_total", "SMTP connections opened.")
+metrics.instrument_stats(email_dispatcher.stats, {
+    "queued": (email_queued,),
+    "sent": (email_messages, "sent"),
+    "failed": (email_messages, "failed"),
+    "dropped": (email_messages, "dropped"),
+    "retries": (email_retries,),
+    "connections": (email_connections,),
+})
 
 
 async def send_email(email: EmailStr, username: str, host: str):
@@ -29,22 +202,19 @@ async def send_email(email: EmailStr, username: str, host: str):
             -email: EmailStr, the user's email address.
             -username: str, the username of the user who is registering for an account.  This will be used in a greeting message within the body of the email sent to them.
             -host: str, this is where we are hosting our application (i.e., localhost).  This will be used as part of a URL that they can click on within their browser.
+        The message is rendered with the precompiled template and put on the queue of the email dispatcher,
+        which delivers it over a pooled SMTP connection.
 
     :param email: EmailStr: Specify the email address of the recipient
     :param username: str: Pass the username to the template
     :param host: str: Pass the hostname of the server to be used in the email template
     :return: A coroutine object
     """
-    try:
-        token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+    token_verification = auth_service.create_email_token({"sub": email})
+    message = EmailMessage()
+    message["Subject"] = "Confirm your email "
+    message["From"] = formataddr((settings.mail_from_name, settings.mail_from))
+    message["To"] = email
+    message.set_content(confirm_template.render(host=str(host), username=username, token=token_verification),
+                        subtype="html")
+    email_dispatcher.enqueue(message)
@@ -0,0 +1,46 @@
+import hashlib
+
+from fastapi import Response, status
+
+# Clients may keep the response but must ask again, with If-None-Match, before using it
+CACHE_CONTROL = "private, no-cache"
+
+
+def weak_etag(*parts) -> str:
+    """
+    The weak_etag function hashes the parts that identify a representation into a weak ETag.
+        Weak, because the same state may be rendered to slightly different bytes
+        (e.g. with response validation on or off).
+
+    :param parts: The values the representation depends on, e.g. the contact id and its updated_at
+    :return: The ETag, e.g. W/"1b2c3d4e5f6a7b8c"
+    """
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    The etag_matches function checks an If-None-Match header against the current ETag
+    with the weak comparison RFC 9110 prescribes for it.
+
+    :param if_none_match: str | None: The header sent by the client
+    :param etag: str: The current ETag
+    :return: True when the client already has the current representation
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    """
+    The not_modified function builds the bodiless 304 answer to a matching If-None-Match.
+
+    :param etag: str: The current ETag
+    :return: The response
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
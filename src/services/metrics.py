@@ -0,0 +1,361 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlalchemy import event
+
+from src.conf.config import settings
+from src.services.timing import record
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Metric:
+    """
+    A metric with one value per combination of label values.
+    Most updates come from the event loop, but the pool listeners of the sync engine run in the
+    threadpool, so every update and the snapshot hold the lock of the metric.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values: dict[tuple, float | list] = {}
+        self.lock = threading.Lock()
+
+    def snapshot(self) -> list:
+        with self.lock:
+            return [[list(labels), list(value) if isinstance(value, list) else value]
+                    for labels, value in self.values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """
+    Each value is a list of per-bucket counts, with the overflow bucket last, followed by the sum.
+    Buckets are only made cumulative when rendered, so an observation touches two list items.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels) -> None:
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bucket] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Holds the metrics of one worker and renders them in the Prometheus text format.
+
+    With several uvicorn workers, each one writes a JSON snapshot of its metrics into
+    settings.metrics_dir every metrics_flush_interval seconds, and the worker that answers
+    /metrics adds up the snapshots of all of them. A snapshot not rewritten for STALE_INTERVALS
+    flush intervals belongs to a worker that exited or hangs, and is left out, so its gauges
+    do not stay in the sum forever. The directory has to be emptied before the workers start,
+    otherwise the numbers of a previous run are added too.
+    """
+
+    STALE_INTERVALS = 3
+
+    def __init__(self, directory: str | None = None, flush_interval: float = 5):
+        self.metrics: dict[str, Metric] = {}
+        self.collectors = []
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        """
+        The snapshot function runs the collectors, which read values such as the pool size on demand,
+        and returns the values of all metrics as plain lists.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of metric name to a list of [labels, value] pairs
+        """
+        for collect in self.collectors:
+            collect()
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def _path(self) -> Path:
+        return self.directory / f"{os.getpid()}.json"
+
+    def flush(self) -> None:
+        """
+        The flush function writes the snapshot of this worker into the metrics directory.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        partial = self._path().with_suffix(".tmp")
+        partial.write_text(json.dumps(self.snapshot()))
+        os.replace(partial, self._path())
+
+    async def run(self) -> None:
+        """
+        The run function flushes the snapshot every flush_interval seconds, when a metrics directory is set.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        while True:
+            try:
+                self.flush()
+            except OSError as err:
+                logger.warning("Writing the metrics snapshot failed: %s", err)
+            await asyncio.sleep(self.flush_interval)
+
+    def merged(self) -> dict:
+        """
+        The merged function adds up the snapshot of this worker and the ones the other live workers wrote.
+
+        :param self: Represent the instance of the class
+        :return: A dictionary of metric name to a dictionary of labels to value
+        """
+        snapshots = [self.snapshot()]
+        if self.directory is not None and self.directory.is_dir():
+            stale_before = time.time() - self.STALE_INTERVALS * self.flush_interval
+            for path in self.directory.glob("*.json"):
+                if path == self._path():
+                    continue
+                try:
+                    if path.stat().st_mtime < stale_before:
+                        continue
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue
+        merged = {name: {} for name in self.metrics}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                if name not in merged:
+                    continue
+                for labels, value in values:
+                    labels = tuple(labels)
+                    current = merged[name].get(labels)
+                    if current is None:
+                        merged[name][labels] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        merged[name][labels] = [a + b for a, b in zip(current, value)]
+                    else:
+                        merged[name][labels] = current + value
+        return merged
+
+    def render(self) -> str:
+        """
+        The render function returns the metrics of all workers in the Prometheus text exposition format.
+
+        :param self: Represent the instance of the class
+        :return: The body of the /metrics response
+        """
+        lines = []
+        for name, values in self.merged().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(values.items()):
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{_labels(metric.labelnames, labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                    lines.append(f"{name}_bucket{_labels(metric.labelnames, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(metric.labelnames, labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(metric.labelnames, labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(settings.metrics_dir, settings.metrics_flush_interval)
+
+http_requests = registry.counter("http_requests_total", "HTTP requests by route, method and status code.",
+                                 ("method", "route", "status"))
+http_latency = registry.histogram("http_request_duration_seconds", "Time to the end of the response body.",
+                                  ("method", "route"))
+http_in_flight = registry.gauge("http_requests_in_flight", "Requests being handled.", ("method",))
+db_pool_checkouts = registry.counter("db_pool_checkouts_total", "Connections taken from the pool.", ("pool",))
+db_pool_checked_out = registry.gauge("db_pool_checked_out", "Connections currently taken from the pool.", ("pool",))
+db_pool_size = registry.gauge("db_pool_size", "Configured size of the connection pool.", ("pool",))
+db_pool_overflow = registry.gauge("db_pool_overflow", "Connections open beyond the pool size.", ("pool",))
+redis_latency = registry.histogram("redis_command_duration_seconds", "Redis round trips by operation.",
+                                   ("operation",), FAST_BUCKETS)
+redis_errors = registry.counter("redis_errors_total", "Failed Redis round trips by operation.", ("operation",))
+
+
+@contextmanager
+def redis_timer(operation: str):
+    """
+    The redis_timer function times one Redis round trip and counts it as failed when it raises.
+    The time is also added to the redis phase of the Server-Timing header.
+
+    :param operation: str: The name of the operation, used as the label
+    :return: A context manager
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        redis_errors.inc(operation)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        redis_latency.observe(elapsed, operation)
+        record("redis", elapsed)
+
+
+def instrument_pool(engine, name: str = "primary") -> None:
+    """
+    The instrument_pool function counts the connections taken from the pool of an engine
+    and reads its size and overflow whenever the metrics are collected.
+
+    :param engine: Engine | AsyncEngine: The engine to instrument
+    :param name: str: The value of the pool label, e.g. primary or replica1
+    :return: None
+    """
+    pool = getattr(engine, "sync_engine", engine).pool
+
+    @event.listens_for(pool, "checkout")
+    def on_checkout(*args):
+        db_pool_checkouts.inc(name)
+
+    def collect():
+        for gauge, attribute in ((db_pool_checked_out, "checkedout"), (db_pool_size, "size"),
+                                 (db_pool_overflow, "overflow")):
+            if hasattr(pool, attribute):
+                gauge.set(getattr(pool, attribute)(), name)
+
+    registry.collectors.append(collect)
+
+
+def instrument_stats(stats, fields: dict) -> None:
+    """
+    The instrument_stats function exports the stats a component keeps for itself whenever the metrics are collected.
+        Counters take the running totals of the worker as they are, gauges the current levels.
+
+    :param stats: Callable[[], dict]: Returns the stats, e.g. the stats method of the component
+    :param fields: dict: Maps a key of the stats to a tuple of the metric and its label values
+    :return: None
+    """
+    def collect():
+        values = stats()
+        for key, (metric, *labels) in fields.items():
+            with metric.lock:
+                metric.values[tuple(labels)] = float(values[key]) if isinstance(values[key], bool) else values[key]
+
+    registry.collectors.append(collect)
+
+
+class MetricsMiddleware:
+    """
+    A pure ASGI middleware that records the latency, the status code and the in-flight count of each request,
+    labelled with the route template (e.g. /api/contact/{contact_id}) rather than the raw path.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        start = time.perf_counter()
+        status_code = 500
+        http_in_flight.inc(method)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec(method)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            http_requests.inc(method, route, status_code)
+            http_latency.observe(time.perf_counter() - start, method, route)
@@ -0,0 +1,33 @@
+import base64
+import binascii
+import json
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    The encode_cursor function turns the id of the last row on a page into an opaque cursor
+    that the client passes back to get the next page.
+
+    :param last_id: int: The id of the last contact on the page
+    :return: A url-safe cursor string
+    """
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    The decode_cursor function is the inverse of encode_cursor.
+    It raises ValueError when the cursor was not produced by encode_cursor.
+
+    :param cursor: str: The cursor sent by the client
+    :return: The id of the last contact on the previous page
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_id = json.loads(raw)["id"]
+    except (binascii.Error, ValueError, TypeError, KeyError) as err:
+        raise ValueError("Invalid cursor") from err
+    if not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
+    return last_id
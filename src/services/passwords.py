@@ -0,0 +1,130 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from src.conf.config import settings
+from src.services import metrics
+
+SCHEMES = ("bcrypt", "argon2")
+
+password_hash_in_flight = metrics.registry.gauge("password_hash_in_flight",
+                                                 "Password hashes and checks waiting or running.")
+password_hash_queue_depth = metrics.registry.gauge("password_hash_queue_depth",
+                                                   "Password hashes and checks waiting for a thread.")
+password_hash_total = metrics.registry.counter("password_hash_total", "Password hashes and checks by result.",
+                                               ("result",))
+password_hash_seconds = metrics.registry.counter("password_hash_seconds_total",
+                                                 "Time spent on password hashes and checks, waiting included.")
+
+
+def build_password_context(scheme: str | None = None) -> CryptContext:
+    """
+    The build_password_context function creates the passlib context from the settings.
+        scheme is used for new hashes; hashes made with the other scheme, or with a different cost,
+        still verify but are reported as needing an update.
+
+    :param scheme: str | None: bcrypt or argon2, defaults to settings.password_scheme
+    :return: A CryptContext
+    """
+    scheme = scheme or settings.password_scheme
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown password scheme '{scheme}'")
+    return CryptContext(
+        schemes=[scheme] + [other for other in SCHEMES if other != scheme],
+        deprecated="auto",
+        bcrypt__default_rounds=settings.password_bcrypt_rounds,
+        bcrypt__min_rounds=settings.password_bcrypt_rounds,
+        bcrypt__max_rounds=settings.password_bcrypt_rounds,
+        argon2__time_cost=settings.password_argon2_time_cost,
+        argon2__memory_cost=settings.password_argon2_memory_cost,
+        argon2__parallelism=settings.password_argon2_parallelism,
+    )
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a dedicated thread pool, so a login never blocks the event loop.
+    At most max_pending operations may be waiting or running; beyond that the request is refused with 503.
+    Everything but the pool itself is touched only from the event loop, so the counters need no locking.
+    """
+
+    def __init__(self, context: CryptContext, workers: int, max_pending: int):
+        self.context = context
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(0, self.in_flight - self.workers)
+
+    async def _run(self, fn, *args):
+        if self.in_flight >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail="Too many password checks in progress, retry later",
+                                headers={"Retry-After": "1"})
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.seconds += time.perf_counter() - start
+
+    async def hash(self, password: str) -> str:
+        """
+        The hash function hashes a password with the current scheme and cost.
+
+        :param self: Represent the instance of the class
+        :param password: str: The plain-text password
+        :return: The hash to store
+        """
+        return await self._run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        The verify_and_update function checks a password against its stored hash.
+        When the password is correct but the hash uses an old scheme or cost, it also returns a new hash.
+
+        :param self: Represent the instance of the class
+        :param password: str: The plain-text password
+        :param hashed_password: str: The stored hash
+        :return: A tuple of whether the password matches and the replacement hash or None
+        """
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "seconds": self.seconds,
+        }
+
+    def instrument(self) -> None:
+        """
+        The instrument function exports the stats of the hasher through the metrics registry.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        metrics.instrument_stats(self.stats, {
+            "in_flight": (password_hash_in_flight,),
+            "queue_depth": (password_hash_queue_depth,),
+            "completed": (password_hash_total, "completed"),
+            "rejected": (password_hash_total, "rejected"),
+            "seconds": (password_hash_seconds,),
+        })
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
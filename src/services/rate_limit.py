@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import redis.asyncio as redis
+from fastapi import Depends, HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.services.auth import auth_service
+from src.services.cache import redis_client
+from src.services import metrics
+from src.services.metrics import redis_timer
+from src.services.timing import span
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class Bucket:
+    capacity: float
+    tokens: float
+    updated: float
+
+
+class RateLimiter:
+    """
+    A token bucket per user and route, kept in process so a check costs no network I/O.
+    A bucket holds up to the route limit and refills at limit / window tokens per second.
+
+    Every sync_interval seconds the requests let through since the last sync are added to a
+    per-window counter in Redis in one pipeline, and each bucket is capped by what is left of the limit
+    across all workers. Between syncs the workers may together let a few more requests through than the limit.
+    While Redis is unreachable the limiter keeps working with the local buckets only.
+    """
+
+    prefix = "ratelimit:"
+
+    def __init__(self, client: redis.Redis, times: int, window: int, routes: dict[str, int],
+                 tiers: dict[str, float], user_tiers: dict[str, str], sync_interval: float, max_buckets: int):
+        self.client = client
+        self.times = times
+        self.window = window
+        self.routes = routes
+        self.tiers = tiers
+        self.user_tiers = user_tiers
+        self.sync_interval = sync_interval
+        self.max_buckets = max_buckets
+        self.buckets: OrderedDict[tuple[str, int], Bucket] = OrderedDict()
+        self.pending: dict[tuple[str, int], int] = {}
+        self.local_only = False
+        self.allowed = 0
+        self.rejected = 0
+        self.syncs = 0
+        self.errors = 0
+
+    def limit_for(self, route: str, user) -> float:
+        """
+        The limit_for function returns how many requests a user may make to a route per window:
+        the route limit, or the default one, times the multiplier of the tier of the user.
+
+        :param self: Represent the instance of the class
+        :param route: str: The name of the route
+        :param user: The current user
+        :return: The number of requests per window
+        """
+        tier = self.user_tiers.get(user.email, "default")
+        return self.routes.get(route, self.times) * self.tiers.get(tier, 1.0)
+
+    def hit(self, route: str, user) -> float | None:
+        """
+        The hit function takes a token from the bucket of the user for the route.
+
+        :param self: Represent the instance of the class
+        :param route: str: The name of the route
+        :param user: The current user
+        :return: None when the request may go on, otherwise the seconds until a token is available
+        """
+        now = time.monotonic()
+        key = (route, user.id)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            capacity = self.limit_for(route, user)
+            bucket = self.buckets[key] = Bucket(capacity, capacity, now)
+            if len(self.buckets) > self.max_buckets:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket.tokens = min(bucket.capacity, bucket.tokens + (now - bucket.updated) * bucket.capacity / self.window)
+            bucket.updated = now
+        if bucket.tokens < 1:
+            self.rejected += 1
+            return (1 - bucket.tokens) * self.window / bucket.capacity
+        bucket.tokens -= 1
+        self.allowed += 1
+        self.pending[key] = self.pending.get(key, 0) + 1
+        return None
+
+    async def sync(self) -> None:
+        """
+        The sync function adds the requests let through since the last sync to the shared counters in Redis
+        and caps every synced bucket by what the other workers have used in the current window.
+        The pending counts are dropped when Redis fails: the limits are approximate anyway.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        window_id = int(time.time() // self.window)
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for (route, user_id), count in pending.items():
+                    counter = f"{self.prefix}{route}:{user_id}:{window_id}"
+                    pipe.incrby(counter, count)
+                    pipe.expire(counter, self.window * 2)
+                with redis_timer("rate_limit_sync"):
+                    results = await pipe.execute()
+        except (RedisError, OSError) as err:
+            self.errors += 1
+            if not self.local_only:
+                logger.warning("Rate limiter sync failed, using local limits only: %s", err)
+            self.local_only = True
+            return
+        self.local_only = False
+        self.syncs += 1
+        for key, used in zip(pending, results[::2]):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.tokens = min(bucket.tokens, bucket.capacity - used)
+
+    async def run(self) -> None:
+        """
+        The run function syncs the buckets every sync_interval seconds for the lifetime of the worker.
+
+        :param self: Represent the instance of the class
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync()
+
+    def depends(self, route: str):
+        """
+        The depends function builds the dependency that limits a route.
+        It answers 429 with a Retry-After header once the bucket of the current user is empty.
+
+        :param self: Represent the instance of the class
+        :param route: str: The name of the route, used to look up its limit in the settings
+        :return: A dependency for the dependencies list of the route
+        """
+        async def check(current_user=Depends(auth_service.get_current_user)):
+            with span("ratelimit"):
+                retry_after = self.hit(route, current_user)
+            if retry_after is not None:
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                                    headers={"Retry-After": str(math.ceil(retry_after))})
+
+        return check
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "syncs": self.syncs,
+            "errors": self.errors,
+            "local_only": self.local_only,
+            "buckets": len(self.buckets),
+        }
+
+
+rate_limiter = RateLimiter(redis_client, times=settings.rate_limit_times, window=settings.rate_limit_window,
+                           routes=settings.rate_limit_routes, tiers=settings.rate_limit_tiers,
+                           user_tiers=settings.rate_limit_user_tiers, sync_interval=settings.rate_limit_sync_interval,
+                           max_buckets=settings.rate_limit_max_buckets)
+rate_limit_requests = metrics.registry.counter("rate_limit_requests_total", "Rate-limited requests by result.",
+                                               ("result",))
+rate_limit_syncs = metrics.registry.counter("rate_limit_syncs_total", "Bucket syncs with Redis.")
+rate_limit_errors = metrics.registry.counter("rate_limit_errors_total", "Failed bucket syncs with Redis.")
+rate_limit_local_only = metrics.registry.gauge("rate_limit_local_only",
+                                               "Workers limiting on their own buckets while Redis is unreachable.")
+rate_limit_buckets = metrics.registry.gauge("rate_limit_buckets", "Buckets held in memory.")
+metrics.instrument_stats(rate_limiter.stats, {
+    "allowed": (rate_limit_requests, "allowed"),
+    "rejected": (rate_limit_requests, "rejected"),
+    "syncs": (rate_limit_syncs,),
+    "errors": (rate_limit_errors,),
+    "local_only": (rate_limit_local_only,),
+    "buckets": (rate_limit_buckets,),
+})
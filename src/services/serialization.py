@@ -0,0 +1,45 @@
+from typing import Iterable, List
+
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+
+from src.conf.config import settings
+from src.schemas.contacts import ContactResponse
+from src.services.timing import span
+
+CONTACT_FIELDS = tuple(ContactResponse.model_fields)
+
+contact_list_adapter = TypeAdapter(List[ContactResponse])
+
+
+def contact_rows(contacts: Iterable) -> list[dict]:
+    """
+    The contact_rows function copies the ContactResponse fields of each contact into a plain dictionary.
+        Nothing is validated: the rows come from our own database, which already holds valid data.
+
+    :param contacts: Iterable: Contact objects or rows with the ContactResponse fields
+    :return: A list of dictionaries
+    """
+    return [{field: getattr(contact, field) for field in CONTACT_FIELDS} for contact in contacts]
+
+
+def contacts_response(contacts: Iterable, headers: dict | None = None) -> Response:
+    """
+    The contacts_response function renders a list of contacts straight to JSON with orjson,
+    skipping the per-row validation FastAPI does for response_model, which dominates the time of a 500-row page.
+        With settings.response_validation on, the rows go through the prebuilt List[ContactResponse] adapter
+        instead, so tests catch any drift between the model and the schema.
+
+    :param contacts: Iterable: Contact objects
+    :param headers: dict | None: Extra response headers
+    :return: The JSON response
+    """
+    with span("serialize"):
+        if settings.response_validation:
+            content = contact_list_adapter.dump_json(
+                contact_list_adapter.validate_python(contacts, from_attributes=True))
+        else:
+            content = orjson.dumps(contact_rows(contacts))
+    return Response(content, media_type=ORJSONResponse.media_type, headers=headers)
@@ -0,0 +1,93 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# name -> [seconds, count] for the request being handled, or None when it is not sampled
+_timings: ContextVar[dict | None] = ContextVar("server_timing", default=None)
+
+
+def record(name: str, seconds: float) -> None:
+    """
+    The record function adds the duration of one phase to the timings of the current request.
+    It does nothing outside a sampled request.
+
+    :param name: str: The name of the phase, e.g. db or redis
+    :param seconds: float: How long it took
+    :return: None
+    """
+    timings = _timings.get()
+    if timings is None:
+        return
+    entry = timings.get(name)
+    if entry is None:
+        timings[name] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def span(name: str):
+    """
+    The span function times the block it wraps and records it under name.
+    Spans may nest; the outer one includes the time of the inner ones.
+
+    :param name: str: The name of the phase
+    :return: A context manager
+    """
+    if _timings.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def header_value(timings: dict, total: float) -> str:
+    """
+    The header_value function formats the timings as a Server-Timing header, in milliseconds.
+
+    :param timings: dict: The recorded phases
+    :param total: float: The time from the start of the request to the response headers
+    :return: The value of the header
+    """
+    parts = [f'{name};dur={seconds * 1000:.2f};desc="{count}x"' for name, (seconds, count) in timings.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class ServerTimingMiddleware:
+    """
+    A pure ASGI middleware that collects the spans of a request and sends them in the Server-Timing header,
+    where browser devtools show them, and logs them. Only a sample_rate share of the requests is timed.
+    """
+
+    def __init__(self, app, sample_rate: float = 1.0):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                value = header_value(timings, time.perf_counter() - start)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", value.encode())]
+                logger.info("%s %s %s Server-Timing: %s", scope["method"], scope["path"], message["status"], value)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
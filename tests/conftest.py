@@ -1,11 +1,13 @@
 
+from unittest.mock import patch
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from main import app
-from src.database.models import Base
+from src.database.models import Base, Users
 from src.database.db import get_db
 
 
@@ -51,6 +53,19 @@ def user():
     return {"username": "deadpool", "email": "deadpool@example.com", "password": "123456789"}
 
 
+
+@pytest.fixture(scope="module")
+def token(client, session, user):
+    with patch("src.routes.auth.send_email"):
+        client.post("/api/auth/signup", json=user)
+    current_user = session.query(Users).filter(Users.email == user.get('email')).first()
+    current_user.confirmed = True
+    session.commit()
+    response = client.post("/api/auth/login",
+                           data={"username": user.get('email'), "password": user.get('password')})
+    return response.json()["access_token"]
+
+
 # pytest --cov=. tests/
 # pytest --cov=. --cov-report html tests/
 # pytest --cov-report html
@@ -0,0 +1,15 @@
+from unittest.mock import patch
+
+from src.conf.config import settings
+
+
+def test_pool_diagnostics(client, token, user):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/admin/pool", headers=headers)
+    assert response.status_code == 403, response.text
+    with patch.object(settings, "admin_emails", [user["email"]]):
+        response = client.get("/api/admin/pool", headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["pools"][0]["name"] == "primary"
+    assert data["config"]["connections_per_worker"] == settings.database_pool_size + settings.database_max_overflow
@@ -0,0 +1,77 @@
+def test_rate_limit(client, token):
+    from src.services.rate_limit import rate_limiter
+
+    headers = {"Authorization": f"Bearer {token}"}
+    for _ in range(rate_limiter.times):
+        response = client.get("/api/contact/", headers=headers)
+        assert response.status_code != 429, response.text
+    response = client.get("/api/contact/", headers=headers)
+    assert response.status_code == 429, response.text
+    assert int(response.headers["Retry-After"]) > 0
+    rate_limiter.buckets.clear()
+
+
+def test_search_unsupported_database(client, token):
+    from unittest.mock import AsyncMock, patch
+
+    with patch("src.repository.contacts.search_contacts",
+               AsyncMock(side_effect=NotImplementedError("Contact search is not supported on mysql"))):
+        response = client.get("/api/contact/search", params={"q": "john"},
+                              headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 501, response.text
+    assert response.json()["detail"] == "Contact search is not supported on mysql"
+
+
+def test_get_contacts_page(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    for number in range(3):
+        response = client.post("/api/contact/", headers=headers, json={
+            "id": 0, "name": f"Wade{number}", "surname": "Wilson", "email": f"wade{number}@example.com",
+            "phone": "123", "birthday": "1990-02-01", "description": "", "created_at": "2023-10-01T00:00:00",
+            "updated_at": "2023-10-01T00:00:00"})
+        assert response.status_code == 201, response.text
+    response = client.get("/api/contact/", headers=headers, params={"limit": 2})
+    assert response.status_code == 200, response.text
+    assert [contact["name"] for contact in response.json()] == ["Wade0", "Wade1"]
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get("/api/contact/", headers=headers, params={"limit": 2, "cursor": cursor})
+    assert [contact["name"] for contact in response.json()] == ["Wade2"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_contacts_queries(client, session, token):
+    from src.database.instrumentation import assert_max_queries
+
+    client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    with assert_max_queries(session.get_bind(), 1):
+        response = client.get("/api/contact/", headers={"Authorization": f"Bearer {token}"}, params={"limit": 500})
+    assert response.status_code == 200, response.text
+
+
+def test_get_contacts_etag(client, session, token):
+    from src.database.instrumentation import assert_max_queries
+
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/contact/", headers=headers)
+    assert response.status_code == 200, response.text
+    etag = response.headers["ETag"]
+    with assert_max_queries(session.get_bind(), 1):
+        response = client.get("/api/contact/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+    response = client.get("/api/contact/", headers={**headers, "If-None-Match": etag}, params={"limit": 2})
+    assert response.status_code == 200, response.text
+
+    contact_id = response.json()[0]["id"]
+    response = client.get(f"/api/contact/{contact_id}", headers=headers)
+    assert response.status_code == 200, response.text
+    contact_etag = response.headers["ETag"]
+    response = client.get(f"/api/contact/{contact_id}", headers={**headers, "If-None-Match": contact_etag})
+    assert response.status_code == 304, response.text
+
+    response = client.delete(f"/api/contact/{contact_id}", headers=headers)
+    assert response.status_code == 204, response.text
+    response = client.get("/api/contact/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
@@ -0,0 +1,63 @@
+from unittest.mock import patch
+
+
+def test_read_users_me(client, token, user):
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["email"] == user.get("email")
+    assert "password" not in data
+
+
+def test_read_users_me_cached(client, token, user):
+    from src.services.auth import auth_service
+
+    hits = auth_service.cache.local_hits
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert auth_service.cache.local_hits == hits + 1
+
+
+def test_read_users_me_invalid_token(client):
+    response = client.get("/api/users/me", headers={"Authorization": "Bearer invalid"})
+    assert response.status_code == 401, response.text
+
+
+def test_update_avatar(client, token, tmp_path):
+    import io
+
+    from PIL import Image
+
+    from src.services.avatars import LocalStorage
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (300, 300), "red").save(buffer, format="PNG")
+    storage = LocalStorage(str(tmp_path), "/media", size=250, variants=[250])
+    with patch("src.services.avatars.avatar_storage", storage):
+        response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {token}"},
+                                files={"file": ("avatar.png", buffer.getvalue(), "image/png")})
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"].startswith("/media/avatars/")
+
+
+def test_metrics(client, token):
+    client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    response = client.get("/metrics")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_requests_total{method="GET",route="/api/users/me",status="200"}' in response.text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/users/me",le="+Inf"}' in response.text
+    assert "db_pool_checkouts_total" in response.text
+    values = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+    assert float(values['password_hash_total{result="completed"}']) > 0
+    assert float(values['user_cache_lookups_total{result="local_hit"}']) > 0
+    assert float(values['auth_token_lookups_total{result="hit"}']) > 0
+    assert "auth_token_decode_seconds_saved" in values
+    for name in ("password_hash_queue_depth", 'rate_limit_requests_total{result="rejected"}', "email_queued"):
+        assert name in values
+
+
+def test_server_timing(client, token):
+    response = client.get("/api/users/me", headers={"Authorization": f"Bearer {token}"})
+    phases = [part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")]
+    assert "jwt" in phases and "user" in phases and "total" in phases
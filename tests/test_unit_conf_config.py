@@ -0,0 +1,24 @@
+import unittest
+
+from pydantic import ValidationError
+
+from src.conf.config import Settings
+
+
+class TestSettings(unittest.TestCase):
+
+    def test_server_timing_sample_rate_follows_environment(self):
+        self.assertEqual(Settings(_env_file=None).server_timing_sample_rate, 1.0)
+        self.assertEqual(Settings(_env_file=None, environment="production").server_timing_sample_rate, 0.01)
+
+    def test_explicit_server_timing_sample_rate_wins(self):
+        settings = Settings(_env_file=None, environment="production", server_timing_sample_rate=0.5)
+        self.assertEqual(settings.server_timing_sample_rate, 0.5)
+
+    def test_unknown_environment(self):
+        with self.assertRaises(ValidationError):
+            Settings(_env_file=None, environment="staging")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from src.database.db import LazySession, get_db
+
+
+class TestLazySession(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.checkouts = []
+        event.listen(self.engine.pool, "checkout", lambda *args: self.checkouts.append(args))
+        self.factory = MagicMock(side_effect=sessionmaker(bind=self.engine))
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_created_on_first_use(self):
+        db = LazySession(self.factory)
+        self.assertFalse(db.opened)
+        self.factory.assert_not_called()
+        self.assertEqual(db.execute(text("SELECT 1")).scalar(), 1)
+        db.execute(text("SELECT 2"))
+        self.assertTrue(db.opened)
+        self.factory.assert_called_once_with()
+        self.assertEqual(len(self.checkouts), 1)
+        db.close()
+
+    async def test_unused_get_db_takes_no_connection(self):
+        request = MagicMock(headers={})
+        with patch("src.database.db.DBSession", self.factory):
+            dependency = get_db(request)
+            db = await anext(dependency)
+            await dependency.aclose()
+        self.assertFalse(db.opened)
+        self.factory.assert_not_called()
+        self.assertEqual(self.checkouts, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError, TimeoutError as PoolTimeoutError
+
+from src.database.instrumentation import (PoolMonitor, QueryCounterMiddleware, TimedQueuePool, assert_max_queries,
+                                          db_checkouts, db_n_plus_one, db_queries, instrument_engine)
+
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        instrument_engine(self.engine)
+
+    async def call(self, app, path="/n-plus-one", route=None):
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            pass
+
+        middleware = QueryCounterMiddleware(app, n_plus_one_threshold=3)
+        await middleware({"type": "http", "method": "GET", "path": path, "route": route}, receive, send)
+
+    async def test_counts_queries_and_flags_repeats(self):
+        async def app(scope, receive, send):
+            with self.engine.connect() as conn:
+                for number in range(4):
+                    conn.execute(text("SELECT :n"), {"n": number})
+                conn.execute(text("SELECT 1"))
+
+        with self.assertLogs("src.database.instrumentation", "WARNING") as logs:
+            await self.call(app)
+        self.assertIn("4 runs of SELECT ?", logs.output[0])
+        self.assertEqual(db_n_plus_one.values[("unmatched",)], 1)
+        self.assertEqual(db_queries.values[("unmatched",)][-1], 5)
+
+    async def test_failed_statements(self):
+        async def app(scope, receive, send):
+            with self.engine.connect() as conn:
+                for _ in range(2):
+                    with self.assertRaises(OperationalError):
+                        conn.execute(text("SELECT * FROM missing"))
+                self.assertEqual(conn.info["query_start"], [])
+                conn.execute(text("SELECT 1"))
+
+        await self.call(app, route=MagicMock(path="/failing"))
+        self.assertEqual(db_queries.values[("/failing",)][-1], 3)
+
+    async def test_counts_checkouts(self):
+        async def uses_db(scope, receive, send):
+            for _ in range(2):
+                with self.engine.connect() as conn:
+                    conn.execute(text("SELECT 1"))
+
+        async def cached(scope, receive, send):
+            pass
+
+        await self.call(uses_db, route=MagicMock(path="/uses-db"))
+        await self.call(cached, route=MagicMock(path="/cached"))
+        # Buckets 0, 1, 2, 3, 5, 10, +Inf, then the sum
+        self.assertEqual(db_checkouts.values[("/uses-db",)], [0, 0, 1, 0, 0, 0, 0, 2])
+        self.assertEqual(db_checkouts.values[("/cached",)], [1, 0, 0, 0, 0, 0, 0, 0])
+
+    def test_assert_max_queries(self):
+        with assert_max_queries(self.engine, 2) as statements, self.engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(statements, ["SELECT 1"])
+        with self.assertRaises(AssertionError):
+            with assert_max_queries(self.engine, 1), self.engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                conn.execute(text("SELECT 2"))
+
+
+class TestPoolMonitor(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{Path(self.tmp.name, 'pool.db')}", poolclass=TimedQueuePool,
+                                    pool_size=1, max_overflow=0, pool_timeout=0.05)
+        self.monitor = PoolMonitor(self.engine, "test")
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp.cleanup()
+
+    async def test_snapshot(self):
+        async def app(scope, receive, send):
+            conn = self.engine.connect()
+            snapshot = self.monitor.snapshot(long_held=0)
+            with self.assertRaises(PoolTimeoutError):
+                self.engine.connect()
+            conn.close()
+            self.result = snapshot
+
+        async def receive():
+            return {"type": "http.request"}
+
+        await QueryCounterMiddleware(app)({"type": "http", "method": "GET", "path": "/api/contact/1",
+                                           "route": MagicMock(path="/api/contact/{contact_id}")}, receive, None)
+        self.assertEqual(self.result["checked_out"], 1)
+        self.assertEqual(self.result["idle"], 0)
+        self.assertEqual(self.result["long_held"][0]["route"], "/api/contact/{contact_id}")
+        snapshot = self.monitor.snapshot(long_held=0)
+        self.assertEqual((snapshot["checked_out"], snapshot["idle"], snapshot["long_held"]), (0, 1, []))
+        self.assertEqual(snapshot["timeouts"], 1)
+        self.assertEqual(snapshot["wait_seconds"]["count"], 2)
+        self.assertGreaterEqual(snapshot["wait_seconds"]["sum"], 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from redis.exceptions import RedisError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.database.db import get_db, get_read_db, identify, is_replica
+from src.database.replicas import ReplicaRouter
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.keys = {}
+
+    async def set(self, key, value, px=None):
+        self.keys[key] = value
+
+    async def exists(self, key):
+        return int(key in self.keys)
+
+
+class TestReplicaRouter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.engines = {name: create_engine(f"sqlite:///{Path(self.tmp.name, name)}.db")
+                        for name in ("replica1", "replica2")}
+        self.redis = FakeRedis()
+        self.router = ReplicaRouter(self.engines, sticky_seconds=5, sticky_size=10, check_interval=5,
+                                    client=self.redis)
+        self.request = MagicMock(headers={"authorization": "Bearer token"})
+        self.request.state.subject = "deadpool@example.com"
+        self.request.state.sticky = False
+
+    def tearDown(self):
+        for engine in self.engines.values():
+            engine.dispose()
+        self.tmp.cleanup()
+
+    def test_round_robin(self):
+        picked = [self.router.pick()[0] for _ in range(4)]
+        self.assertEqual(picked, ["replica1", "replica2", "replica1", "replica2"])
+
+    async def test_sticky_after_write(self):
+        await self.router.mark_write("deadpool@example.com")
+        self.assertTrue(await self.router.wrote_recently("deadpool@example.com"))
+        self.assertFalse(await self.router.wrote_recently("other@example.com"))
+        self.assertIsNone(self.router.pick(sticky=True))
+        self.assertIsNotNone(self.router.pick(sticky=False))
+
+    async def test_sticky_across_workers(self):
+        other_worker = ReplicaRouter(self.engines, sticky_seconds=5, sticky_size=10, check_interval=5,
+                                     client=self.redis)
+        await self.router.mark_write("deadpool@example.com")
+        self.assertEqual(self.redis.keys, {"sticky:deadpool@example.com": 1})
+        self.assertTrue(await other_worker.wrote_recently("deadpool@example.com"))
+        self.assertFalse(await other_worker.wrote_recently("other@example.com"))
+
+    async def test_primary_when_redis_fails(self):
+        self.router.client = MagicMock(exists=AsyncMock(side_effect=RedisError("down")),
+                                       set=AsyncMock(side_effect=RedisError("down")))
+        with self.assertLogs("src.database.replicas", "WARNING"):
+            await self.router.mark_write("deadpool@example.com")
+            self.assertTrue(await self.router.wrote_recently("other@example.com"))
+
+    async def test_check_ejects_and_readmits(self):
+        good = self.engines["replica1"]
+        self.engines["replica1"] = create_engine(f"sqlite:///{Path(self.tmp.name, 'missing', 'x')}.db")
+        await self.router.check()
+        self.assertEqual(self.router.healthy, ["replica2"])
+        self.assertEqual({self.router.pick()[0] for _ in range(3)}, {"replica2"})
+        self.engines["replica1"].dispose()
+        self.engines["replica1"] = good
+        await self.router.check()
+        self.assertEqual(self.router.healthy, ["replica1", "replica2"])
+
+    def test_primary_when_all_ejected(self):
+        self.router.eject("replica1", "down")
+        self.router.eject("replica2", "down")
+        self.assertIsNone(self.router.pick())
+
+    async def test_get_read_db(self):
+        primary = MagicMock()
+        with patch("src.database.db.replica_router", self.router), \
+                patch("src.database.db.DBSession", sessionmaker()):
+            dependency = get_read_db(self.request, primary=primary)
+            db = await anext(dependency)
+            self.assertFalse(is_replica(db))
+            self.assertIs(db.get_bind(), self.engines["replica1"])
+            self.assertTrue(is_replica(db))
+            await dependency.aclose()
+
+            dependency = get_db(self.request)
+            db = await anext(dependency)
+            db.commit()
+            await dependency.aclose()
+            self.assertTrue(await self.router.wrote_recently("deadpool@example.com"))
+
+            # The next request of the user, with any token, gets the primary session
+            await identify(self.request, "deadpool@example.com")
+            self.assertTrue(self.request.state.sticky)
+            dependency = get_read_db(self.request, primary=primary)
+            db = await anext(dependency)
+            db.execute("SELECT 1")
+            primary.execute.assert_called_once_with("SELECT 1")
+            self.assertFalse(is_replica(db))
+            await dependency.aclose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,25 @@
 import datetime
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from sqlalchemy import func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.sql.elements import and_
 
-from src.database.models import Contact, Users
+from src.database.models import Base, Contact, Users
 from src.repository.contacts import (
     get_contacts,
+    get_contacts_version,
+    get_contacts_with_version,
     get_contact_by_email,
     get_contact_by_id,
     get_contact_by_name,
     get_contact_by_surname,
     get_nearly_birthdays,
+    get_upcoming_birthdays,
+    search_contacts,
     create,
     update,
     remove
@@ -29,57 +35,57 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().limit().offset().all.return_value = contacts
+        self.session.execute().scalars().all.return_value = contacts
         result = await get_contacts(limit=10, offset=0, db=self.session, user_id=self.user.id)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_found(self):
         contact = Contact()
-        self.session.query().filter_by().filter_by().first.return_value = contact
+        self.session.execute().scalars().first.return_value = contact
         result = await get_contact_by_id(contact_id=1, db=self.session, user_id=self.user.id)
         self.assertEqual(result, contact)
 
     async def test_get_contact_not_found(self):
-        self.session.query().filter_by().filter_by().first.return_value = None
+        self.session.execute().scalars().first.return_value = None
         result = await get_contact_by_id(contact_id=1, db=self.session, user_id=self.user.id)
         self.assertIsNone(result)
 
     async def test_get_contact_by_name_found(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().filter_by().all.return_value = contacts
+        self.session.execute().scalars().all.return_value = contacts
         result = await get_contact_by_name(name='Name', db=self.session, user_id=self.user.id)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_by_name_not_found(self):
-        self.session.query().filter_by().filter_by().all.return_value = None
+        self.session.execute().scalars().all.return_value = None
         result = await get_contact_by_name(name='Name', db=self.session, user_id=self.user.id)
         self.assertIsNone(result)
 
     async def test_get_contact_by_surname_found(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().filter_by().all.return_value = contacts
+        self.session.execute().scalars().all.return_value = contacts
         result = await get_contact_by_surname(surname='Name', db=self.session, user_id=self.user.id)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_by_surname_not_found(self):
-        self.session.query().filter_by().filter_by().all.return_value = None
+        self.session.execute().scalars().all.return_value = None
         result = await get_contact_by_surname(surname='Name', db=self.session, user_id=self.user.id)
         self.assertIsNone(result)
 
     async def test_get_contact_by_email_found(self):
         contact = [Contact(), Contact(), Contact()]
-        self.session.query().filter_by().filter_by().first.return_value = contact
+        self.session.execute().scalars().first.return_value = contact
         result = await get_contact_by_email(email='Name', db=self.session, user_id=self.user.id)
         self.assertEqual(result, contact)
 
     async def test_get_contact_by_email_not_found(self):
-        self.session.query().filter_by().filter_by().first.return_value = None
+        self.session.execute().scalars().first.return_value = None
         result = await get_contact_by_email(email='Name', db=self.session, user_id=self.user.id)
         self.assertIsNone(result)
 
     async def test_get_nearly_birthdays(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().select_from().filter_by().filter().all.return_value = contacts
+        self.session.execute().scalars().all.return_value = contacts
         result = await get_nearly_birthdays(db=self.session, user_id=self.user.id)
         self.assertEqual(result, contacts)
 
@@ -106,12 +112,12 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     async def test_remove_contact_found(self):
         contact = Contact()
-        self.session.query().filter_by().filter_by().first.return_value = contact
+        self.session.execute().scalars().first.return_value = contact
         result = await remove(contact_id=1, user_id=self.user.id, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_remove_contact_not_found(self):
-        self.session.query().filter_by().filter_by().first.return_value = None
+        self.session.execute().scalars().first.return_value = None
         result = await remove(contact_id=1, user_id=self.user.id, db=self.session)
         self.assertIsNone(result)
 
@@ -128,7 +134,7 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             created_at=datetime.datetime(day=1, month=1, year=2019),
             updated_at=datetime.datetime(day=1, month=1, year=2019),
         )
-        self.session.query().filter_by().filter_by().first.return_value = contact
+        self.session.execute().scalars().first.return_value = contact
         result = await update(contact_id=1, body=body, user_id=self.user.id, db=self.session)
         self.assertEqual(result, contact)
 
@@ -145,10 +151,111 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
             created_at=datetime.datetime(day=1, month=1, year=2019),
             updated_at=datetime.datetime(day=1, month=1, year=2019),
         )
-        self.session.query().filter_by().filter_by().first.return_value = None
+        self.session.execute().scalars().first.return_value = None
         result = await update(contact_id=1, body=body, user_id=self.user.id, db=self.session)
         self.assertIsNone(result)
 
 
+class TestContactsAsyncSession(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+        self.body = ContactModel(
+            id=1,
+            name="name",
+            surname="surname",
+            phone="phone",
+            email="email@gmail.com",
+            birthday=datetime.date(day=1, month=1, year=2019),
+            description="description",
+            created_at=datetime.datetime(day=1, month=1, year=2019),
+            updated_at=datetime.datetime(day=1, month=1, year=2019),
+        )
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def test_create_and_get(self):
+        contact = await create(body=self.body, db=self.session, user_id=1)
+        result = await get_contact_by_id(contact_id=contact.id, db=self.session, user_id=1)
+        self.assertEqual(result.name, self.body.name)
+        result = await get_contacts(limit=10, offset=0, db=self.session, user_id=1)
+        self.assertEqual([c.id for c in result], [contact.id])
+
+    async def test_get_contacts_keyset(self):
+        ids = [(await create(body=self.body, db=self.session, user_id=1)).id for _ in range(5)]
+        await create(body=self.body, db=self.session, user_id=2)
+        first = await get_contacts(limit=2, offset=0, db=self.session, user_id=1)
+        second = await get_contacts(limit=2, offset=0, db=self.session, user_id=1, after_id=first[-1].id)
+        rest = await get_contacts(limit=2, offset=0, db=self.session, user_id=1, after_id=second[-1].id)
+        self.assertEqual([c.id for c in first + second + rest], ids)
+
+    async def test_get_contacts_version(self):
+        self.assertEqual(await get_contacts_version(db=self.session, user_id=1), (None, 0))
+        contacts, version = await get_contacts_with_version(limit=2, offset=0, db=self.session, user_id=1)
+        self.assertEqual((contacts, version), ([], None))
+        ids = [(await create(body=self.body, db=self.session, user_id=1)).id for _ in range(3)]
+        await create(body=self.body, db=self.session, user_id=2)
+        latest, count = await get_contacts_version(db=self.session, user_id=1)
+        self.assertEqual(count, 3)
+        self.assertIsNotNone(latest)
+        contacts, version = await get_contacts_with_version(limit=2, offset=0, db=self.session, user_id=1,
+                                                            after_id=ids[0])
+        self.assertEqual([c.id for c in contacts], ids[1:])
+        self.assertEqual(version, (latest, 3))
+
+    async def test_get_upcoming_birthdays_wraps_year(self):
+        for birthday in ["1990-12-20", "1985-01-02", "2000-12-30", "1970-01-10", "1999-12-28"]:
+            self.body.name = birthday
+            self.body.birthday = datetime.date.fromisoformat(birthday)
+            await create(body=self.body, db=self.session, user_id=1)
+        today = datetime.date(2023, 12, 28)
+        result = await get_upcoming_birthdays(days=7, db=self.session, user_id=1, today=today)
+        self.assertEqual([c.name for c in result], ["1999-12-28", "2000-12-30", "1985-01-02"])
+        result = await get_upcoming_birthdays(days=1, db=self.session, user_id=1, today=today)
+        self.assertEqual([c.name for c in result], ["1999-12-28"])
+
+    async def test_update_keeps_birthday_key(self):
+        contact = await create(body=self.body, db=self.session, user_id=1)
+        self.assertEqual(contact.birthday_key, 101)
+        self.body.birthday = datetime.date(1990, 7, 15)
+        contact = await update(contact_id=contact.id, body=self.body, db=self.session, user_id=1)
+        self.assertEqual(contact.birthday_key, 715)
+
+    async def test_search_contacts(self):
+        for name, surname, email, user_id in [("John", "Smith", "js@example.com", 1),
+                                              ("Johnny", "Cash", "cash@example.com", 1),
+                                              ("Mary", "Jane", "john.fan@example.com", 1),
+                                              ("John", "Other", "other@example.com", 2)]:
+            self.body.name, self.body.surname, self.body.email = name, surname, email
+            await create(body=self.body, db=self.session, user_id=user_id)
+        result = await search_contacts(q="joh", limit=10, db=self.session, user_id=1)
+        self.assertEqual(sorted(c.name for c in result), ["John", "Johnny", "Mary"])
+        result = await search_contacts(q="john smi", limit=10, db=self.session, user_id=1)
+        self.assertEqual([c.surname for c in result], ["Smith"])
+        await remove(contact_id=result[0].id, db=self.session, user_id=1)
+        result = await search_contacts(q="smith", limit=10, db=self.session, user_id=1)
+        self.assertEqual(result, [])
+        result = await search_contacts(q="*:()", limit=10, db=self.session, user_id=1)
+        self.assertEqual(result, [])
+
+    async def test_update_and_remove(self):
+        contact = await create(body=self.body, db=self.session, user_id=1)
+        self.body.name = "other"
+        with patch("src.repository.contacts.response_cache") as response_cache:
+            response_cache.bump = AsyncMock()
+            result = await update(contact_id=contact.id, body=self.body, db=self.session, user_id=1)
+            self.assertEqual(result.name, "other")
+            await remove(contact_id=contact.id, db=self.session, user_id=1)
+            self.assertEqual(response_cache.bump.await_count, 2)
+            response_cache.bump.assert_awaited_with(1)
+        result = await get_contact_by_id(contact_id=contact.id, db=self.session, user_id=1)
+        self.assertIsNone(result)
+
+
 if __name__ == '__main__':
     unittest.main()
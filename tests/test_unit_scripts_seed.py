@@ -0,0 +1,50 @@
+import random
+import unittest
+from unittest.mock import MagicMock
+from datetime import date
+
+from sqlalchemy import create_engine, func, select
+
+from scripts.seed import contact_counts, generate_contacts, seed, write_contacts
+from src.database.models import Base, Contact, Users
+
+
+class TestSeed(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        Base.metadata.create_all(self.engine)
+
+    def test_contact_counts(self):
+        counts = contact_counts(random.Random(1), 50, 10_000, 1.2)
+        self.assertEqual(len(counts), 50)
+        self.assertEqual(sum(counts), 10_000)
+        self.assertGreater(max(counts), 10_000 / 50 * 3)
+
+    def test_generate_contacts_is_deterministic(self):
+        first = list(generate_contacts(random.Random(7), [(1, 20), (2, 5)], date(2024, 1, 1)))
+        second = list(generate_contacts(random.Random(7), [(1, 20), (2, 5)], date(2024, 1, 1)))
+        self.assertEqual(first, second)
+        self.assertEqual([row[0] for row in first], [1] * 20 + [2] * 5)
+
+    def test_seed(self):
+        self.assertEqual(seed(self.engine, 10, 500, batch_size=128), (10, 500))
+        with self.engine.connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(Users)).scalar(), 10)
+            self.assertEqual(conn.execute(select(func.count()).select_from(Contact)).scalar(), 500)
+            self.assertIsNone(conn.execute(select(Contact).filter(Contact.birthday > date(2024, 1, 1))).first())
+
+    def test_copy_keeps_empty_strings(self):
+        conn = MagicMock()
+        conn.dialect.name, conn.dialect.driver = "postgresql", "psycopg2"
+        cursor = conn.connection.cursor.return_value
+        rows = list(generate_contacts(random.Random(3), [(1, 10)], date(2024, 1, 1)))
+        self.assertEqual(write_contacts(conn, rows, batch_size=100), 10)
+        sql, buffer = cursor.copy_expert.call_args.args
+        self.assertIn("FORCE_NOT_NULL (name, surname, phone, email, description)", sql)
+        self.assertEqual(len(buffer.getvalue().splitlines()), 10)
+        cursor.close.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from unittest.mock import patch
+
+from jose import JWTError, jwt
+
+from src.services.auth import Auth
+
+
+class TestDecodeAccessToken(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.auth = Auth()
+
+    async def test_second_decode_is_cached(self):
+        token = await self.auth.create_access_token({"sub": "deadpool@example.com"})
+        with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode:
+            first = self.auth.decode_access_token(token)
+            second = self.auth.decode_access_token(token)
+        decode.assert_called_once()
+        self.assertEqual(first, second)
+        self.assertEqual(first["sub"], "deadpool@example.com")
+        stats = self.auth.token_cache_stats()
+        self.assertEqual((stats["hits"], stats["decodes"]), (1, 1))
+        self.assertGreater(stats["decode_seconds_saved"], 0)
+
+    async def test_entry_expires_with_token(self):
+        token = await self.auth.create_access_token({"sub": "deadpool@example.com"}, expires_delta=60)
+        with patch("src.services.cache.time.monotonic", return_value=1000.0):
+            self.auth.decode_access_token(token)
+        with patch("src.services.cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(self.auth.token_cache.get(next(iter(self.auth.token_cache._data))))
+
+    async def test_invalid_token_is_not_cached(self):
+        token = await self.auth.create_access_token({"sub": "deadpool@example.com"})
+        for _ in range(2):
+            with self.assertRaises(JWTError):
+                self.auth.decode_access_token(token + "x")
+        self.assertEqual(len(self.auth.token_cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import io
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from PIL import Image
+
+from src.services.avatars import CloudinaryStorage, LocalStorage, update_avatar
+from src.services.cache import CachedUser
+
+
+def png(color="red", size=(400, 300)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class TestLocalStorage(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.tmp.name, "/media/", size=250, variants=[64])
+        self.user = CachedUser(id=1, username="deadpool", email="deadpool@example.com", avatar=None, confirmed=True)
+        self.db = AsyncMock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def test_writes_square_variants(self):
+        url = await self.storage.save(png(), self.user, "abc")
+        self.assertEqual(url, "/media/avatars/1/abc_250.png")
+        for size in (64, 250):
+            with Image.open(f"{self.tmp.name}/avatars/1/abc_{size}.png") as image:
+                self.assertEqual(image.size, (size, size))
+
+    async def test_update_avatar_skips_unchanged_image(self):
+        with patch("src.services.avatars.repository_users.update_avatar", new=AsyncMock()) as update:
+            update.side_effect = lambda email, url, db: CachedUser(1, "deadpool", email, url, True)
+            user = await update_avatar(self.user, png(), self.db, self.storage)
+            with patch.object(self.storage, "save", new=AsyncMock()) as save:
+                again = await update_avatar(user, png(), self.db, self.storage)
+            save.assert_not_awaited()
+            self.assertIs(again, user)
+            await update_avatar(user, png("blue"), self.db, self.storage)
+        self.assertEqual(update.await_count, 2)
+        self.assertEqual(len(os.listdir(f"{self.tmp.name}/avatars/1")), 2)
+        self.assertNotIn(user.avatar.rsplit("/", 1)[1], os.listdir(f"{self.tmp.name}/avatars/1"))
+
+    async def test_keeps_foreign_avatars(self):
+        user = CachedUser(id=1, username="deadpool", email="deadpool@example.com",
+                          avatar="https://www.gravatar.com/avatar/abc", confirmed=True)
+        with patch("src.services.avatars.repository_users.update_avatar", new=AsyncMock()), \
+                patch.object(self.storage, "_remove") as remove:
+            await update_avatar(user, png(), self.db, self.storage)
+        remove.assert_not_called()
+
+    async def test_rejects_decompression_bombs(self):
+        with patch.object(Image, "MAX_IMAGE_PIXELS", 1000):
+            with self.assertRaises(HTTPException) as err:
+                await update_avatar(self.user, png(size=(100, 100)), self.db, self.storage)
+        self.assertEqual(err.exception.status_code, 400)
+        self.assertEqual(err.exception.detail, "The image has too many pixels")
+
+    async def test_rejects_files_that_are_not_images(self):
+        with self.assertRaises(HTTPException) as err:
+            await update_avatar(self.user, b"not an image", self.db, self.storage)
+        self.assertEqual(err.exception.status_code, 400)
+
+
+class TestCloudinaryStorage(unittest.IsolatedAsyncioTestCase):
+
+    async def test_upload_runs_off_loop(self):
+        threads = []
+
+        def upload(file, **kwargs):
+            threads.append(threading.get_ident())
+            return {"version": 7}
+
+        with patch("src.services.avatars.cloudinary.config") as config:
+            storage = CloudinaryStorage("name", 1, "secret", size=250)
+        config.assert_called_once()
+        user = CachedUser(id=1, username="deadpool", email="deadpool@example.com", avatar=None, confirmed=True)
+        with patch("src.services.avatars.cloudinary.uploader.upload", side_effect=upload):
+            url = await storage.save(b"image", user, "abc")
+        self.assertNotEqual(threads, [threading.get_ident()])
+        self.assertIn("ContactsApp/deadpool1_abc", url)
+        self.assertIn("v7", url)
+
+    async def test_destroys_previous_asset(self):
+        with patch("src.services.avatars.cloudinary.config"):
+            storage = CloudinaryStorage("name", 1, "secret", size=250)
+        user = CachedUser(id=1, username="deadpool", email="deadpool@example.com", confirmed=True,
+                          avatar="https://res.cloudinary.com/name/image/upload/c_fill,h_250,w_250/v7/"
+                                 "ContactsApp/deadpool1_abc")
+        with patch("src.services.avatars.cloudinary.uploader.upload", return_value={"version": 8}), \
+                patch("src.services.avatars.cloudinary.uploader.destroy") as destroy, \
+                patch("src.services.avatars.repository_users.update_avatar", new=AsyncMock()):
+            await update_avatar(user, b"image", AsyncMock(), storage)
+            await storage.discard(user, "https://www.gravatar.com/avatar/abc")
+            await storage.discard(user, "https://res.cloudinary.com/name/image/upload/v1/ContactsApp/other2_abc")
+        destroy.assert_called_once_with("ContactsApp/deadpool1_abc", invalidate=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
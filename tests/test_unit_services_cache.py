@@ -0,0 +1,199 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import Response
+from redis.exceptions import ConnectionError
+
+from src.database.models import Users
+from src.services.cache import CachedUser, ResponseCache, TTLCache, UserCache
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+
+    def test_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        with patch("src.services.cache.time.monotonic", return_value=100.0):
+            cache.set("a", 1)
+            cache.set("b", 2, ttl=1)
+        with patch("src.services.cache.time.monotonic", return_value=130.0):
+            self.assertEqual((cache.get("a"), cache.get("b")), (1, None))
+        with patch("src.services.cache.time.monotonic", return_value=160.0):
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.mget = AsyncMock(return_value=[None, None])
+        self.client.register_script.return_value = AsyncMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.client.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.cache = UserCache(self.client, ttl=900, local_size=10, local_ttl=30)
+        self.user = Users(id=1, username="deadpool", email="deadpool@example.com", password="hash",
+                          refresh_token="token", avatar="url", confirmed=True)
+
+    def test_dto_round_trip_has_no_secrets(self):
+        cached = CachedUser.from_user(self.user)
+        self.assertEqual(CachedUser.loads(cached.dumps()), cached)
+        self.assertNotIn(b"hash", cached.dumps())
+        self.assertNotIn(b"token", cached.dumps())
+        self.assertIsNone(CachedUser.loads(b"[1, 2]"))
+
+    async def test_miss_fills_with_seen_version(self):
+        self.client.mget.return_value = [None, b"7"]
+        load = AsyncMock(return_value=self.user)
+        user = await self.cache.get_or_load("deadpool@example.com", load)
+        self.assertEqual(user, CachedUser.from_user(self.user))
+        self.cache._fill.assert_awaited_once_with(
+            keys=["user:deadpool@example.com", "user:deadpool@example.com:v"], args=[user.dumps(), "7", 900])
+
+    async def test_local_hit_skips_redis(self):
+        await self.cache.get_or_load("deadpool@example.com", AsyncMock(return_value=self.user))
+        user = await self.cache.get("deadpool@example.com")
+        self.assertEqual(user.id, 1)
+        self.client.mget.assert_awaited_once()
+        self.assertEqual(self.cache.stats()["local_hits"], 1)
+
+    async def test_redis_hit_fills_local(self):
+        self.client.mget.return_value = [CachedUser.from_user(self.user).dumps(), b"1"]
+        load = AsyncMock()
+        await self.cache.get_or_load("deadpool@example.com", load)
+        await self.cache.get("deadpool@example.com")
+        load.assert_not_awaited()
+        self.client.mget.assert_awaited_once()
+        self.assertEqual((self.cache.redis_hits, self.cache.local_hits), (1, 1))
+
+    async def test_redis_error_is_a_miss(self):
+        self.client.mget.side_effect = ConnectionError("down")
+        user = await self.cache.get_or_load("deadpool@example.com", AsyncMock(return_value=self.user))
+        self.assertEqual(user.id, 1)
+        self.cache._fill.assert_not_awaited()
+        self.assertEqual((self.cache.misses, self.cache.errors), (1, 1))
+
+    async def test_write_through_bumps_version_and_broadcasts(self):
+        cached = await self.cache.write_through(self.user)
+        self.client.pipeline.assert_called_once_with(transaction=True)
+        self.pipe.incr.assert_called_once_with("user:deadpool@example.com:v")
+        self.pipe.set.assert_called_once_with("user:deadpool@example.com", cached.dumps(), ex=900)
+        self.pipe.publish.assert_called_once_with(UserCache.channel,
+                                                  f"{self.cache.worker_id}:deadpool@example.com")
+        self.assertEqual(await self.cache.get("deadpool@example.com"), cached)
+
+    async def test_invalidate(self):
+        await self.cache.write_through(self.user)
+        await self.cache.invalidate("deadpool@example.com")
+        self.pipe.delete.assert_called_once_with("user:deadpool@example.com")
+        self.assertIsNone(await self.cache.get("deadpool@example.com"))
+
+
+    async def test_failed_write_drops_entry(self):
+        self.pipe.execute.side_effect = [ConnectionError("down"), None]
+        await self.cache.write_through(self.user)
+        self.pipe.delete.assert_called_once_with("user:deadpool@example.com")
+        self.assertEqual((self.cache.pending, self.cache.errors), (set(), 1))
+
+    async def test_failed_invalidation_is_retried(self):
+        self.pipe.execute.side_effect = ConnectionError("down")
+        await self.cache.write_through(self.user)
+        self.assertEqual(self.cache.pending, {"deadpool@example.com"})
+        self.cache.local.clear()
+        self.client.mget.return_value = [CachedUser.from_user(self.user).dumps(), b"1"]
+        load = AsyncMock(return_value=self.user)
+        await self.cache.get_or_load("deadpool@example.com", load)
+        load.assert_awaited_once()
+        self.client.mget.assert_not_awaited()
+        self.cache._fill.assert_not_awaited()
+
+        self.pipe.execute.side_effect = None
+        self.cache.reconnect_delay = 0
+        with patch("src.services.cache.asyncio.sleep", AsyncMock(side_effect=[None, None, asyncio.CancelledError])):
+            with self.assertRaises(asyncio.CancelledError):
+                await self.cache.retry_pending()
+        self.assertEqual(self.cache.pending, set())
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.client.register_script.return_value = AsyncMock(return_value=[b"3"])
+        self.client.set = AsyncMock()
+        self.client.incr = AsyncMock()
+        self.cache = ResponseCache(self.client, ttl=300, max_entry_size=100)
+
+    async def test_miss_returns_versioned_key(self):
+        key, response = await self.cache.get("contact_list", 1, (10, 0, None))
+        self.assertIsNone(response)
+        self.assertTrue(key.startswith("resp:{1}:3:contact_list:"))
+        self.cache._lookup.assert_awaited_once_with(keys=["resp:{1}:v"], args=["resp:{1}:", key[len("resp:{1}:3"):]])
+        other, _ = await self.cache.get("contact_list", 1, (10, 10, None))
+        self.assertNotEqual(key, other)
+
+    async def test_set_and_hit(self):
+        key, _ = await self.cache.get("contact_list", 1, (10, 0, None))
+        await self.cache.set(key, Response(b'[{"id":1}]', media_type="application/json", headers={"ETag": 'W/"a"'}))
+        stored = self.client.set.await_args.args[1]
+        self.assertEqual(self.client.set.await_args.kwargs, {"ex": 300})
+        self.cache._lookup.return_value = [b"3", stored]
+        _, response = await self.cache.get("contact_list", 1, (10, 0, None))
+        self.assertEqual(response.body, b'[{"id":1}]')
+        self.assertEqual(response.headers["etag"], 'W/"a"')
+        self.assertEqual(response.headers["content-type"], "application/json")
+        self.assertEqual(self.cache.stats()["hit_rate"], 0.5)
+
+    async def test_set_skips_large_and_failed_responses(self):
+        await self.cache.set("key", Response(b"x" * 101))
+        await self.cache.set("key", Response(b"x", status_code=404))
+        await self.cache.set(None, Response(b"x"))
+        self.client.set.assert_not_awaited()
+        self.assertEqual(self.cache.skipped, 1)
+
+    async def test_error_skips_cache_for_a_while(self):
+        self.cache._lookup.side_effect = ConnectionError("down")
+        self.assertEqual(await self.cache.get("contact_list", 1, ()), (None, None))
+        self.assertEqual(await self.cache.get("contact_list", 1, ()), (None, None))
+        self.cache._lookup.assert_awaited_once()
+        await self.cache.bump(1)
+        self.client.incr.assert_awaited_once_with("resp:{1}:v")
+
+    async def test_failed_bump_marks_user_dirty(self):
+        key, _ = await self.cache.get("contact_list", 1, ())
+        self.client.incr.side_effect = ConnectionError("down")
+        await self.cache.bump(1)
+        self.assertEqual(self.client.incr.await_count, ResponseCache.bump_attempts)
+        await self.cache.set(key, Response(b"[]"))
+        self.client.set.assert_not_awaited()
+        self.cache.down_until = 0
+        self.assertEqual(await self.cache.get("contact_list", 1, ()), (None, None))
+        self.cache.down_until = 0
+        self.assertIsNotNone((await self.cache.get("contact_list", 2, ()))[0])
+
+        # The next lookup bumps again, and once that gets through the cache is used again
+        self.client.incr.side_effect = None
+        self.cache.down_until = 0
+        key, _ = await self.cache.get("contact_list", 1, ())
+        self.assertIsNotNone(key)
+        self.assertEqual(self.cache.dirty, {})
+
+    async def test_dirty_user_expires_with_the_entries(self):
+        self.client.incr.side_effect = ConnectionError("down")
+        with patch("src.services.cache.time.monotonic", return_value=100.0):
+            await self.cache.bump(1)
+        with patch("src.services.cache.time.monotonic", return_value=401.0):
+            self.assertIsNotNone((await self.cache.get("contact_list", 1, ()))[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
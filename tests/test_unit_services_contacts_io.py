@@ -0,0 +1,139 @@
+import datetime
+import json
+import unittest
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, Contact
+from src.services.contacts_io import (LINE_TOO_LONG, MAX_RECORD_LINES, export_contacts, import_contacts, iter_lines,
+                                     parse_csv, parse_ndjson, parse_vcard)
+
+
+async def chunked(data: bytes, size: int = 7):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+CSV = (
+    'name,surname,email,phone,birthday,description\r\n'
+    'John,Smith,john@example.com,+380501234567,1990-05-01,"multi\nline"\n'
+    'Bad,Row,not-an-email,123,1990-05-01,\n'
+    'Mary,Jane,mary@example.com,555,1985-12-31,\n'
+).encode()
+
+VCARD = (
+    'BEGIN:VCARD\r\nVERSION:3.0\r\nN:Smith;John;;;\r\nFN:John Smith\r\n'
+    'EMAIL;TYPE=work:john@exam\r\n ple.com\r\nTEL:+380501234567\r\nBDAY:19900501\r\n'
+    'NOTE:line one\\nline two\\, ok\r\nEND:VCARD\r\n'
+).encode()
+
+
+class TestParsers(unittest.IsolatedAsyncioTestCase):
+
+    async def test_iter_lines_splits_across_chunks(self):
+        lines = await collect(iter_lines(chunked("﻿a\r\nbé\nc".encode(), size=1)))
+        self.assertEqual(lines, ["a", "bé", "c"])
+
+    async def test_iter_lines_drops_long_lines(self):
+        data = b"ab\n" + b"x" * 50 + b"\ncd\n" + b"y" * 20 + b"\nef\n" + b"z" * 50
+        lines = await collect(iter_lines(chunked(data, size=4), max_chars=10))
+        self.assertEqual(lines, ["ab", None, "cd", None, "ef", None])
+
+    async def test_parse_ndjson_long_line(self):
+        data = b'{"name": "' + b"x" * 100_000 + b'"}\n{"name": "John"}\n'
+        rows = await collect(parse_ndjson(iter_lines(chunked(data, size=4096))))
+        self.assertEqual(rows, [(1, None, LINE_TOO_LONG), (2, {"name": "John"}, None)])
+
+    async def test_parse_csv(self):
+        rows = await collect(parse_csv(iter_lines(chunked(CSV))))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0][1]["description"], "multi\nline")
+        self.assertEqual(rows[2][1]["name"], "Mary")
+
+    async def test_parse_csv_stray_quotes(self):
+        data = ('name,surname,description\n'
+                'John,5" tall,ok\n'
+                + 'Open,"quote,never closed\n'
+                + ''.join(f'Name{number},Surname,\n' for number in range(MAX_RECORD_LINES + 10))).encode()
+        rows = await collect(parse_csv(iter_lines(chunked(data, size=64))))
+        self.assertEqual(rows[0][1]["surname"], '5" tall')
+        self.assertEqual(rows[1][0], 2)
+        self.assertIn("quoted value longer than", rows[1][2])
+        self.assertEqual([record["name"] for _, record, _ in rows[2:]],
+                         [f"Name{number}" for number in range(MAX_RECORD_LINES + 10)])
+
+    async def test_parse_vcard(self):
+        rows = await collect(parse_vcard(iter_lines(chunked(VCARD))))
+        self.assertEqual(rows, [(1, {"surname": "Smith", "name": "John", "email": "john@example.com",
+                                     "phone": "+380501234567", "birthday": "1990-05-01",
+                                     "description": "line one\nline two, ok"}, None)])
+
+
+class TestImportContacts(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def test_import_csv(self):
+        report = await import_contacts(chunked(CSV), "csv", self.session, user_id=1, batch_size=1)
+        self.assertEqual((report["received"], report["inserted"], report["failed"]), (3, 2, 1))
+        self.assertEqual(report["errors"][0]["row"], 2)
+        contacts = (await self.session.execute(select(Contact).order_by(Contact.id))).scalars().all()
+        self.assertEqual([c.name for c in contacts], ["John", "Mary"])
+        self.assertEqual(contacts[1].birthday_key, 1231)
+        self.assertEqual(contacts[1].user_id, 1)
+
+    async def test_import_ndjson(self):
+        rows = [{"name": "A", "surname": "B", "email": f"a{i}@example.com", "phone": "1",
+                 "birthday": str(datetime.date(2000, 1, 1))} for i in range(5)]
+        data = ("\n".join(json.dumps(row) for row in rows) + "\n[1]\n{broken\n").encode()
+        report = await import_contacts(chunked(data), "ndjson", self.session, user_id=1, batch_size=2)
+        self.assertEqual((report["received"], report["inserted"], report["failed"]), (7, 5, 2))
+
+    async def test_export_round_trip(self):
+        await import_contacts(chunked(CSV), "csv", self.session, user_id=1, batch_size=10)
+        chunks = await collect(export_contacts(self.session, 1, "ndjson", batch_size=1))
+        self.assertEqual(len(chunks), 2)
+        exported = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+        self.assertEqual([(c["name"], c["birthday"]) for c in exported],
+                         [("John", "1990-05-01"), ("Mary", "1985-12-31")])
+        data = b"".join(await collect(export_contacts(self.session, 1, "csv", batch_size=1)))
+        report = await import_contacts(chunked(data), "csv", self.session, user_id=2, batch_size=10)
+        self.assertEqual((report["inserted"], report["failed"]), (2, 0))
+        data = b"".join(await collect(export_contacts(self.session, 2, "vcf", batch_size=1)))
+        rows = await collect(parse_vcard(iter_lines(chunked(data))))
+        self.assertEqual([(row[1]["name"], row[1].get("description")) for row in rows],
+                         [("John", "multi\nline"), ("Mary", None)])
+
+
+class TestExportSyncSession(unittest.IsolatedAsyncioTestCase):
+
+    async def test_export_with_sync_session(self):
+        engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        Base.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add_all([Contact(user_id=1, name=f"n{i}", surname="s", email="e@example.com", phone="1",
+                                     birthday=datetime.date(2000, 1, 1), description="") for i in range(3)])
+            session.commit()
+            chunks = await collect(export_contacts(session, 1, "csv", batch_size=2))
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[0].startswith(b"id,name,surname"))
+        self.assertEqual(b"".join(chunks).count(b"\n"), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
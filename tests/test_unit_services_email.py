@@ -0,0 +1,114 @@
+import asyncio
+import socket
+import unittest
+from email.message import EmailMessage
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import aiosmtplib
+import pytest
+
+from src.services import email as email_service
+from src.services.email import EmailDispatcher
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+
+class Handler:
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def make_dispatcher(port, **kwargs):
+    options = dict(hostname="127.0.0.1", port=port, username=None, password=None, use_tls=False,
+                   start_tls=False, validate_certs=False, workers=1, queue_size=10, batch_size=5,
+                   max_retries=2, retry_backoff=0, idle_timeout=30)
+    options.update(kwargs)
+    return EmailDispatcher(**options)
+
+
+class TestEmailDispatcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.handler = Handler()
+        port = free_port()
+        self.controller = aiosmtpd_controller.Controller(self.handler, hostname="127.0.0.1", port=port)
+        self.controller.start()
+        self.dispatcher = make_dispatcher(port)
+
+    def tearDown(self):
+        self.controller.stop()
+
+    async def test_send_email_reuses_connection(self):
+        self.dispatcher.start()
+        with patch.object(email_service, "email_dispatcher", self.dispatcher):
+            for number in range(3):
+                await email_service.send_email(f"user{number}@example.com", "deadpool", "http://testserver/")
+        await self.dispatcher.stop()
+        self.assertEqual(len(self.handler.messages), 3)
+        self.assertEqual(self.handler.messages[0].rcpt_tos, ["user0@example.com"])
+        self.assertIn(b"http://testserver/api/auth/confirmed_email/", self.handler.messages[0].content)
+        self.assertEqual(self.dispatcher.stats()["connections"], 1)
+        self.assertEqual(self.dispatcher.stats()["sent"], 3)
+
+    async def test_reconnects_after_idle_timeout(self):
+        self.dispatcher.idle_timeout = 0.05
+        self.dispatcher.start()
+        with patch.object(email_service, "email_dispatcher", self.dispatcher):
+            await email_service.send_email("user@example.com", "deadpool", "http://testserver/")
+            await asyncio.sleep(0.2)
+            await email_service.send_email("user@example.com", "deadpool", "http://testserver/")
+        await self.dispatcher.stop()
+        self.assertEqual(len(self.handler.messages), 2)
+        self.assertEqual(self.dispatcher.connections, 2)
+
+    async def test_worker_survives_unexpected_errors(self):
+        self.dispatcher.start()
+        with self.assertLogs("src.services.email", "ERROR"):
+            self.dispatcher.enqueue(EmailMessage())
+            with patch.object(email_service, "email_dispatcher", self.dispatcher):
+                await email_service.send_email("user@example.com", "deadpool", "http://testserver/")
+            await self.dispatcher.stop()
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertEqual((self.dispatcher.failed, self.dispatcher.sent, self.dispatcher.retries), (1, 1, 0))
+
+
+class TestEmailDispatcherRetries(unittest.IsolatedAsyncioTestCase):
+
+    async def test_retry_with_backoff(self):
+        smtp = MagicMock(is_connected=True)
+        smtp.connect = AsyncMock()
+        smtp.quit = AsyncMock()
+        smtp.send_message = AsyncMock(side_effect=[aiosmtplib.SMTPServerDisconnected("gone"), None])
+        dispatcher = make_dispatcher(25, retry_backoff=0.01)
+        with patch.object(dispatcher, "_client", return_value=smtp), \
+                patch("src.services.email.asyncio.sleep", new=AsyncMock()) as sleep:
+            await dispatcher._send(None, MagicMock())
+        sleep.assert_awaited_once_with(0.01)
+        self.assertEqual((dispatcher.sent, dispatcher.retries, dispatcher.connections), (1, 1, 2))
+
+    async def test_gives_up_after_max_retries(self):
+        dispatcher = make_dispatcher(25)
+        with patch.object(dispatcher, "_client", side_effect=OSError("refused")):
+            self.assertIsNone(await dispatcher._send(None, MagicMock()))
+        self.assertEqual((dispatcher.failed, dispatcher.retries), (1, 2))
+
+    def test_drops_when_queue_is_full(self):
+        dispatcher = make_dispatcher(25, queue_size=1)
+        self.assertTrue(dispatcher.enqueue(MagicMock()))
+        self.assertFalse(dispatcher.enqueue(MagicMock()))
+        self.assertEqual(dispatcher.dropped, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
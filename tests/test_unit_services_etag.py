@@ -0,0 +1,32 @@
+import unittest
+from datetime import datetime
+
+from src.services.etag import etag_matches, not_modified, weak_etag
+
+
+class TestEtag(unittest.TestCase):
+
+    def test_weak_etag(self):
+        etag = weak_etag(1, datetime(2023, 10, 1), 3)
+        self.assertRegex(etag, r'^W/"[0-9a-f]{16}"$')
+        self.assertEqual(etag, weak_etag(1, datetime(2023, 10, 1), 3))
+        self.assertNotEqual(etag, weak_etag(1, datetime(2023, 10, 1), 4))
+
+    def test_etag_matches(self):
+        etag = weak_etag(1)
+        self.assertTrue(etag_matches(etag, etag))
+        self.assertTrue(etag_matches(etag.removeprefix("W/"), etag))
+        self.assertTrue(etag_matches(f'"other", {etag}', etag))
+        self.assertTrue(etag_matches("*", etag))
+        self.assertFalse(etag_matches(None, etag))
+        self.assertFalse(etag_matches('W/"other"', etag))
+
+    def test_not_modified(self):
+        response = not_modified('W/"abc"')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], 'W/"abc"')
+        self.assertEqual(response.body, b"")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from src.services.metrics import Registry
+
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.registry = Registry(self.tmp.name)
+        self.requests = self.registry.counter("requests_total", "Requests.", ("route",))
+        self.latency = self.registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+        self.in_flight = self.registry.gauge("in_flight", "In flight.")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_render_prometheus_text(self):
+        self.requests.inc("/a")
+        self.requests.inc("/a")
+        self.latency.observe(0.05, "/a")
+        self.latency.observe(0.5, "/a")
+        self.latency.observe(5, "/a")
+        self.in_flight.inc()
+        text = self.registry.render()
+        self.assertIn("# TYPE requests_total counter\nrequests_total{route=\"/a\"} 2\n", text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="0.1"} 1\n', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="1.0"} 2\n', text)
+        self.assertIn('latency_seconds_bucket{route="/a",le="+Inf"} 3\n', text)
+        self.assertIn('latency_seconds_sum{route="/a"} 5.55\n', text)
+        self.assertIn('latency_seconds_count{route="/a"} 3\n', text)
+        self.assertIn("in_flight 1\n", text)
+
+    def test_label_values_are_escaped(self):
+        self.requests.inc('say "hi"\\')
+        self.assertIn('requests_total{route="say \\"hi\\"\\\\"} 1', self.registry.render())
+
+    def test_merges_snapshots_of_other_workers(self):
+        self.requests.inc("/a")
+        self.latency.observe(0.05, "/a")
+        other = {"requests_total": [[["/a"], 3], [["/b"], 1]], "latency_seconds": [[["/a"], [0, 1, 0, 0.5]]]}
+        Path(self.tmp.name, "1.json").write_text(json.dumps(other))
+        merged = self.registry.merged()
+        self.assertEqual(merged["requests_total"], {("/a",): 4, ("/b",): 1})
+        self.assertEqual(merged["latency_seconds"][("/a",)], [1, 1, 0, 0.55])
+
+    def test_ignores_stale_snapshots(self):
+        self.in_flight.inc()
+        Path(self.tmp.name, "1.json").write_text(json.dumps({"in_flight": [[[], 5]]}))
+        self.assertEqual(self.registry.merged()["in_flight"], {(): 6})
+        stale = time.time() - self.registry.STALE_INTERVALS * self.registry.flush_interval - 1
+        os.utime(Path(self.tmp.name, "1.json"), (stale, stale))
+        self.assertEqual(self.registry.merged()["in_flight"], {(): 1})
+
+    def test_updates_from_threads(self):
+        def work():
+            for _ in range(10_000):
+                self.requests.inc("/a")
+                self.latency.observe(0.5, "/a")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.requests.values[("/a",)], 40_000)
+        self.assertEqual(self.latency.values[("/a",)][:3], [0, 40_000, 0])
+
+    def test_flush_writes_own_snapshot(self):
+        self.requests.inc("/a")
+        self.registry.flush()
+        snapshot = json.loads(self.registry._path().read_text())
+        self.assertEqual(snapshot["requests_total"], [[["/a"], 1]])
+        self.assertEqual(self.registry.merged()["requests_total"], {("/a",): 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+import unittest
+
+from src.services.pagination import encode_cursor, decode_cursor
+
+
+class TestCursor(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(42)), 42)
+
+    def test_invalid_cursor(self):
+        for cursor in ("", "not-a-cursor", encode_cursor(1)[:-2]):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+
+from src.conf.config import settings
+from src.services.passwords import PasswordHasher, build_password_context
+
+
+def low_cost_context(scheme="bcrypt", rounds=4):
+    with patch.object(settings, "password_bcrypt_rounds", rounds), \
+            patch.object(settings, "password_argon2_memory_cost", 1024), \
+            patch.object(settings, "password_argon2_time_cost", 1):
+        return build_password_context(scheme)
+
+
+class TestPasswordHasher(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.hasher = PasswordHasher(low_cost_context(), workers=1, max_pending=2)
+
+    async def asyncTearDown(self):
+        self.hasher.shutdown()
+
+    async def test_hash_and_verify_off_loop(self):
+        with patch.object(self.hasher.context, "hash", side_effect=lambda password: threading.get_ident()):
+            self.assertNotEqual(await self.hasher.hash("secret"), threading.get_ident())
+        hashed = await self.hasher.hash("secret")
+        self.assertEqual(await self.hasher.verify_and_update("secret", hashed), (True, None))
+        self.assertEqual(await self.hasher.verify_and_update("wrong", hashed), (False, None))
+        self.assertEqual(self.hasher.stats()["in_flight"], 0)
+
+    async def test_upgrade_when_cost_changes(self):
+        hashed = await self.hasher.hash("secret")
+        self.hasher.context = low_cost_context(rounds=5)
+        verified, new_hash = await self.hasher.verify_and_update("secret", hashed)
+        self.assertTrue(verified)
+        self.assertTrue(new_hash.startswith("$2b$05$"))
+
+    async def test_upgrade_to_argon2(self):
+        hashed = await self.hasher.hash("secret")
+        self.hasher.context = low_cost_context(scheme="argon2")
+        verified, new_hash = await self.hasher.verify_and_update("secret", hashed)
+        self.assertTrue(verified)
+        self.assertTrue(new_hash.startswith("$argon2"))
+        self.assertEqual(await self.hasher.verify_and_update("secret", new_hash), (True, None))
+
+    async def test_rejects_when_full(self):
+        release = threading.Event()
+        self.hasher.context = type("Slow", (), {"hash": lambda _, password: release.wait(5)})()
+        pending = [asyncio.create_task(self.hasher.hash("secret")) for _ in range(2)]
+        await asyncio.sleep(0)
+        self.assertEqual(self.hasher.queue_depth, 1)
+        with self.assertRaises(HTTPException) as err:
+            await self.hasher.hash("secret")
+        self.assertEqual(err.exception.status_code, 503)
+        release.set()
+        await asyncio.gather(*pending)
+        self.assertEqual(self.hasher.rejected, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
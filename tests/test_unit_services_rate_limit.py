@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from redis.exceptions import ConnectionError
+
+from src.services.cache import CachedUser
+from src.services.rate_limit import RateLimiter
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        self.pipe = MagicMock()
+        self.pipe.execute = AsyncMock()
+        self.client.pipeline.return_value.__aenter__.return_value = self.pipe
+        self.limiter = RateLimiter(self.client, times=2, window=60, routes={"contact_import": 1},
+                                   tiers={"default": 1.0, "pro": 5.0}, user_tiers={"pro@example.com": "pro"},
+                                   sync_interval=1, max_buckets=2)
+        self.user = CachedUser(id=1, username="deadpool", email="deadpool@example.com", avatar=None, confirmed=True)
+
+    def test_limits_per_route_and_tier(self):
+        pro = CachedUser(id=2, username="pro", email="pro@example.com", avatar=None, confirmed=True)
+        self.assertEqual(self.limiter.limit_for("contact_list", self.user), 2)
+        self.assertEqual(self.limiter.limit_for("contact_import", self.user), 1)
+        self.assertEqual(self.limiter.limit_for("contact_list", pro), 10)
+
+    def test_bucket_empties_and_refills(self):
+        with patch("src.services.rate_limit.time.monotonic", return_value=100.0):
+            self.assertIsNone(self.limiter.hit("contact_list", self.user))
+            self.assertIsNone(self.limiter.hit("contact_list", self.user))
+            self.assertEqual(self.limiter.hit("contact_list", self.user), 30)
+            self.assertIsNone(self.limiter.hit("contact_import", self.user))
+        with patch("src.services.rate_limit.time.monotonic", return_value=130.0):
+            self.assertIsNone(self.limiter.hit("contact_list", self.user))
+        self.assertEqual(self.limiter.stats()["rejected"], 1)
+        self.assertEqual(self.limiter.pending, {("contact_list", 1): 3, ("contact_import", 1): 1})
+
+    def test_evicts_least_recently_used_bucket(self):
+        for route in ("a", "b", "c"):
+            self.limiter.hit(route, self.user)
+        self.assertEqual(list(self.limiter.buckets), [("b", 1), ("c", 1)])
+
+    async def test_sync_caps_bucket_by_shared_usage(self):
+        self.limiter.hit("contact_list", self.user)
+        self.pipe.execute.return_value = [2, True]
+        await self.limiter.sync()
+        self.pipe.incrby.assert_called_once()
+        self.assertEqual(self.pipe.incrby.call_args.args[1], 1)
+        self.assertEqual(self.limiter.pending, {})
+        self.assertIsNotNone(self.limiter.hit("contact_list", self.user))
+
+    async def test_sync_falls_back_to_local_limits(self):
+        self.limiter.hit("contact_list", self.user)
+        self.pipe.execute.side_effect = ConnectionError("down")
+        await self.limiter.sync()
+        self.assertTrue(self.limiter.local_only)
+        self.assertEqual(self.limiter.pending, {})
+        self.assertIsNone(self.limiter.hit("contact_list", self.user))
+        self.assertIsNotNone(self.limiter.hit("contact_list", self.user))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import json
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+
+from src.conf.config import settings
+from src.database.models import Contact
+from src.services.serialization import contacts_response
+
+
+class TestContactsResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.contacts = [Contact(id=i, name="Wade", surname="Wilson", email=f"wade{i}@example.com", phone="123",
+                                 birthday=date(1990, 2, 1), description="", user_id=1,
+                                 created_at=datetime(2023, 10, 1, 12, 0, 0, 5), updated_at=datetime(2023, 10, 2))
+                         for i in range(3)]
+
+    def test_fast_path_matches_validated_path(self):
+        fast = contacts_response(self.contacts, {"X-Next-Cursor": "abc"})
+        with patch.object(settings, "response_validation", True):
+            validated = contacts_response(self.contacts)
+        self.assertEqual(json.loads(fast.body), json.loads(validated.body))
+        self.assertEqual(fast.headers["X-Next-Cursor"], "abc")
+        self.assertEqual(fast.media_type, "application/json")
+        self.assertNotIn("user_id", json.loads(fast.body)[0])
+        self.assertEqual(json.loads(fast.body)[0]["created_at"], "2023-10-01T12:00:00.000005")
+
+
+if __name__ == '__main__':
+    unittest.main()
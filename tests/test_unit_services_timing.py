@@ -0,0 +1,52 @@
+import unittest
+from unittest.mock import patch
+
+from src.services import timing
+from src.services.timing import ServerTimingMiddleware, header_value, record, span
+
+
+class TestTiming(unittest.IsolatedAsyncioTestCase):
+
+    async def call(self, middleware):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware({"type": "http", "method": "GET", "path": "/"}, receive, send)
+        return dict(messages[0]["headers"])
+
+    async def app(self, scope, receive, send):
+        with span("db"):
+            record("redis", 0.002)
+        record("redis", 0.001)
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b""})
+
+    def test_outside_a_request_nothing_is_recorded(self):
+        with span("db"):
+            record("redis", 1)
+        self.assertIsNone(timing._timings.get())
+
+    def test_header_value(self):
+        self.assertEqual(header_value({"db": [0.0015, 2]}, 0.01), 'db;dur=1.50;desc="2x", total;dur=10.00')
+
+    async def test_middleware_adds_header(self):
+        headers = await self.call(ServerTimingMiddleware(self.app))
+        value = headers[b"server-timing"].decode()
+        self.assertIn('redis;dur=3.00;desc="2x"', value)
+        self.assertIn("db;dur=", value)
+        self.assertIn("total;dur=", value)
+        self.assertIsNone(timing._timings.get())
+
+    async def test_unsampled_requests_have_no_header(self):
+        with patch("src.services.timing.random.random", return_value=0.5):
+            headers = await self.call(ServerTimingMiddleware(self.app, sample_rate=0.1))
+        self.assertNotIn(b"server-timing", headers)
+
+
+if __name__ == '__main__':
+    unittest.main()